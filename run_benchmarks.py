@@ -0,0 +1,67 @@
+"""
+Runs the benchmarks against a test database and prints the results as JSON. The database is chosen with the DB
+environment variable in the same way as for the tests.
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+from settings import configure_settings
+
+# Configure the default settings
+configure_settings()
+
+import django  # noqa: E402
+django.setup()
+
+from django.db import connection  # noqa: E402
+from django.test.utils import setup_databases, teardown_databases  # noqa: E402
+
+from smart_manager.tests.benchmarks import run_benchmark  # noqa: E402
+
+
+def get_commit():
+    """
+    Returns the commit that is checked out, or None if it cannot be determined.
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(breadths, depths, repeat):
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        return {
+            'commit': get_commit(),
+            'database': connection.vendor,
+            'django': django.get_version(),
+            'python': sys.version.split()[0],
+            'repeat': repeat,
+            'benchmarks': [
+                run_benchmark(breadth, depth, batch_build=batch_build, repeat=repeat)
+                for breadth in breadths
+                for depth in depths
+                for batch_build in (False, True)
+            ],
+        }
+    finally:
+        teardown_databases(old_config, verbosity=0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--breadth', type=int, nargs='+', default=[10], help='the number of children of every node')
+    parser.add_argument('--depth', type=int, nargs='+', default=[1, 2], help='the depth of the tree templates')
+    parser.add_argument('--repeat', type=int, default=5, help='the number of times every benchmark is run')
+    parser.add_argument('--output', help='a file to write the results to instead of stdout')
+    args = parser.parse_args()
+
+    results = json.dumps(run_benchmarks(args.breadth, args.depth, args.repeat), indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(results + '\n')
+    else:
+        print(results)
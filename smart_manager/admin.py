@@ -1,9 +1,125 @@
 from django.contrib import admin
-from smart_manager.models import SmartManager
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils.functional import cached_property
+
+from smart_manager.models import SmartManager, SmartManagerObject
+
+
+# Unfiltered tables whose estimated number of rows is below this are counted exactly
+ESTIMATED_COUNT_THRESHOLD = 10000
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    A paginator that estimates the number of rows of large unfiltered tables on PostgreSQL from the statistics of
+    the table instead of counting them. Filtered querysets, small tables and other databases are counted exactly.
+    """
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is not None and not query.where and connections[self.object_list.db].vendor == 'postgresql':
+            with connections[self.object_list.db].cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE relname = %s', [self.object_list.model._meta.db_table])
+                row = cursor.fetchone()
+            if row is not None and row[0] >= ESTIMATED_COUNT_THRESHOLD:
+                return int(row[0])
+
+        return super(EstimatedCountPaginator, self).count
+
+
+class SmartManagerObjectInline(admin.TabularInline):
+    """
+    A read-only list of the objects managed by a smart manager, shown one page at a time.
+    """
+    model = SmartManagerObject
+    fields = ('model_obj_type', 'model_obj_id')
+    readonly_fields = ('model_obj_type', 'model_obj_id')
+    template = 'admin/smart_manager/smartmanagerobject_inline.html'
+    can_delete = False
+    extra = 0
+    per_page = 50
+    page_param = 'smo_page'
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_queryset(self, request):
+        return super(SmartManagerObjectInline, self).get_queryset(request).select_related(
+            'model_obj_type').order_by('id')
+
+    def get_formset(self, request, obj=None, **kwargs):
+        """
+        Returns a formset that only contains the objects of the page in the request.
+        """
+        try:
+            page_number = max(int(request.GET.get(self.page_param, 1)), 1)
+        except ValueError:
+            page_number = 1
+        per_page = self.per_page
+        page_param = self.page_param
+
+        def get_page_query_string(number):
+            # Other parameters of the page, such as the changelist filters, are kept
+            query = request.GET.copy()
+            query[page_param] = number
+            return '?' + query.urlencode()
+
+        class PaginatedFormSet(super(SmartManagerObjectInline, self).get_formset(request, obj, **kwargs)):
+            def get_queryset(self):
+                if not hasattr(self, '_paginated_queryset'):
+                    queryset = super(PaginatedFormSet, self).get_queryset()
+                    self.count = queryset.count()
+                    self.num_pages = max((self.count + per_page - 1) // per_page, 1)
+                    self.page_number = min(page_number, self.num_pages)
+                    self.previous_page_query_string = get_page_query_string(self.page_number - 1)
+                    self.next_page_query_string = get_page_query_string(self.page_number + 1)
+                    start = (self.page_number - 1) * per_page
+                    self._paginated_queryset = queryset[start:start + per_page]
+                return self._paginated_queryset
+
+        return PaginatedFormSet
 
 
 class SmartManagerAdmin(admin.ModelAdmin):
-    list_display = ('name', 'smart_manager_class', 'primary_obj_type', 'primary_obj_id')
+    """
+    Lists smart managers without loading their templates, which are deferred by the queryset of the manager.
+    The number of objects managed by each smart manager is counted in the query of the list.
+    """
+    list_display = (
+        'name', 'smart_manager_class', 'primary_obj_type', 'primary_obj_id', 'num_smart_manager_objs', 'build_status',
+    )
+    list_select_related = ('primary_obj_type',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    inlines = [SmartManagerObjectInline]
+    actions = ['queue_rebuild']
+
+    def get_queryset(self, request):
+        return super(SmartManagerAdmin, self).get_queryset(request).annotate(num_smart_manager_objs=Coalesce(Subquery(
+            SmartManagerObject.objects.filter(smart_manager=OuterRef('pk')).order_by().values(
+                'smart_manager').annotate(count=Count('*')).values('count'),
+            output_field=IntegerField(),
+        ), 0))
+
+    def num_smart_manager_objs(self, obj):
+        return obj.num_smart_manager_objs
+    num_smart_manager_objs.short_description = 'Managed objects'
+
+    def queue_rebuild(self, request, queryset):
+        """
+        Queues rebuilds of the selected smart managers with the build backend instead of rebuilding them in the
+        request.
+        """
+        num_queued = queryset.queue_rebuild()
+        self.message_user(request, 'Queued {0} smart managers for rebuilding.'.format(num_queued))
+    queue_rebuild.short_description = 'Queue a rebuild of the selected smart managers'
 
 
 admin.site.register(SmartManager, SmartManagerAdmin)
@@ -0,0 +1,34 @@
+import asyncio
+from functools import lru_cache, partial
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+
+@lru_cache(maxsize=None)
+def get_executor():
+    """
+    Returns the thread pool that runs the blocking work of the async API. The number of threads is set with the
+    SMART_MANAGER_ASYNC_WORKERS setting, and defaults to the default of ThreadPoolExecutor.
+    """
+    return ThreadPoolExecutor(max_workers=getattr(settings, 'SMART_MANAGER_ASYNC_WORKERS', None))
+
+
+def _call(func, args, kwargs):
+    """
+    Calls a function in a thread of the pool. Every thread has its own database connections, which are closed
+    after the call when they have reached their maximum age.
+    """
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_in_executor(func, *args, **kwargs):
+    """
+    Runs a blocking function in the thread pool without blocking the event loop. Functions that are run at the
+    same time are run concurrently in different threads.
+    """
+    return await asyncio.get_event_loop().run_in_executor(get_executor(), partial(_call, func, args, kwargs))
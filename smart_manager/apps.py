@@ -8,3 +8,7 @@ class SmartManagerConfig(AppConfig):
     def ready(self):
         import smart_manager.signal_handlers
         assert(smart_manager)
+
+        # Register the smart manager classes of installed apps
+        from smart_manager.registry import autodiscover
+        autodiscover()
@@ -1,25 +1,105 @@
 from copy import deepcopy
 
-from manager_utils import upsert
+from django.db import models
+
+from smart_manager.batch import UpsertBatch
+from smart_manager.context import BuildContext, BuiltObjs
+from smart_manager.subtrees import get_subtree_fingerprint
+from smart_manager.templates import BaseTemplateView, get_template_view
+from smart_manager.upsert import native_upsert_obj
 
 
 class BaseSmartManager(object):
+    # If True, build_obj queues its upserts and flushes them with one bulk upsert per model class. Objects
+    # returned by build_obj receive their pks when the build is flushed.
+    batch_build = False
+
+    # If True, when the smart manager is saved, the objects and their SmartManagerObject rows are written in chunks
+    # of stream_chunk_size objects instead of being kept until the end of the build. Streaming builds are batched.
+    stream_build = False
+    stream_chunk_size = 1000
+
+    # If True, saving a SmartManager of this class does not build its template. The SmartManager is marked as pending
+    # and its template is built by the build backend once the save has been committed
+    defer_build = False
+
+    # The template given to a builder is deep copied, so later changes to it do not reach the build. Streaming
+    # builders do not copy their template, so it can be consumed as an iterator. Child builders read the templates
+    # passed to build_using through copy-on-write views instead, which leave the template of the parent intact
+    # without copying it. If True, child builders also deep copy their templates
+    copy_template = False
+
+    # If True, build_obj upserts objects whose lookups match a unique constraint with a single INSERT ... ON CONFLICT
+    # statement on databases that support it. Native upserts do not call save or send the save signals of the model
+    native_upsert = False
+
     def __init__(self, template):
-        self._template = deepcopy(template)
-        self._built_objs = set()
+        if self.stream_build:
+            self._template = template
+        elif isinstance(template, BaseTemplateView) and not self.copy_template:
+            self._template = get_template_view(template)
+        else:
+            self._template = copy_template(template)
+        self._batch = UpsertBatch() if self.batch_build or self.stream_build else None
+
+        # The state shared by all builders in the build
+        self._context = BuildContext()
+
+        # The content type ids and pks of the objects built by this builder and its child builders
+        self._built_objs = BuiltObjs(self._context)
+
+        # The fingerprints of the subtrees built by the child builders of this builder
+        self._subtree_fingerprints = []
 
     @property
     def built_objs(self):
+        """
+        Returns the set of built objects. The objects are loaded without querying for them, and all of their
+        fields other than the pk are deferred.
+        """
+        return set(self.get_built_objs().get_model_objs())
+
+    def get_built_objs(self):
+        """
+        Returns the content type ids and pks of the built objects, flushing the build first if any of them
+        have not been written yet.
+        """
+        if self._built_objs.has_pending_model_objs:
+            self.flush()
+        self._built_objs.resolve()
         return self._built_objs
 
     def build_obj(self, model_class, is_deletable=True, updates=None, defaults=None, **kwargs):
         """
         Builds an object using the upsert function in manager utils. If the object can be deleted
         by the smart manager, it is added to the internal _built_objs list and returned.
+
+        In a batched build, the object is queued and returned without a pk. Lookups that span relationships
+        cannot be queued, so those objects are upserted right away. With native_upsert, objects are upserted
+        natively when the database and the lookups allow it.
         """
-        built_obj = upsert(model_class.objects, updates=updates, defaults=defaults, **kwargs)[0]
+        if self._batch is not None and not any('__' in field_name for field_name in kwargs):
+            builder_stats = self._context.stats.get_active_builder_stats() if self._context.stats is not None else None
+            built_obj = self._batch.add(
+                model_class, updates=updates, defaults=defaults, builder_stats=builder_stats, **kwargs)
+            if is_deletable:
+                self._built_objs.add(built_obj)
+            self._stream()
+            return built_obj
+
+        self.flush()
+        upserted = None
+        if self.native_upsert:
+            upserted = native_upsert_obj(model_class, kwargs, updates=updates, defaults=defaults)
+        if upserted is None:
+            upserted = upsert_obj(model_class, updates=updates, defaults=defaults, **kwargs)
+        built_obj, created, updated = upserted
+        if self._context.stats is not None:
+            self._context.stats.record_objs(
+                model_class, num_created=int(created), num_updated=int(updated),
+                num_unchanged=int(not created and not updated))
         if is_deletable:
-            self._built_objs |= set([built_obj])
+            self._built_objs.add(built_obj)
 
         return built_obj
 
@@ -27,17 +107,73 @@ class BaseSmartManager(object):
         """
         Builds objects using another builder and a template. Adds the resulting built objects
         from that builder to the built objects of this builder.
+
+        A batched builder shares its batch with batched child builders. Any other child builder is
+        built after the batch has been flushed, since it may depend on the pks of the queued objects.
+
+        When subtrees are recorded, a child builder whose class and template are unchanged since the previous
+        build is not built again. Its objects from the previous build are reused without any queries.
         """
-        smart_manager = smart_manager_class(template)
-        built_objs = smart_manager.build()
-        self._built_objs |= smart_manager.built_objs
+        subtree_recorder = self._context.subtree_recorder
+        subtree_fingerprint = None
+        if subtree_recorder is not None:
+            subtree_fingerprint = get_subtree_fingerprint(smart_manager_class, template)
+            reused_subtree = subtree_recorder.load(subtree_fingerprint, self._context)
+            if reused_subtree is not None:
+                self._subtree_fingerprints.append(subtree_fingerprint)
+                for built_obj_key in reused_subtree[0]:
+                    self._built_objs.add_key(*built_obj_key)
+                return reused_subtree[1]
+
+        # The child builder adds its built objects to the built objects of this builder in place, unless its
+        # subtree is recorded and it needs to keep track of its own built objects
+        smart_manager = smart_manager_class(get_template_view(template))
+        smart_manager._context = self._context
+        smart_manager._built_objs = self._built_objs if subtree_fingerprint is None else BuiltObjs(self._context)
+        if self._batch is not None and smart_manager.batch_build:
+            smart_manager._batch = self._batch
+        else:
+            self.flush()
+
+        built_objs = self._context.build(smart_manager)
+        if smart_manager._batch is not self._batch:
+            smart_manager.flush()
+
+        if smart_manager._built_objs is not self._built_objs:
+            self._built_objs.update(smart_manager._built_objs)
+        self._stream()
 
         # make sure build objs is a list or tuple
         if type(built_objs) not in (list, tuple,):
             built_objs = [built_objs]
 
+        if subtree_fingerprint is not None:
+            self._subtree_fingerprints.append(subtree_fingerprint)
+            subtree_recorder.record(subtree_fingerprint, smart_manager, built_objs)
+
         return built_objs
 
+    def _stream(self):
+        """
+        Writes the built objects to the stream of a streaming build once a chunk of objects has been queued.
+        """
+        stream = self._context.stream
+        if stream is None:
+            return
+
+        num_built_objs = self._built_objs.num_pks + (len(self._batch) if self._batch is not None else 0)
+        if num_built_objs >= stream.chunk_size:
+            self.flush()
+            stream.write(self._built_objs)
+
+    def flush(self):
+        """
+        Writes the queued objects of a batched build to the database. Builders can call this when they need
+        the pks of the objects they have built. Nothing happens for builds that are not batched.
+        """
+        if self._batch is not None:
+            self._batch.flush(self._context.stats)
+
     def build(self):
         """
         All builders must implement the build function, which returns the built object. All build
@@ -45,3 +181,42 @@ class BaseSmartManager(object):
         self.built_objs.
         """
         raise NotImplementedError
+
+
+def copy_template(template):
+    """
+    Deep copies a template. Model objects in the template are not copied, so a child template can point to an
+    object that receives its pk when a batched build is flushed. Template views are copied as the containers they
+    wrap.
+    """
+    memo = {}
+    values = [template]
+    while values:
+        value = values.pop()
+        if isinstance(value, models.Model):
+            memo[id(value)] = value
+        elif isinstance(value, dict):
+            values.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            values.extend(value)
+
+    return deepcopy(template, memo)
+
+
+def upsert_obj(model_class, updates=None, defaults=None, **kwargs):
+    """
+    Upserts an object with the same semantics as manager_utils.upsert. Returns the object and whether it was
+    created or updated.
+    """
+    defaults = dict(defaults or {})
+    defaults.update(updates or {})
+    model_obj, created = model_class.objects.get_or_create(defaults=defaults, **kwargs)
+
+    updated = updates is not None and not created and any(
+        getattr(model_obj, field_name) != value for field_name, value in updates.items())
+    if updated:
+        for field_name, value in updates.items():
+            setattr(model_obj, field_name, value)
+        model_obj.save(update_fields=updates)
+
+    return model_obj, created, updated
@@ -0,0 +1,279 @@
+from collections import OrderedDict
+from functools import reduce
+import operator
+
+from django.db import models
+from django.db.models import Q
+from manager_utils import post_bulk_operation
+
+from smart_manager.utils import bulk_update
+
+
+# The maximum number of lookups that are combined into a single query when fetching existing objects
+LOOKUP_CHUNK_SIZE = 250
+
+
+class QueuedObj(object):
+    """
+    An object that has been queued for upserting in a batch. The instance is the object that is handed back
+    to the builder. It receives its pk when the batch is flushed.
+    """
+    def __init__(self, instance, lookups, updates, builder_stats=None):
+        self.instance = instance
+        self.lookups = lookups
+        self.updates = dict(updates or {})
+
+        # The stats of the builder that queued the object in an instrumented build
+        self.builder_stats = builder_stats
+
+    def update(self, updates):
+        """
+        Merges the updates of another build_obj call for the same object.
+        """
+        self.updates.update(updates or {})
+        self.apply_updates()
+
+    def apply_updates(self):
+        for field_name, value in self.updates.items():
+            setattr(self.instance, field_name, value)
+
+    def copy_from(self, model_obj):
+        """
+        Loads the values of an existing row into the instance and applies the updates on top of them.
+        """
+        for field in model_obj._meta.concrete_fields:
+            value = getattr(model_obj, field.attname)
+            if field.is_relation and field.is_cached(self.instance) and value != getattr(self.instance, field.attname):
+                field.delete_cached_value(self.instance)
+            setattr(self.instance, field.attname, value)
+        self.instance._state.adding = False
+        self.instance._state.db = model_obj._state.db
+        self.apply_updates()
+
+    def has_pending_relations(self):
+        """
+        Returns True if the instance points to a related object that has not been saved yet.
+        """
+        return any(
+            related_obj is not None and related_obj.pk is None
+            for related_obj in _get_cached_related_objs(self.instance)
+        )
+
+    def resolve_relations(self):
+        """
+        Copies the pks of related objects onto the instance. This is needed for related objects that
+        were queued in the same batch and did not have a pk when they were assigned.
+        """
+        for field in self.instance._meta.concrete_fields:
+            if field.is_relation and field.is_cached(self.instance):
+                setattr(self.instance, field.attname, getattr(getattr(self.instance, field.name), 'pk', None))
+
+
+class UpsertBatch(object):
+    """
+    Queues the upserts of a build and flushes them with one bulk upsert per model class. Upserts of the
+    same object are merged, and objects that point to other queued objects are flushed after them.
+    """
+    def __init__(self):
+        # Queued objects keyed on the model class and lookup fields, then on the lookup values
+        self._queues = OrderedDict()
+
+    def __len__(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def add(self, model_class, updates=None, defaults=None, builder_stats=None, **kwargs):
+        """
+        Queues an upsert with the same semantics as manager_utils.upsert and returns the object that will
+        be upserted. The object receives its pk when the batch is flushed. The object is counted for the builder
+        of the builder stats when it is flushed, or for the builder that queued it first if it is queued again.
+        """
+        lookup_fields = tuple(sorted(kwargs))
+        queue = self._queues.setdefault((model_class, lookup_fields), OrderedDict())
+        key = tuple(_get_queue_key(kwargs[field_name]) for field_name in lookup_fields)
+
+        if key in queue:
+            queue[key].update(updates)
+        else:
+            init_kwargs = dict(defaults or {})
+            init_kwargs.update(updates or {})
+            init_kwargs.update(kwargs)
+            queue[key] = QueuedObj(model_class(**init_kwargs), kwargs, updates, builder_stats)
+
+        return queue[key].instance
+
+    def flush(self, stats=None):
+        """
+        Upserts all queued objects. Objects are flushed one model class at a time in an order where
+        related objects receive their pks before the objects that point to them. The numbers of created, updated
+        and unchanged objects are recorded in the stats of an instrumented build for the builders that queued them.
+        """
+        while self._queues:
+            ready = [
+                queue_key for queue_key, queue in self._queues.items()
+                if not any(queued_obj.has_pending_relations() for queued_obj in queue.values())
+            ]
+            if not ready:
+                raise ValueError('Queued objects point to unsaved objects that are not part of the batch')
+
+            for model_class, lookup_fields in ready:
+                queued_objs = list(self._queues.pop((model_class, lookup_fields)).values())
+                created_queued_objs, updated_queued_objs = _flush_queued_objs(model_class, lookup_fields, queued_objs)
+                if stats is not None:
+                    _record_queued_objs(stats, model_class, queued_objs, created_queued_objs, updated_queued_objs)
+
+
+def _record_queued_objs(stats, model_class, queued_objs, created_queued_objs, updated_queued_objs):
+    """
+    Records the numbers of created, updated and unchanged objects of a model class for each builder that queued them.
+    """
+    created_ids = set(id(queued_obj) for queued_obj in created_queued_objs)
+    updated_ids = set(id(queued_obj) for queued_obj in updated_queued_objs)
+    num_objs = OrderedDict()
+    for queued_obj in queued_objs:
+        builder_num_objs = num_objs.setdefault(id(queued_obj.builder_stats), [queued_obj.builder_stats, 0, 0, 0])
+        if id(queued_obj) in created_ids:
+            builder_num_objs[1] += 1
+        elif id(queued_obj) in updated_ids:
+            builder_num_objs[2] += 1
+        else:
+            builder_num_objs[3] += 1
+
+    for builder_stats, num_created, num_updated, num_unchanged in num_objs.values():
+        stats.record_objs(
+            model_class, num_created=num_created, num_updated=num_updated, num_unchanged=num_unchanged,
+            builder_stats=builder_stats)
+
+
+def _get_cached_related_objs(model_obj):
+    """
+    Returns the related objects that are assigned to the concrete relations of a model object.
+    """
+    return [
+        getattr(model_obj, field.name)
+        for field in model_obj._meta.concrete_fields
+        if field.is_relation and field.is_cached(model_obj)
+    ]
+
+
+def _get_queue_key(value):
+    """
+    Returns a hashable key for a lookup value. Unsaved model objects are keyed on their identity.
+    """
+    if isinstance(value, models.Model):
+        return (value.__class__, value.pk) if value.pk is not None else id(value)
+    return value
+
+
+def _get_lookup_value(model_class, field_name, value):
+    """
+    Normalizes a lookup value so that it can be compared with the value that is loaded from the database.
+    """
+    field = model_class._meta.get_field(field_name)
+    if isinstance(value, models.Model):
+        value = value.pk
+    if field.is_relation:
+        field = field.target_field
+    return field.to_python(value)
+
+
+def _get_lookup_key(model_class, lookup_fields, lookups):
+    return tuple(
+        _get_lookup_value(model_class, field_name, lookups[field_name])
+        for field_name in lookup_fields
+    )
+
+
+def _get_extant_model_objs(model_class, lookup_fields, queued_objs):
+    """
+    Fetches the existing objects that match the lookups of the queued objects and returns them keyed on their
+    lookup values.
+    """
+    extant_model_objs = {}
+    attnames = [model_class._meta.get_field(field_name).attname for field_name in lookup_fields]
+    for i in range(0, len(queued_objs), LOOKUP_CHUNK_SIZE):
+        lookup_filter = reduce(operator.or_, [
+            Q(**queued_obj.lookups) for queued_obj in queued_objs[i:i + LOOKUP_CHUNK_SIZE]
+        ])
+        for model_obj in model_class.objects.filter(lookup_filter):
+            key = _get_lookup_key(model_class, lookup_fields, dict(zip(lookup_fields, [
+                getattr(model_obj, attname) for attname in attnames
+            ])))
+            if key in extant_model_objs:
+                raise model_class.MultipleObjectsReturned(
+                    'Multiple {0} objects match the lookup {1}'.format(model_class.__name__, key))
+            extant_model_objs[key] = model_obj
+
+    return extant_model_objs
+
+
+def _update_extant_model_objs(model_class, queued_objs, extant_model_objs):
+    """
+    Copies the existing rows onto the queued objects and updates the rows that have changed. Returns the queued
+    objects that do not exist yet and the queued objects whose rows were updated.
+    """
+    model_objs_to_create = []
+    updated_queued_objs = []
+    model_objs_to_update = OrderedDict()
+    for key, queued_obj in queued_objs:
+        extant_model_obj = extant_model_objs.get(key)
+        if extant_model_obj is None:
+            model_objs_to_create.append(queued_obj)
+            continue
+
+        queued_obj.copy_from(extant_model_obj)
+        update_fields = [
+            model_class._meta.get_field(field_name) for field_name in sorted(queued_obj.updates)
+        ]
+        if any(
+            getattr(queued_obj.instance, field.attname) != getattr(extant_model_obj, field.attname)
+            for field in update_fields
+        ):
+            model_objs_to_update.setdefault(
+                tuple(field.name for field in update_fields), []).append(queued_obj.instance)
+            updated_queued_objs.append(queued_obj)
+
+    for field_names, model_objs in model_objs_to_update.items():
+        bulk_update(model_class, model_objs, list(field_names))
+
+    return model_objs_to_create, updated_queued_objs
+
+
+def _create_model_objs(model_class, lookup_fields, queued_objs):
+    """
+    Bulk creates the queued objects. Backends that cannot return the pks of bulk created objects have the pks
+    fetched using the lookups of the objects.
+    """
+    model_class.objects.bulk_create([queued_obj.instance for queued_obj in queued_objs])
+
+    queued_objs_without_pks = [queued_obj for queued_obj in queued_objs if queued_obj.instance.pk is None]
+    if queued_objs_without_pks:
+        created_model_objs = _get_extant_model_objs(model_class, lookup_fields, queued_objs_without_pks)
+        for queued_obj in queued_objs_without_pks:
+            created_model_obj = created_model_objs[_get_lookup_key(model_class, lookup_fields, queued_obj.lookups)]
+            queued_obj.instance.pk = created_model_obj.pk
+
+    for queued_obj in queued_objs:
+        queued_obj.instance._state.adding = False
+        queued_obj.instance._state.db = model_class.objects.db
+
+
+def _flush_queued_objs(model_class, lookup_fields, queued_objs):
+    """
+    Upserts a list of queued objects of the same model class that share the same lookup fields. Returns the
+    created and updated queued objects.
+    """
+    for queued_obj in queued_objs:
+        queued_obj.resolve_relations()
+
+    keyed_queued_objs = [
+        (_get_lookup_key(model_class, lookup_fields, queued_obj.lookups), queued_obj)
+        for queued_obj in queued_objs
+    ]
+    extant_model_objs = _get_extant_model_objs(model_class, lookup_fields, queued_objs)
+    queued_objs_to_create, updated_queued_objs = _update_extant_model_objs(
+        model_class, keyed_queued_objs, extant_model_objs)
+    if queued_objs_to_create:
+        _create_model_objs(model_class, lookup_fields, queued_objs_to_create)
+
+    post_bulk_operation.send(sender=model_class, model=model_class)
+    return queued_objs_to_create, updated_queued_objs
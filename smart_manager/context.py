@@ -0,0 +1,163 @@
+from collections import OrderedDict
+
+from django.db import router
+
+
+class BuildContext(object):
+    """
+    Holds the state that is shared by all builders in a build. Child builders receive the context of their
+    parent in build_using. The content type and pk attribute of every model class are resolved once per build.
+    """
+    def __init__(self, subtree_recorder=None):
+        # Records the subtrees built by child builders so that unchanged subtrees can be reused by later builds.
+        # Subtrees are only recorded when a recorder is set on the context of the builder at the root of a build
+        self.subtree_recorder = subtree_recorder
+
+        # Writes the built objects of a streaming build in chunks
+        self.stream = None
+
+        # Records the wall time, queries and object counts of an instrumented build
+        self.stats = None
+
+        # The content types and pk attribute names of the model classes in the build, keyed on the model classes
+        self._content_types = {}
+        self._pk_attnames = {}
+
+    def build(self, smart_manager):
+        """
+        Builds a builder, recording its stats if the build is instrumented.
+        """
+        if self.stats is None:
+            return smart_manager.build()
+        return self.stats.build(smart_manager)
+
+    def get_content_type(self, model_class):
+        """
+        Returns the content type of a model class. Proxy models have their own content types.
+        """
+        from django.contrib.contenttypes.models import ContentType
+        if model_class not in self._content_types:
+            self._content_types[model_class] = ContentType.objects.get_for_model(
+                model_class, for_concrete_model=False)
+        return self._content_types[model_class]
+
+    def get_model_class(self, content_type_id):
+        """
+        Returns the model class of a content type id, or None if the model or the content type no longer exist.
+        """
+        from django.contrib.contenttypes.models import ContentType
+        try:
+            return ContentType.objects.get_for_id(content_type_id).model_class()
+        except ContentType.DoesNotExist:
+            return None
+
+    def load_model_obj(self, content_type_id, pk):
+        """
+        Returns an instance of a model object without querying for it. All fields other than the pk are deferred
+        and loaded from the database when they are accessed. Returns None if the model no longer exists.
+        """
+        model_class = self.get_model_class(content_type_id)
+        if model_class is None:
+            return None
+        return model_class.from_db(router.db_for_read(model_class), [model_class._meta.pk.attname], [pk])
+
+    def get_pk(self, model_obj):
+        model_class = model_obj.__class__
+        if model_class not in self._pk_attnames:
+            self._pk_attnames[model_class] = model_class._meta.pk.attname
+        return getattr(model_obj, self._pk_attnames[model_class])
+
+    def get_model_obj_key(self, model_obj):
+        """
+        Returns a (content type id, pk) tuple for a model object.
+        """
+        return self.get_content_type(model_obj.__class__).id, self.get_pk(model_obj)
+
+
+class BuiltObjs(object):
+    """
+    The objects built by a builder, stored as pks grouped by content type id instead of model instances. Objects
+    that were queued in a batch are kept until they receive their pks when the batch is flushed.
+    """
+    def __init__(self, context):
+        self._context = context
+
+        # Sets of pks keyed on content type ids
+        self._pks = OrderedDict()
+
+        # Queued objects that may not have pks yet
+        self._pending_model_objs = []
+
+    def __len__(self):
+        self.resolve()
+        return sum(len(pks) for pks in self._pks.values()) + len(self._pending_model_objs)
+
+    def __iter__(self):
+        """
+        Iterates over the (content type id, pk) tuples of the built objects.
+        """
+        self.resolve()
+        for content_type_id, pks in self._pks.items():
+            for pk in pks:
+                yield content_type_id, pk
+
+    @property
+    def num_pks(self):
+        """
+        The number of built objects with pks, not counting queued objects that have not been resolved yet.
+        """
+        return sum(len(pks) for pks in self._pks.values())
+
+    @property
+    def has_pending_model_objs(self):
+        return bool(self._pending_model_objs)
+
+    def add(self, model_obj):
+        if self._context.get_pk(model_obj) is None:
+            self._pending_model_objs.append(model_obj)
+        else:
+            self.add_key(*self._context.get_model_obj_key(model_obj))
+
+    def add_key(self, content_type_id, pk):
+        self._pks.setdefault(content_type_id, set()).add(pk)
+
+    def update(self, built_objs):
+        """
+        Merges other built objects into these built objects in place.
+        """
+        for content_type_id, pks in built_objs._pks.items():
+            self._pks.setdefault(content_type_id, set()).update(pks)
+        self._pending_model_objs.extend(built_objs._pending_model_objs)
+
+    def clear(self):
+        """
+        Removes the built objects that have pks.
+        """
+        self.resolve()
+        self._pks = OrderedDict()
+
+    def resolve(self):
+        """
+        Replaces the queued objects that have received their pks with their keys.
+        """
+        if self._pending_model_objs:
+            pending_model_objs, self._pending_model_objs = self._pending_model_objs, []
+            for model_obj in pending_model_objs:
+                self.add(model_obj)
+
+    def group(self):
+        """
+        Returns the sets of pks of the built objects keyed on their content type ids.
+        """
+        self.resolve()
+        return self._pks
+
+    def get_model_objs(self):
+        """
+        Returns instances of the built objects without querying for them. Objects that do not have pks yet are
+        returned as they are.
+        """
+        self.resolve()
+        return [
+            self._context.load_model_obj(content_type_id, pk) for content_type_id, pk in self
+        ] + self._pending_model_objs
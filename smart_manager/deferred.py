@@ -0,0 +1,92 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import threading
+import traceback
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils.module_loading import import_string
+
+
+# The backend that runs deferred builds unless the SMART_MANAGER_BUILD_BACKEND setting names another one
+DEFAULT_BUILD_BACKEND = 'smart_manager.deferred.ThreadPoolBuildBackend'
+
+
+def build_deferred_smart_manager(smart_manager_id, force_rebuild=False):
+    """
+    Builds a smart manager whose build was deferred. The latest template of the smart manager is built, so
+    several saves that were made before the build runs are built once. If the build fails, the smart manager is
+    marked as failed with the error.
+    """
+    from smart_manager.models import SmartManager
+    smart_manager = SmartManager.objects.with_templates(built_subtrees=not force_rebuild).filter(
+        id=smart_manager_id).first()
+    if smart_manager is None:
+        return
+
+    try:
+        with transaction.atomic():
+            smart_manager.save(force_rebuild=force_rebuild, defer_build=False)
+    except Exception:
+        SmartManager.objects.filter(id=smart_manager_id).update(
+            build_status=SmartManager.FAILED, build_error=traceback.format_exc())
+
+
+class BaseBuildBackend(object):
+    """
+    Build backends run the deferred builds of smart managers. Builds are enqueued once the transaction that
+    saved the smart manager has been committed.
+    """
+    def enqueue(self, smart_manager_id, force_rebuild=False):
+        raise NotImplementedError
+
+
+class SynchronousBuildBackend(BaseBuildBackend):
+    """
+    Runs deferred builds as soon as they are enqueued. This is useful in tests.
+    """
+    def enqueue(self, smart_manager_id, force_rebuild=False):
+        build_deferred_smart_manager(smart_manager_id, force_rebuild=force_rebuild)
+
+
+class ThreadPoolBuildBackend(BaseBuildBackend):
+    """
+    Runs deferred builds in a pool of threads in the current process. A smart manager that is enqueued again
+    before its build has started is only built once.
+    """
+    def __init__(self, max_workers=None):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        # The force_rebuild flags of the smart managers that are waiting to be built, keyed on their ids
+        self._queued = {}
+        self._lock = threading.Lock()
+
+    def enqueue(self, smart_manager_id, force_rebuild=False):
+        with self._lock:
+            if smart_manager_id in self._queued:
+                self._queued[smart_manager_id] = self._queued[smart_manager_id] or force_rebuild
+                return
+            self._queued[smart_manager_id] = force_rebuild
+
+        self._executor.submit(self._build, smart_manager_id)
+
+    def _build(self, smart_manager_id):
+        with self._lock:
+            force_rebuild = self._queued.pop(smart_manager_id)
+
+        try:
+            build_deferred_smart_manager(smart_manager_id, force_rebuild=force_rebuild)
+        finally:
+            # Every thread has its own connections, which are closed once the build is done
+            connections.close_all()
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+@lru_cache(maxsize=None)
+def get_build_backend():
+    """
+    Returns the backend that runs deferred builds, which is loaded from the SMART_MANAGER_BUILD_BACKEND setting.
+    """
+    return import_string(getattr(settings, 'SMART_MANAGER_BUILD_BACKEND', DEFAULT_BUILD_BACKEND))()
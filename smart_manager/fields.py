@@ -0,0 +1,109 @@
+import base64
+import json
+import zlib
+
+from django.conf import settings
+from django.db import NotSupportedError
+from django.db.models import Func, Lookup
+from jsonfield import JSONField
+
+
+# The key of the JSON object that holds a compressed template
+COMPRESSED_TEMPLATE_KEY = '__zlib__'
+
+
+def get_template_compression_threshold():
+    """
+    Returns the length of template JSON above which templates are stored compressed, or None if templates are not
+    compressed.
+    """
+    return getattr(settings, 'SMART_MANAGER_TEMPLATE_COMPRESSION_THRESHOLD', None)
+
+
+def compress_template(template_json):
+    """
+    Compresses the JSON of a template into a JSON object that holds the base64 encoded zlib data.
+    """
+    return json.dumps({
+        COMPRESSED_TEMPLATE_KEY: base64.b64encode(zlib.compress(template_json.encode('utf-8'))).decode('ascii'),
+    })
+
+
+def decompress_template(value):
+    """
+    Returns the template in a decoded JSON value, which is the value itself unless it is a compressed template.
+    """
+    if isinstance(value, dict) and len(value) == 1 and COMPRESSED_TEMPLATE_KEY in value:
+        return json.loads(zlib.decompress(base64.b64decode(value[COMPRESSED_TEMPLATE_KEY])).decode('utf-8'))
+    return value
+
+
+class TemplateField(JSONField):
+    """
+    A JSON field for templates. On PostgreSQL, templates are stored as jsonb so that they can be filtered with
+    containment queries that use a GIN index. Other databases store templates as JSON text.
+
+    Templates whose JSON is longer than the SMART_MANAGER_TEMPLATE_COMPRESSION_THRESHOLD setting are stored
+    compressed, and they are decompressed when they are loaded. Templates are not compressed by default.
+    """
+    def db_type(self, connection):
+        if connection.vendor == 'postgresql':
+            return 'jsonb'
+        return super(TemplateField, self).db_type(connection)
+
+    def get_prep_value(self, value):
+        template_json = super(TemplateField, self).get_prep_value(value)
+        threshold = get_template_compression_threshold()
+        if template_json is not None and threshold is not None and len(template_json) > threshold:
+            return compress_template(template_json)
+        return template_json
+
+    def from_db_value(self, value, expression, connection):
+        # Values of jsonb columns are decoded by psycopg2
+        if connection.vendor != 'postgresql':
+            value = super(TemplateField, self).from_db_value(value, expression, connection)
+        return decompress_template(value)
+
+
+@TemplateField.register_lookup
+class JSONBContains(Lookup):
+    """
+    Filters templates that contain a JSON value with the jsonb @> operator. Only PostgreSQL supports it.
+    """
+    lookup_name = 'jsonb_contains'
+
+    # The value is encoded as JSON here, since the field would compress large values
+    prepare_rhs = False
+
+    def get_db_prep_lookup(self, value, connection):
+        return '%s', [json.dumps(value, **self.lhs.output_field.dump_kwargs)]
+
+    def as_sql(self, compiler, connection):
+        raise NotSupportedError('The jsonb_contains lookup is only supported on PostgreSQL')
+
+    def as_postgresql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return '{0} @> {1}::jsonb'.format(lhs, rhs), lhs_params + rhs_params
+
+
+class JSONExtract(Func):
+    """
+    Extracts the value at a path of a JSON text column with the json_extract function of SQLite.
+    """
+    function = 'json_extract'
+
+
+def json_contains(data, value):
+    """
+    Returns True if a decoded JSON value contains another one, with the semantics of the jsonb @> operator.
+    Objects contain the keys of other objects with values that they contain, and arrays contain arrays whose
+    elements are each contained by one of their elements.
+    """
+    if isinstance(value, dict):
+        return isinstance(data, dict) and all(
+            key in data and json_contains(data[key], key_value) for key, key_value in value.items())
+    if isinstance(value, list):
+        return isinstance(data, list) and all(
+            any(json_contains(item, element) for item in data) for element in value)
+    return isinstance(data, bool) == isinstance(value, bool) and data == value
@@ -0,0 +1,177 @@
+from collections import defaultdict
+from contextlib import contextmanager, ExitStack
+from time import perf_counter
+
+from django.db import connections
+
+from smart_manager.registry import get_smart_manager_class_path
+from smart_manager.signals import build_finished
+
+
+# The collectors that receive the stats of every instrumented build
+_collectors = []
+
+
+class BuilderStats(object):
+    """
+    The number of builds of a builder class, their wall time in seconds and number of queries, and the number of
+    objects that the builder created, updated or left unchanged with build_obj. The wall time and queries of a builder
+    include those of its child builders, but the objects of the child builders are only counted for them.
+    """
+    def __init__(self):
+        self.num_builds = 0
+        self.duration = 0.0
+        self.num_queries = 0
+        self.num_created = 0
+        self.num_updated = 0
+        self.num_unchanged = 0
+
+
+class ModelStats(object):
+    """
+    The number of objects of a model class that were created, updated or left unchanged by build_obj.
+    """
+    def __init__(self):
+        self.num_created = 0
+        self.num_updated = 0
+        self.num_unchanged = 0
+
+
+class BuildStats(object):
+    """
+    The stats of a build, with the stats of its builders keyed on their class paths and the stats of the objects
+    they built keyed on their model labels.
+    """
+    def __init__(self):
+        self.duration = 0.0
+        self.num_queries = 0
+        self.builders = defaultdict(BuilderStats)
+        self.models = defaultdict(ModelStats)
+
+        # The stats of the builders that are being built, with the innermost builder last
+        self._active_builder_stats = []
+
+    def count_query(self, execute, sql, params, many, context):
+        """
+        A database execute wrapper that counts the queries of the build.
+        """
+        self.num_queries += 1
+        return execute(sql, params, many, context)
+
+    def build(self, smart_manager):
+        """
+        Builds a builder and records its wall time and number of queries. The objects that are recorded during the
+        build are counted for the builder unless they were built by one of its child builders.
+        """
+        builder_stats = self.builders[get_smart_manager_class_path(smart_manager.__class__)]
+        start_time, num_queries = perf_counter(), self.num_queries
+        self._active_builder_stats.append(builder_stats)
+        try:
+            built_objs = smart_manager.build()
+        finally:
+            self._active_builder_stats.pop()
+
+        builder_stats.num_builds += 1
+        builder_stats.duration += perf_counter() - start_time
+        builder_stats.num_queries += self.num_queries - num_queries
+        return built_objs
+
+    def get_active_builder_stats(self):
+        """
+        Returns the stats of the builder that is being built, or None outside of builds.
+        """
+        return self._active_builder_stats[-1] if self._active_builder_stats else None
+
+    def record_objs(self, model_class, num_created=0, num_updated=0, num_unchanged=0, builder_stats=None):
+        """
+        Records the objects of a model class that were created, updated or left unchanged. The objects are counted
+        for the builder of the given builder stats, or else for the builder that is being built.
+        """
+        builder_stats = builder_stats or self.get_active_builder_stats()
+        for obj_stats in [self.models[model_class._meta.label], builder_stats]:
+            if obj_stats is not None:
+                obj_stats.num_created += num_created
+                obj_stats.num_updated += num_updated
+                obj_stats.num_unchanged += num_unchanged
+
+    def as_dict(self):
+        return {
+            'duration': self.duration,
+            'num_queries': self.num_queries,
+            'builders': {class_path: vars(builder_stats) for class_path, builder_stats in self.builders.items()},
+            'models': {label: vars(model_stats) for label, model_stats in self.models.items()},
+        }
+
+
+class BaseCollector(object):
+    """
+    Collectors receive the stats of every instrumented build once it has finished.
+    """
+    def collect(self, smart_managers, stats):
+        raise NotImplementedError
+
+
+class InMemoryCollector(BaseCollector):
+    """
+    Keeps the stats of every build in a list.
+    """
+    def __init__(self):
+        self.stats = []
+
+    def collect(self, smart_managers, stats):
+        self.stats.append(stats)
+
+    def clear(self):
+        self.stats = []
+
+
+def add_collector(collector):
+    _collectors.append(collector)
+
+
+def remove_collector(collector):
+    _collectors.remove(collector)
+
+
+@contextmanager
+def collect_build_stats():
+    """
+    Collects the stats of the builds that finish inside the context with an in memory collector.
+    """
+    collector = InMemoryCollector()
+    add_collector(collector)
+    try:
+        yield collector
+    finally:
+        remove_collector(collector)
+
+
+def is_instrumented():
+    """
+    Returns True if there is a collector or a receiver of the build_finished signal.
+    """
+    return bool(_collectors) or build_finished.has_listeners()
+
+
+@contextmanager
+def instrument_build(sender, smart_managers):
+    """
+    Records the stats of the build of smart managers inside the context. The stats are yielded so that they can be
+    passed to the build, and are sent to the collectors and the build_finished signal when the build finishes.
+    None is yielded when there is nothing to send the stats to, so builds are not instrumented at all.
+    """
+    if not is_instrumented():
+        yield None
+        return
+
+    stats = BuildStats()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(stats.count_query))
+        start_time = perf_counter()
+        yield stats
+        stats.duration = perf_counter() - start_time
+
+    for collector in list(_collectors):
+        collector.collect(smart_managers, stats)
+    build_finished.send(sender=sender, smart_managers=smart_managers, stats=stats)
@@ -0,0 +1,168 @@
+from collections import deque
+import json
+from multiprocessing import Pool
+import os
+from time import perf_counter
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from smart_manager.models import SmartManager, rebuild_smart_managers
+
+
+def get_chunks(queryset, chunk_size):
+    """
+    Iterates over the ids of the smart managers in a queryset in chunks, ordered by id.
+    """
+    chunk = []
+    for smart_manager_id in queryset.order_by('id').values_list('id', flat=True).iterator(chunk_size=chunk_size):
+        chunk.append(smart_manager_id)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def rebuild_chunk(smart_manager_ids):
+    """
+    Rebuilds a chunk of smart managers at once. If the chunk cannot be rebuilt, every smart manager is rebuilt on
+    its own so that only the smart managers that fail are skipped. Returns the ids of the chunk and a list of
+    (id, error) tuples for the smart managers that could not be rebuilt.
+    """
+    try:
+        with transaction.atomic():
+            rebuild_smart_managers(list(
+                SmartManager.objects.with_templates().filter(id__in=smart_manager_ids).order_by('id')))
+        return smart_manager_ids, []
+    except Exception:
+        pass
+
+    errors = []
+    for smart_manager in SmartManager.objects.with_templates().filter(id__in=smart_manager_ids).order_by('id'):
+        try:
+            with transaction.atomic():
+                rebuild_smart_managers([smart_manager])
+        except Exception as e:
+            errors.append((smart_manager.id, '{0}: {1}'.format(e.__class__.__name__, e)))
+
+    return smart_manager_ids, errors
+
+
+def imap_bounded(pool, func, iterable, max_pending):
+    """
+    Maps a function over an iterable with a process pool and yields the results in order. At most max_pending
+    items are submitted at once, so the iterable is consumed as the results come in.
+    """
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+
+    while pending:
+        yield pending.popleft().get()
+
+
+def load_checkpoint(path):
+    if path is None or not os.path.exists(path):
+        return {'last_id': None, 'errors': []}
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_checkpoint(path, checkpoint):
+    """
+    Writes a checkpoint to a temporary file that replaces the checkpoint file, so an interrupted write does not
+    leave a partial checkpoint.
+    """
+    with open(path + '.tmp', 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(path + '.tmp', path)
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuilds the templates of smart managers in chunks. Smart managers that fail to rebuild are reported and '
+        'skipped. With a checkpoint file, an interrupted rebuild resumes after the last chunk that was rebuilt.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--class', dest='smart_manager_classes', action='append', default=[],
+            help='Only rebuild smart managers with this smart manager class path. Can be given more than once.')
+        parser.add_argument(
+            '--name', dest='name_pattern', help='Only rebuild smart managers with names that match this regex.')
+        parser.add_argument(
+            '--primary-obj-type', dest='primary_obj_types', action='append', default=[],
+            help='Only rebuild smart managers with primary objects of this app_label.model. Can be given more '
+            'than once.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=100, help='The number of smart managers that are rebuilt at once.')
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='The number of processes that rebuild chunks. Every process has its own database connection.')
+        parser.add_argument(
+            '--checkpoint', help='A file that records the progress of the rebuild so that it can be resumed.')
+
+    def get_queryset(self, options):
+        queryset = SmartManager.objects.all()
+        if options['smart_manager_classes']:
+            queryset = queryset.filter(smart_manager_class__in=options['smart_manager_classes'])
+        if options['name_pattern']:
+            queryset = queryset.filter(name__regex=options['name_pattern'])
+        if options['primary_obj_types']:
+            try:
+                queryset = queryset.filter(primary_obj_type__in=[
+                    ContentType.objects.get_by_natural_key(*primary_obj_type.split('.', 1))
+                    for primary_obj_type in options['primary_obj_types']
+                ])
+            except (ContentType.DoesNotExist, TypeError):
+                raise CommandError('Primary object types must be existing app_label.model content types')
+
+        return queryset
+
+    def rebuild_chunks(self, chunks, workers):
+        """
+        Rebuilds the chunks in this process, or with a process pool if there is more than one worker.
+        """
+        if workers <= 1:
+            for result in map(rebuild_chunk, chunks):
+                yield result
+            return
+
+        # The processes of the pool open their own connections instead of sharing the connections of this process
+        connections.close_all()
+        with Pool(workers) as pool:
+            for result in imap_bounded(pool, rebuild_chunk, chunks, workers * 2):
+                yield result
+
+    def handle(self, *args, **options):
+        checkpoint = load_checkpoint(options['checkpoint'])
+        queryset = self.get_queryset(options)
+        if checkpoint['last_id'] is not None:
+            queryset = queryset.filter(id__gt=checkpoint['last_id'])
+
+        num_smart_managers = queryset.count()
+        num_processed = num_errors = 0
+        start_time = perf_counter()
+        for smart_manager_ids, errors in self.rebuild_chunks(
+            get_chunks(queryset, options['chunk_size']), options['workers']
+        ):
+            num_processed += len(smart_manager_ids)
+            num_errors += len(errors)
+            checkpoint['last_id'] = smart_manager_ids[-1]
+            checkpoint['errors'].extend(errors)
+            if options['checkpoint']:
+                save_checkpoint(options['checkpoint'], checkpoint)
+
+            for smart_manager_id, error in errors:
+                self.stderr.write('Could not rebuild smart manager {0}: {1}'.format(smart_manager_id, error))
+            self.stdout.write('Processed {0}/{1} smart managers ({2:.1f}/s)'.format(
+                num_processed, num_smart_managers, num_processed / max(perf_counter() - start_time, 1e-6)))
+
+        self.stdout.write('Processed {0} smart managers in {1:.1f}s with {2} errors'.format(
+            num_processed, perf_counter() - start_time, num_errors))
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('smart_manager', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='smartmanager',
+            name='template_fingerprint',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
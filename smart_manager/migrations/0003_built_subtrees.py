@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('smart_manager', '0002_template_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='smartmanager',
+            name='built_subtrees',
+            field=jsonfield.fields.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('smart_manager', '0003_built_subtrees'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='smartmanager',
+            name='build_status',
+            field=models.CharField(
+                choices=[('built', 'Built'), ('pending', 'Pending'), ('failed', 'Failed')], default='built',
+                max_length=16),
+        ),
+        migrations.AddField(
+            model_name='smartmanager',
+            name='last_built_at',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='smartmanager',
+            name='build_error',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
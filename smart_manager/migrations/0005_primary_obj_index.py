@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('smart_manager', '0004_build_status'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='smartmanager',
+            index=models.Index(fields=['primary_obj_type', 'primary_obj_id'], name='smart_manager_primary_obj_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+import smart_manager.fields
+
+
+# The GIN index of the jsonb templates that is used by containment queries on PostgreSQL
+TEMPLATE_INDEX_NAME = 'smart_manager_template_gin'
+
+
+def create_template_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE INDEX {0} ON {1} USING GIN ({2})'.format(
+            schema_editor.quote_name(TEMPLATE_INDEX_NAME),
+            schema_editor.quote_name(apps.get_model('smart_manager', 'SmartManager')._meta.db_table),
+            schema_editor.quote_name('template'),
+        ))
+
+
+def drop_template_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS {0}'.format(schema_editor.quote_name(TEMPLATE_INDEX_NAME)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('smart_manager', '0005_primary_obj_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='smartmanager',
+            name='template',
+            field=smart_manager.fields.TemplateField(),
+        ),
+        migrations.RunPython(create_template_index, drop_template_index),
+    ]
@@ -1,16 +1,417 @@
+from collections import defaultdict, Counter, OrderedDict
+from functools import reduce
+import hashlib
 import inspect
+import json
+import operator
 import traceback
 
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
-from django.db import models, transaction
-from django.utils.module_loading import import_string
-from manager_utils import sync, ManagerUtilsManager
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, models, transaction
+from django.utils import timezone
+from manager_utils import ManagerUtilsManager, ManagerUtilsQuerySet
 import six
 
 from jsonfield import JSONField
 
+from smart_manager.aio import run_in_executor
+from smart_manager.batch import UpsertBatch
+from smart_manager.context import BuildContext
+from smart_manager.deferred import get_build_backend
+from smart_manager.fields import JSONExtract, TemplateField, get_template_compression_threshold, json_contains
+from smart_manager.instrumentation import instrument_build
+from smart_manager.registry import get_smart_manager_class, get_smart_manager_class_path
+from smart_manager.signals import build_progress
+from smart_manager.subtrees import SubtreeRecorder
+from smart_manager.utils import bulk_create, bulk_update
+
+
+def set_primary_obj(smart_manager, primary_built_obj):
+    if primary_built_obj:
+        smart_manager.primary_obj_type = ContentType.objects.get_for_model(primary_built_obj)
+        smart_manager.primary_obj_id = primary_built_obj.pk
+
+
+def set_built(smart_manager):
+    smart_manager.build_status = SmartManager.BUILT
+    smart_manager.last_built_at = timezone.now()
+    smart_manager.build_error = ''
+
+
+def plan_smart_managers(smart_managers, reuse_subtrees=False, stats=None):
+    """
+    Builds the templates of smart managers without flushing the batch that is shared by batched builders, so the
+    objects of batched builders are not written yet. If reuse_subtrees is True, subtrees from the previous builds
+    of the smart managers are reused. The builds are recorded in the stats of an instrumented build. Returns a plan
+    that is written by flush_smart_managers.
+    """
+    if reuse_subtrees:
+        load_built_subtrees(smart_managers)
+
+    batch = UpsertBatch()
+    builds = []
+    for smart_manager in smart_managers:
+        builder = get_smart_manager_class(smart_manager.smart_manager_class)(smart_manager.template)
+        builder._context.subtree_recorder = SubtreeRecorder(smart_manager.built_subtrees if reuse_subtrees else None)
+        builder._context.stats = stats
+        if builder.batch_build:
+            builder._batch = batch
+        builds.append((smart_manager, builder, builder._context.build(builder)))
+
+    return batch, builds
+
+
+def load_built_subtrees(smart_managers):
+    """
+    Loads the built subtrees of saved smart managers that were loaded without them, with one query per chunk of
+    smart managers instead of one query per smart manager.
+    """
+    smart_managers_by_id = defaultdict(list)
+    for smart_manager in smart_managers:
+        if smart_manager.id is not None and 'built_subtrees' in smart_manager.get_deferred_fields():
+            smart_managers_by_id[smart_manager.id].append(smart_manager)
+
+    smart_manager_ids = sorted(smart_managers_by_id)
+    batch_size = max(connections[SmartManager.objects.db].ops.bulk_batch_size(['pk'], smart_manager_ids), 1)
+    for i in range(0, len(smart_manager_ids), batch_size):
+        for smart_manager_id, built_subtrees in SmartManager.objects.filter(
+            id__in=smart_manager_ids[i:i + batch_size]
+        ).values_list('id', 'built_subtrees'):
+            for smart_manager in smart_managers_by_id[smart_manager_id]:
+                smart_manager.built_subtrees = built_subtrees
+
+
+def flush_smart_managers(plan, stats=None):
+    """
+    Flushes the batch of a plan and sets the primary objects and built subtrees of its smart managers. Streaming
+    builders keep their own batch, which is flushed too, since they are built without a stream here. Returns a
+    (builder, primary built object) tuple for every smart manager.
+    """
+    batch, builds = plan
+    batch.flush(stats)
+    for smart_manager, builder, primary_built_obj in builds:
+        if builder._batch is not batch:
+            builder.flush()
+        smart_manager.built_subtrees = builder._context.subtree_recorder.serialize()
+        set_primary_obj(smart_manager, primary_built_obj)
+        set_built(smart_manager)
+
+    return [(builder, primary_built_obj) for smart_manager, builder, primary_built_obj in builds]
+
+
+def build_smart_managers(smart_managers, reuse_subtrees=False, stats=None):
+    """
+    Builds the templates of smart managers and sets their primary objects and built subtrees. Batched builders
+    share one batch that is flushed after all templates have been built. If reuse_subtrees is True, subtrees
+    from the previous builds of the smart managers are reused. Returns a (builder, primary built object) tuple
+    for every smart manager.
+    """
+    return flush_smart_managers(
+        plan_smart_managers(smart_managers, reuse_subtrees=reuse_subtrees, stats=stats), stats=stats)
+
+
+def stream_smart_manager(smart_manager, stats=None):
+    """
+    Builds the template of a saved smart manager with a streaming builder. The objects and their
+    SmartManagerObject rows are written in chunks while the template is built, and objects that are no longer
+    built are deleted at the end. Returns the primary built object.
+    """
+    builder = get_smart_manager_class(smart_manager.smart_manager_class)(smart_manager.template)
+    stream = SmartManagerObjectStream(smart_manager, builder.stream_chunk_size)
+    builder._context.stream = stream
+    builder._context.stats = stats
+
+    primary_built_obj = builder._context.build(builder)
+    builder.flush()
+    stream.write(builder.get_built_objs())
+    stream.close()
+
+    smart_manager.built_subtrees = {}
+    set_primary_obj(smart_manager, primary_built_obj)
+    set_built(smart_manager)
+    return primary_built_obj
+
+
+def get_smart_manager_objs(smart_manager, builder):
+    """
+    Returns unsaved SmartManagerObject instances for all of the objects built by a builder.
+    """
+    return [
+        SmartManagerObject(
+            smart_manager=smart_manager, model_obj_type_id=model_obj_type_id, model_obj_id=model_obj_id)
+        for model_obj_type_id, model_obj_ids in builder.get_built_objs().group().items()
+        for model_obj_id in model_obj_ids
+    ]
+
+
+def sync_smart_manager_objs(builds):
+    """
+    Syncs the SmartManagerObject rows of saved smart managers with the objects built by their builders, given a
+    list of (smart manager, builder) tuples. The rows are compared as (model_obj_type_id, model_obj_id) tuples
+    without loading them as model instances. Only rows of new objects are inserted and only rows of objects that
+    are no longer built are deleted, so nothing is written when the built objects have not changed.
+    """
+    built_keys = {smart_manager.id: set(builder.get_built_objs()) for smart_manager, builder in builds}
+
+    deleted_ids = []
+    for smart_manager_obj_id, smart_manager_id, model_obj_type_id, model_obj_id in SmartManagerObject.objects.filter(
+        smart_manager_id__in=built_keys
+    ).values_list('id', 'smart_manager_id', 'model_obj_type_id', 'model_obj_id').iterator():
+        key = (model_obj_type_id, model_obj_id)
+        if key in built_keys[smart_manager_id]:
+            built_keys[smart_manager_id].remove(key)
+        else:
+            deleted_ids.append(smart_manager_obj_id)
+
+    # Rows are deleted before rows are inserted, since an object can move from one smart manager to another
+    batch_size = max(connections[SmartManagerObject.objects.db].ops.bulk_batch_size(['pk'], deleted_ids), 1)
+    for i in range(0, len(deleted_ids), batch_size):
+        SmartManagerObject.objects.filter(id__in=deleted_ids[i:i + batch_size]).delete()
+
+    new_smart_manager_objs = [
+        SmartManagerObject(
+            smart_manager_id=smart_manager_id, model_obj_type_id=model_obj_type_id, model_obj_id=model_obj_id)
+        for smart_manager_id, keys in built_keys.items()
+        for model_obj_type_id, model_obj_id in sorted(keys)
+    ]
+    if new_smart_manager_objs:
+        SmartManagerObject.objects.bulk_create(new_smart_manager_objs)
+
+
+def delete_model_objs(model_obj_type_id, model_obj_ids, using):
+    """
+    Deletes the model objects of one content type with a pk__in query. The query is only split into chunks on
+    backends that limit the number of query parameters. Protected and missing model objects are ignored. If a
+    chunk cannot be deleted, its objects are deleted one at a time so that the rest of the chunk is still deleted.
+    Returns the number of deleted objects keyed on their model labels.
+    """
+    num_deleted = Counter()
+    model_class = ContentType.objects.db_manager(using).get_for_id(model_obj_type_id).model_class()
+    if model_class is None:
+        return num_deleted
+
+    queryset = model_class._base_manager.using(using)
+    model_obj_ids = sorted(model_obj_ids)
+    batch_size = max(connections[using].ops.bulk_batch_size(['pk'], model_obj_ids), 1)
+    for i in range(0, len(model_obj_ids), batch_size):
+        try:
+            with transaction.atomic(using=using):
+                num_deleted.update(queryset.filter(pk__in=model_obj_ids[i:i + batch_size]).delete()[1])
+        except Exception:
+            for model_obj_id in model_obj_ids[i:i + batch_size]:
+                try:
+                    with transaction.atomic(using=using):
+                        num_deleted.update(queryset.filter(pk=model_obj_id).delete()[1])
+                except Exception:
+                    # The model object could have been trying to cascade delete a protected model. Ignore any
+                    # deletion errors with model objects.
+                    pass
+
+    return num_deleted
+
+
+def rebuild_smart_managers(smart_managers, reuse_subtrees=False):
+    """
+    Builds the templates of saved smart managers and saves the smart managers with one bulk update. The objects
+    managed by the smart managers are synced at once. Returns the smart managers.
+    """
+    with instrument_build(SmartManager, smart_managers) as stats:
+        builds = build_smart_managers(smart_managers, reuse_subtrees=reuse_subtrees, stats=stats)
+
+        for smart_manager in smart_managers:
+            smart_manager.template_fingerprint = smart_manager.get_template_fingerprint()
+        bulk_update(SmartManager, smart_managers, [
+            'smart_manager_class', 'template', 'primary_obj_type', 'primary_obj_id', 'template_fingerprint',
+            'built_subtrees', 'build_status', 'last_built_at', 'build_error',
+        ])
+        sync_smart_manager_objs([
+            (smart_manager, builder) for smart_manager, (builder, primary_built_obj) in zip(smart_managers, builds)
+        ])
+
+    return smart_managers
+
+
+class SmartManagerQuerySet(ManagerUtilsQuerySet):
+    @transaction.atomic
+    def rebuild(self):
+        """
+        Rebuilds the templates of all smart managers in the queryset in a single transaction. The objects
+        managed by the smart managers are synced at once. Returns the rebuilt smart managers.
+        """
+        return rebuild_smart_managers(list(self.with_templates()))
+
+    @transaction.atomic
+    def delete(self):
+        """
+        Deletes the smart managers after deleting their managed objects in bulk.
+        """
+        num_deleted, num_deleted_per_model = SmartManagerObject.objects.filter(smart_manager__in=self).delete()
+        num_deleted_per_model = Counter(num_deleted_per_model)
+        num_deleted_per_model.update(super(SmartManagerQuerySet, self).delete()[1])
+        return sum(num_deleted_per_model.values()), dict(num_deleted_per_model)
+
+    delete.queryset_only = True
+
+    def queue_rebuild(self):
+        """
+        Marks the smart managers as pending and enqueues rebuilds of them with the build backend once the
+        transaction is committed, instead of rebuilding them right away. Returns the number of queued smart
+        managers.
+        """
+        smart_manager_ids = list(self.values_list('id', flat=True))
+        batch_size = max(connections[self.db].ops.bulk_batch_size(['pk'], smart_manager_ids), 1)
+        for i in range(0, len(smart_manager_ids), batch_size):
+            self.model.objects.filter(id__in=smart_manager_ids[i:i + batch_size]).update(
+                build_status=SmartManager.PENDING)
+
+        def enqueue():
+            build_backend = get_build_backend()
+            for smart_manager_id in smart_manager_ids:
+                build_backend.enqueue(smart_manager_id, force_rebuild=True)
+        transaction.on_commit(enqueue)
+
+        return len(smart_manager_ids)
+
+    def with_templates(self, built_subtrees=False):
+        """
+        Returns a queryset that loads the templates of the smart managers. Templates and built subtrees are
+        deferred by default, so code that does not read them does not load and decode them. If built_subtrees is
+        True, the subtrees of the previous builds are loaded too, for rebuilds that reuse them.
+        """
+        loaded_field_names = {'template', 'built_subtrees'} if built_subtrees else {'template'}
+        clone = self._chain()
+        field_names, defer = clone.query.deferred_loading
+        if defer:
+            clone.query.deferred_loading = (frozenset(field_names) - loaded_field_names, True)
+        else:
+            clone.query.deferred_loading = (frozenset(field_names) | loaded_field_names, False)
+        return clone
+
+    def for_primary_objs(self, primary_objs):
+        """
+        Returns the smart managers of primary objects, which can be a queryset or a list of model objects. The
+        smart managers of all of the primary objects are looked up with one query that uses the index on the
+        primary object type and id. A queryset of primary objects is used as a subquery.
+        """
+        if isinstance(primary_objs, models.QuerySet):
+            return self.filter(
+                primary_obj_type=ContentType.objects.get_for_model(primary_objs.model),
+                primary_obj_id__in=primary_objs.values('pk'),
+            )
+
+        primary_obj_ids = defaultdict(set)
+        for primary_obj in primary_objs:
+            if primary_obj.pk is not None:
+                primary_obj_ids[ContentType.objects.get_for_model(primary_obj)].add(primary_obj.pk)
+        if not primary_obj_ids:
+            return self.none()
+
+        return self.filter(reduce(operator.or_, [
+            models.Q(primary_obj_type=primary_obj_type, primary_obj_id__in=sorted(pks))
+            for primary_obj_type, pks in primary_obj_ids.items()
+        ]))
+
+    def template_contains(self, value):
+        """
+        Returns the smart managers whose templates contain a JSON value, with the semantics of the jsonb @> operator.
+        On PostgreSQL, the templates are filtered by the database with the GIN index on the template. Other
+        databases load the templates of the queryset and filter them in Python, as does PostgreSQL when templates
+        are compressed, since the database cannot look inside compressed templates. The matching smart managers are
+        then looked up in chunks on backends that limit the number of query parameters.
+        """
+        if connections[self.db].vendor == 'postgresql' and get_template_compression_threshold() is None:
+            return self.filter(template__jsonb_contains=value)
+
+        smart_manager_ids = [
+            smart_manager_id
+            for smart_manager_id, template in self.values_list('id', 'template').iterator()
+            if json_contains(template, value)
+        ]
+        if not smart_manager_ids:
+            return self.none()
+
+        batch_size = max(connections[self.db].ops.bulk_batch_size(['pk'], smart_manager_ids), 1)
+        return self.filter(reduce(operator.or_, [
+            models.Q(id__in=smart_manager_ids[i:i + batch_size])
+            for i in range(0, len(smart_manager_ids), batch_size)
+        ]))
+
+    def filter_template_key(self, key, value):
+        """
+        Returns the smart managers whose templates have a top-level key that contains a value. On SQLite, scalar
+        values are compared by the database with json_extract unless templates are compressed. Other values are
+        filtered like template_contains.
+        """
+        is_scalar = isinstance(value, six.string_types + (int, float)) and not isinstance(value, bool)
+        is_compressed = get_template_compression_threshold() is not None
+        if connections[self.db].vendor == 'sqlite' and is_scalar and '"' not in key and not is_compressed:
+            # The extracted values are compared as they are, since they can be strings or numbers
+            return self.annotate(_template_value=JSONExtract(
+                'template', models.Value('$."{0}"'.format(key)), output_field=models.Field()
+            )).filter(_template_value=value)
+
+        return self.template_contains({key: value})
+
+
+class SmartManagerManager(ManagerUtilsManager):
+    def get_queryset(self):
+        """
+        Returns a queryset with the templates and built subtrees deferred. A template is loaded when it is first
+        accessed, or with the rest of the smart manager when the queryset calls with_templates.
+        """
+        return SmartManagerQuerySet(self.model, using=self._db).defer('template', 'built_subtrees')
+
+    def with_templates(self, built_subtrees=False):
+        return self.get_queryset().with_templates(built_subtrees=built_subtrees)
+
+    def queue_rebuild(self):
+        return self.get_queryset().queue_rebuild()
+
+    def rebuild(self):
+        return self.get_queryset().rebuild()
+
+    def for_primary_objs(self, primary_objs):
+        return self.get_queryset().for_primary_objs(primary_objs)
+
+    def template_contains(self, value):
+        return self.get_queryset().template_contains(value)
+
+    def filter_template_key(self, key, value):
+        return self.get_queryset().filter_template_key(key, value)
+
+    @transaction.atomic
+    def bulk_build(self, sm_classes_and_templates, batch_size=None, **kwargs):
+        """
+        Creates smart managers from a list of (smart manager class, template) tuples in a single transaction.
+        The smart manager class can be a class or its path. Any additional kwargs are used as field values
+        of every smart manager. The smart managers and the objects they manage are inserted in bulk, and the
+        smart managers are returned in the order of the templates.
+        """
+        smart_managers = [
+            self.model(
+                smart_manager_class=get_smart_manager_class_path(sm_class) if inspect.isclass(sm_class) else sm_class,
+                template=template,
+                **kwargs
+            )
+            for sm_class, template in sm_classes_and_templates
+        ]
+        with instrument_build(SmartManager, smart_managers) as stats:
+            builds = build_smart_managers(smart_managers, stats=stats)
+
+            for smart_manager in smart_managers:
+                smart_manager.template_fingerprint = smart_manager.get_template_fingerprint()
+            bulk_create(SmartManager, smart_managers, batch_size=batch_size)
+            SmartManagerObject.objects.bulk_create([
+                smart_manager_obj
+                for smart_manager, (builder, primary_built_obj) in zip(smart_managers, builds)
+                for smart_manager_obj in get_smart_manager_objs(smart_manager, builder)
+            ], batch_size=batch_size)
+
+        return smart_managers
+
 
 @six.python_2_unicode_compatible
 class SmartManager(models.Model):
@@ -34,9 +435,38 @@ class SmartManager(models.Model):
     primary_obj = GenericForeignKey('primary_obj_type', 'primary_obj_id')
 
     # The template of the model(s) being managed
-    template = JSONField()
+    template = TemplateField()
+
+    # A hash of the template and smart manager class that were last built. Saves that do not change
+    # the fingerprint do not rebuild the template
+    template_fingerprint = models.CharField(max_length=64, blank=True, default='')
 
-    objects = ManagerUtilsManager()
+    # The objects built by each child builder in the last build, keyed on the fingerprints of the child
+    # builder classes and templates. Children that have not changed are reused when the template is rebuilt
+    built_subtrees = JSONField(default=dict, blank=True)
+
+    # Whether the template has been built, is waiting for a deferred build, or failed to build in a deferred build
+    BUILT = 'built'
+    PENDING = 'pending'
+    FAILED = 'failed'
+    BUILD_STATUSES = (
+        (BUILT, 'Built'),
+        (PENDING, 'Pending'),
+        (FAILED, 'Failed'),
+    )
+    build_status = models.CharField(max_length=16, choices=BUILD_STATUSES, default=BUILT)
+
+    # When the template was last built, and the error of the last deferred build if it failed
+    last_built_at = models.DateTimeField(null=True, blank=True, default=None)
+    build_error = models.TextField(blank=True, default='')
+
+    objects = SmartManagerManager()
+
+    class Meta:
+        indexes = [
+            # Looks up the smart managers of primary objects
+            models.Index(fields=['primary_obj_type', 'primary_obj_id'], name='smart_manager_primary_obj_idx'),
+        ]
 
     def __str__(self):
         return str(self.name)
@@ -45,40 +475,248 @@ class SmartManager(models.Model):
         """
         Verify that the object can be built and the template class can be loaded. If any exception happens, raise
         a validation error.
+
+        The build is kept and used by the next save if the template has not changed in the meantime, so the
+        template is only built once. Batched builders do not write their queued objects until the save, and
+        templates that have not changed since they were last built are not built again.
         """
+        self._validated_build = None
+        template_fingerprint = self.get_template_fingerprint()
+        if self.id and template_fingerprint == self.template_fingerprint:
+            return
+
         try:
-            smart_manager = import_string(self.smart_manager_class)(self.template)
-            smart_manager.build()
+            # Streaming builders write their objects in chunks, and deferred builds happen after the save, so
+            # they are only built when they are saved
+            smart_manager_class = get_smart_manager_class(self.smart_manager_class)
+            if smart_manager_class.stream_build or smart_manager_class.defer_build:
+                return
+
+            # Builders that are not batched write their objects during the build, and those writes are
+            # rolled back if the build fails
+            with transaction.atomic():
+                plan = plan_smart_managers([self], reuse_subtrees=True)
         except Exception as e:
             raise ValidationError('{0} - {1}'.format(str(e), traceback.format_exc()))
 
+        self._validated_build = (template_fingerprint, plan)
+
+    def get_template_fingerprint(self):
+        """
+        Returns a hash of the template and the smart manager class.
+        """
+        return hashlib.sha256(json.dumps(
+            [self.smart_manager_class, self.template], sort_keys=True, cls=DjangoJSONEncoder
+        ).encode('utf-8')).hexdigest()
+
     @transaction.atomic
-    def save(self, *args, **kwargs):
+    def save(self, *args, force_rebuild=False, defer_build=None, **kwargs):
         """
-        Builds the objects managed by the template before saving the template.
+        Builds the objects managed by the template before saving the template. The template is not rebuilt
+        if its fingerprint matches the one that was last built, unless force_rebuild is True.
+        The build of a preceding clean is used if the template has not changed since then.
+
+        If defer_build is True, or if it is None and the smart manager class has defer_build set, the template is
+        saved and marked as pending, and it is built by the build backend after the transaction is committed.
         """
+        validated_build = self.__dict__.pop('_validated_build', None)
+        template_fingerprint = self.get_template_fingerprint()
+        built_template_fingerprint = SmartManager.objects.select_for_update().filter(
+            id=self.id).values_list('template_fingerprint', flat=True).first() if self.id else None
+        if defer_build is None:
+            defer_build = get_smart_manager_class(self.smart_manager_class).defer_build
+        if defer_build:
+            return self._save_deferred(template_fingerprint, built_template_fingerprint, force_rebuild, args, kwargs)
+
+        self.template_fingerprint = template_fingerprint
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | set(['template_fingerprint'])
         super(SmartManager, self).save(*args, **kwargs)
 
-        smart_manager = import_string(self.smart_manager_class)(self.template)
-        primary_built_obj = smart_manager.build()
+        if template_fingerprint == built_template_fingerprint and not force_rebuild:
+            # The template that was last built is still current, even if a deferred build is waiting or failed
+            if self.build_status != SmartManager.BUILT:
+                self.build_status, self.build_error = SmartManager.BUILT, ''
+                SmartManager.objects.filter(id=self.id).update(build_status=self.build_status, build_error='')
+            return
 
-        # Do an update of the primary object type and id after it has been built. We use an update since
-        # you can't call save in a save method. We may want to put this in post_save as well later.
+        with instrument_build(SmartManager, [self]) as stats:
+            self._build(validated_build, force_rebuild, stats)
+
+    def _build(self, validated_build, force_rebuild, stats):
+        """
+        Builds the template and syncs the objects it manages. The build of a preceding clean is used if it is for
+        the current template.
+        """
+        if get_smart_manager_class(self.smart_manager_class).stream_build:
+            smart_manager, primary_built_obj = None, stream_smart_manager(self, stats=stats)
+        elif validated_build is not None and validated_build[0] == self.template_fingerprint and not force_rebuild:
+            smart_manager, primary_built_obj = flush_smart_managers(validated_build[1], stats=stats)[0]
+        else:
+            smart_manager, primary_built_obj = build_smart_managers(
+                [self], reuse_subtrees=not force_rebuild, stats=stats)[0]
+
+        # Do an update of the primary object type and id and the built subtrees after it has been built. We use an
+        # update since you can't call save in a save method. We may want to put this in post_save as well later.
+        updates = {
+            'built_subtrees': self.built_subtrees,
+            'build_status': self.build_status,
+            'last_built_at': self.last_built_at,
+            'build_error': self.build_error,
+        }
         if primary_built_obj:
-            self.primary_obj_type = ContentType.objects.get_for_model(primary_built_obj)
-            self.primary_obj_id = primary_built_obj.id
-            SmartManager.objects.filter(id=self.id).update(
-                primary_obj_type=self.primary_obj_type, primary_obj_id=primary_built_obj.id)
+            updates.update(primary_obj_type=self.primary_obj_type, primary_obj_id=self.primary_obj_id)
+        SmartManager.objects.filter(id=self.id).update(**updates)
+
+        # Sync all of the objects from the built template. Streaming builds have already written them
+        if smart_manager is not None:
+            sync_smart_manager_objs([(self, smart_manager)])
+
+    def _save_deferred(self, template_fingerprint, built_template_fingerprint, force_rebuild, args, kwargs):
+        """
+        Saves the template without building it. If the template has to be built, the smart manager is marked as
+        pending and its build is enqueued once the transaction is committed. The fingerprint of the template that
+        was last built is kept so that the deferred build can tell whether the template has changed.
+        """
+        self.template_fingerprint = built_template_fingerprint or ''
+        needs_build = template_fingerprint != built_template_fingerprint or force_rebuild
+        if needs_build:
+            self.build_status = SmartManager.PENDING
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | set(['template_fingerprint', 'build_status'])
+        super(SmartManager, self).save(*args, **kwargs)
+
+        if needs_build:
+            smart_manager_id = self.id
+            transaction.on_commit(lambda: get_build_backend().enqueue(smart_manager_id, force_rebuild=force_rebuild))
+
+    @transaction.atomic
+    def delete(self, *args, **kwargs):
+        """
+        Deletes the managed objects in bulk before deleting the smart manager.
+        """
+        num_deleted, num_deleted_per_model = self.smartmanagerobject_set.all().delete()
+        num_deleted_per_model = Counter(num_deleted_per_model)
+        num_deleted_per_model.update(super(SmartManager, self).delete(*args, **kwargs)[1])
+        return sum(num_deleted_per_model.values()), dict(num_deleted_per_model)
+
+    def build(self):
+        """
+        Rebuilds the template of a saved smart manager, even if it has not changed since it was last built. Subtrees
+        that have not changed are reused.
+        """
+        with transaction.atomic():
+            rebuild_smart_managers([self], reuse_subtrees=True)
+
+    async def abuild(self):
+        """
+        The async version of build. The build runs in a thread pool without blocking the event loop.
+        """
+        return await run_in_executor(self.build)
+
+    async def asave(self, *args, **kwargs):
+        """
+        The async version of save. The build runs in a thread pool without blocking the event loop.
+        """
+        return await run_in_executor(self.save, *args, **kwargs)
+
+    async def adelete(self, *args, **kwargs):
+        """
+        The async version of delete.
+        """
+        return await run_in_executor(self.delete, *args, **kwargs)
+
+
+class SmartManagerObjectStream(object):
+    """
+    Writes the SmartManagerObject rows of a streaming build in chunks. When the stream is opened, the rows of the
+    previous build are moved to a placeholder smart manager. Rows of objects that are built again are moved back in
+    every chunk, and the placeholder is deleted along with the rows and objects that are left when the stream is
+    closed. This keeps track of the objects that are no longer built without holding them in memory.
+    """
+    def __init__(self, smart_manager, chunk_size):
+        self.smart_manager = smart_manager
+        self.chunk_size = chunk_size
+        self.num_built_objs = 0
+
+        self._previous_smart_manager = bulk_create(SmartManager, [SmartManager(
+            smart_manager_class=smart_manager.smart_manager_class,
+            manages_deletions=smart_manager.manages_deletions,
+            template={},
+        )])[0]
+        SmartManagerObject.objects.filter(smart_manager=smart_manager).update(
+            smart_manager=self._previous_smart_manager)
+
+    def write(self, built_objs):
+        """
+        Writes the rows of the built objects that have pks and removes them from the built objects.
+        """
+        for model_obj_type_id, model_obj_ids in built_objs.group().items():
+            model_obj_ids = sorted(model_obj_ids)
+            batch_size = min(self.chunk_size, max(
+                connections[SmartManagerObject.objects.db].ops.bulk_batch_size(['pk'], model_obj_ids), 1))
+            for i in range(0, len(model_obj_ids), batch_size):
+                self._write_chunk(model_obj_type_id, model_obj_ids[i:i + batch_size])
+            self.num_built_objs += len(model_obj_ids)
+        built_objs.clear()
+
+        build_progress.send(sender=SmartManager, smart_manager=self.smart_manager, num_built_objs=self.num_built_objs)
 
-        # Sync all of the objects from the built template
-        sync(self.smartmanagerobject_set.all(), [
+    def _write_chunk(self, model_obj_type_id, model_obj_ids):
+        smart_manager_objs = SmartManagerObject.objects.filter(
+            smart_manager__in=[self.smart_manager, self._previous_smart_manager],
+            model_obj_type_id=model_obj_type_id,
+            model_obj_id__in=model_obj_ids,
+        )
+        extant_model_obj_ids = set(smart_manager_objs.values_list('model_obj_id', flat=True))
+        smart_manager_objs.filter(smart_manager=self._previous_smart_manager).update(smart_manager=self.smart_manager)
+        SmartManagerObject.objects.bulk_create([
             SmartManagerObject(
-                smart_manager=self,
-                model_obj_id=built_obj.id,
-                model_obj_type=ContentType.objects.get_for_model(built_obj, for_concrete_model=False),
-            )
-            for built_obj in smart_manager.built_objs
-        ], ['smart_manager_id', 'model_obj_id', 'model_obj_type_id'])
+                smart_manager=self.smart_manager, model_obj_type_id=model_obj_type_id, model_obj_id=model_obj_id)
+            for model_obj_id in model_obj_ids
+            if model_obj_id not in extant_model_obj_ids
+        ])
+
+    def close(self):
+        """
+        Deletes the objects that were not built again.
+        """
+        SmartManager.objects.filter(id=self._previous_smart_manager.id).delete()
+
+
+class SmartManagerObjectQuerySet(ManagerUtilsQuerySet):
+    @transaction.atomic
+    def delete(self):
+        """
+        Deletes the smart manager objects without sending a signal for each of them. The model objects of smart
+        managers that manage deletions are grouped by content type, and every group is deleted in bulk.
+        """
+        assert self.query.can_filter(), 'Cannot use \'limit\' or \'offset\' with delete.'
+        del_query = self._chain()
+        del_query._for_write = True
+        using = del_query.db
+
+        model_obj_ids = defaultdict(set)
+        for model_obj_type_id, model_obj_id in del_query.filter(smart_manager__manages_deletions=True).values_list(
+            'model_obj_type_id', 'model_obj_id'
+        ):
+            model_obj_ids[model_obj_type_id].add(model_obj_id)
+
+        num_deleted_per_model = Counter()
+        for model_obj_type_id in sorted(model_obj_ids):
+            num_deleted_per_model.update(delete_model_objs(model_obj_type_id, model_obj_ids[model_obj_type_id], using))
+
+        # The smart manager objects are deleted directly, since their model objects have already been deleted
+        num_deleted_per_model[self.model._meta.label] += del_query._raw_delete(using)
+        self._result_cache = None
+        return sum(num_deleted_per_model.values()), dict(num_deleted_per_model)
+
+    delete.queryset_only = True
+
+
+class SmartManagerObjectManager(ManagerUtilsManager):
+    def get_queryset(self):
+        return SmartManagerObjectQuerySet(self.model, using=self._db)
 
 
 class SmartManagerObject(models.Model):
@@ -94,24 +732,162 @@ class SmartManagerObject(models.Model):
     model_obj_id = models.PositiveIntegerField()
     model_obj = GenericForeignKey('model_obj_type', 'model_obj_id', for_concrete_model=False)
 
-    objects = ManagerUtilsManager()
+    objects = SmartManagerObjectManager()
 
     class Meta:
         unique_together = ('model_obj_type', 'model_obj_id')
 
 
+def prefetch_smart_managers(model_objs):
+    """
+    Attaches the smart manager that manages each model object to the object, or None if it is not managed by a
+    smart manager. The smart managers of all objects of the same model are loaded with one query, and the attached
+    smart managers are used by SmartModelMixin. Returns the model objects.
+    """
+    model_objs = list(model_objs)
+    model_objs_by_type = defaultdict(dict)
+    context = BuildContext()
+    for model_obj in model_objs:
+        model_obj._smart_manager_cache = None
+        if model_obj.pk is not None:
+            model_obj_type = context.get_content_type(model_obj.__class__)
+            model_objs_by_type[model_obj_type].setdefault(model_obj.pk, []).append(model_obj)
+
+    for model_obj_type, model_objs_by_id in model_objs_by_type.items():
+        model_obj_ids = sorted(model_objs_by_id)
+        batch_size = max(connections[SmartManagerObject.objects.db].ops.bulk_batch_size(['pk'], model_obj_ids), 1)
+        for i in range(0, len(model_obj_ids), batch_size):
+            for smart_manager_obj in SmartManagerObject.objects.filter(
+                model_obj_type=model_obj_type, model_obj_id__in=model_obj_ids[i:i + batch_size]
+            ).select_related('smart_manager').defer('smart_manager__template', 'smart_manager__built_subtrees'):
+                for model_obj in model_objs_by_id[smart_manager_obj.model_obj_id]:
+                    model_obj._smart_manager_cache = smart_manager_obj.smart_manager
+
+    return model_objs
+
+
+class SmartQuerySetMixin(object):
+    """
+    A mixin for django querysets of models that inherit SmartModelMixin. The functions provided for querysets are
+
+    with_smart_managers: Attach the smart managers of the objects when the queryset is evaluated,
+    smart_upsert_many: Upsert many objects with a smart manager class and a template for each object,
+    smart_delete: Delete the objects and their smart managers.
+
+    asmart_upsert_many and asmart_delete are their async versions.
+    """
+    def __init__(self, *args, **kwargs):
+        super(SmartQuerySetMixin, self).__init__(*args, **kwargs)
+        self._with_smart_managers = False
+
+    def with_smart_managers(self):
+        """
+        Returns a queryset that attaches the smart manager of every object when it is evaluated, so that
+        smart_upsert and smart_delete do not have to look them up one object at a time.
+        """
+        clone = self._chain()
+        clone._with_smart_managers = True
+        return clone
+
+    @transaction.atomic
+    def smart_upsert_many(self, sm_class, templates_by_pk):
+        """
+        Upserts the objects with the given pks using a smart manager class and a template for every object, in
+        a single transaction. Smart managers whose template or class have changed are rebuilt together, and the
+        objects that do not have a smart manager get one from a bulk build. Returns the smart managers keyed
+        on the pks of the objects.
+        """
+        model_objs = prefetch_smart_managers(self.filter(pk__in=list(templates_by_pk)))
+        model_objs_by_pk = {model_obj.pk: model_obj for model_obj in model_objs}
+        if len(model_objs_by_pk) != len(templates_by_pk):
+            raise ValueError('Cannot call smart_upsert_many on non-persisted models')
+
+        sm_class_path = get_smart_manager_class_path(sm_class)
+        smart_managers = {}
+        extant_smart_managers = OrderedDict()
+        pks_to_create = []
+        for pk, template in templates_by_pk.items():
+            smart_manager = model_objs_by_pk[pk]._smart_manager_cache
+            if smart_manager is None:
+                pks_to_create.append(pk)
+                continue
+
+            # Objects that are managed by the same smart manager share one instance of it
+            smart_manager = extant_smart_managers.setdefault(smart_manager.id, smart_manager)
+            smart_manager.template = template
+            smart_manager.smart_manager_class = sm_class_path
+            smart_managers[pk] = smart_manager
+
+        rebuild_smart_managers([
+            smart_manager
+            for smart_manager in extant_smart_managers.values()
+            if smart_manager.get_template_fingerprint() != smart_manager.template_fingerprint
+        ], reuse_subtrees=True)
+        smart_managers.update(zip(pks_to_create, SmartManager.objects.bulk_build([
+            (sm_class_path, templates_by_pk[pk]) for pk in pks_to_create
+        ])))
+
+        return smart_managers
+
+    @transaction.atomic
+    def smart_delete(self):
+        """
+        Deletes the objects in the queryset and their smart managers in a single transaction. Note that the
+        objects are normally managed by the smart managers, so the objects managed along with them are often
+        deleted as well.
+        """
+        smart_manager_ids = list(SmartManagerObject.objects.filter(
+            model_obj_type=ContentType.objects.get_for_model(self.model, for_concrete_model=False),
+            model_obj_id__in=self.values('pk'),
+        ).values_list('smart_manager_id', flat=True).distinct())
+        self.delete()
+        SmartManager.objects.filter(id__in=smart_manager_ids).delete()
+
+    async def asmart_upsert_many(self, sm_class, templates_by_pk):
+        """
+        The async version of smart_upsert_many. The builds run in a thread pool without blocking the event loop.
+        """
+        return await run_in_executor(self.smart_upsert_many, sm_class, templates_by_pk)
+
+    async def asmart_delete(self):
+        """
+        The async version of smart_delete.
+        """
+        return await run_in_executor(self.smart_delete)
+
+    def _clone(self):
+        clone = super(SmartQuerySetMixin, self)._clone()
+        clone._with_smart_managers = self._with_smart_managers
+        return clone
+
+    def _fetch_all(self):
+        is_fetched = self._result_cache is not None
+        super(SmartQuerySetMixin, self)._fetch_all()
+        if self._with_smart_managers and not is_fetched:
+            prefetch_smart_managers(
+                model_obj for model_obj in self._result_cache if isinstance(model_obj, models.Model))
+
+
 class SmartModelMixin(object):
     """
     A mixin for django models that provides smart manager behavior. The functions provided for models are
 
     smart_upsert: Upsert an existing model with a provided smart manager class and template,
     smart_delete: Delete an existing model and flush its associated smart manager.
+
+    asmart_upsert and asmart_delete are their async versions.
     """
     def _get_smart_manager(self):
         """
-        Gets the smart manager associated with this object or None if it doesn't have one.
+        Gets the smart manager associated with this object or None if it doesn't have one. Uses the smart
+        manager that was attached by prefetch_smart_managers if there is one.
         """
-        smo = SmartManagerObject.objects.get_or_none(
+        if hasattr(self, '_smart_manager_cache'):
+            return self._smart_manager_cache
+
+        smo = SmartManagerObject.objects.select_related('smart_manager').defer(
+            'smart_manager__template', 'smart_manager__built_subtrees'
+        ).get_or_none(
             model_obj_type=ContentType.objects.get_for_model(self, for_concrete_model=False),
             model_obj_id=self.id)
         return smo.smart_manager if smo else None
@@ -124,11 +900,12 @@ class SmartModelMixin(object):
             raise ValueError('Cannot call smart_upsert on a non-persisted model')
 
         sm = self._get_smart_manager()
+        self.__dict__.pop('_smart_manager_cache', None)
         return SmartManager.objects.upsert(
             id=sm.id if sm else None,
             updates={
                 'template': sm_template,
-                'smart_manager_class': '{0}.{1}'.format(inspect.getmodule(sm_class).__name__, sm_class.__name__),
+                'smart_manager_class': get_smart_manager_class_path(sm_class),
             })[0]
 
     def smart_delete(self):
@@ -137,21 +914,59 @@ class SmartModelMixin(object):
         is often deleted as well.
         """
         sm = self._get_smart_manager()
+        self.__dict__.pop('_smart_manager_cache', None)
         self.delete()
         if sm:
             sm.delete()
 
+    async def asmart_upsert(self, sm_class, sm_template):
+        """
+        The async version of smart_upsert. The build runs in a thread pool without blocking the event loop.
+        """
+        return await run_in_executor(self.smart_upsert, sm_class, sm_template)
+
+    async def asmart_delete(self):
+        """
+        The async version of smart_delete.
+        """
+        return await run_in_executor(self.smart_delete)
+
 
 class SmartManagerMixin(object):
     """
     Provides additional "smart" functions for Django model managers, including:
 
-    smart_create: Creates an object using a smart manager and returns the smart manager.
+    smart_create: Creates an object using a smart manager and returns the smart manager,
+    smart_bulk_create: Creates objects using a smart manager class and many templates and returns the smart managers.
+
+    asmart_create and asmart_bulk_create are their async versions.
     """
     def smart_create(self, sm_class, sm_template):
         """
         Given a smart manager class and template, constructs the object using the smart manager,
         and returns the smart manager object.
         """
-        sm_class_path = '{0}.{1}'.format(inspect.getmodule(sm_class).__name__, sm_class.__name__)
-        return SmartManager.objects.create(smart_manager_class=sm_class_path, template=sm_template)
+        return SmartManager.objects.create(
+            smart_manager_class=get_smart_manager_class_path(sm_class), template=sm_template)
+
+    def smart_bulk_create(self, sm_class, sm_templates, batch_size=None):
+        """
+        Given a smart manager class and a list of templates, constructs the objects of all templates using
+        SmartManager.objects.bulk_build and returns the smart managers in the order of the templates. Batched
+        smart manager classes write the objects of all templates with one bulk upsert per model class.
+        """
+        sm_class_path = get_smart_manager_class_path(sm_class)
+        return SmartManager.objects.bulk_build(
+            [(sm_class_path, sm_template) for sm_template in sm_templates], batch_size=batch_size)
+
+    async def asmart_create(self, sm_class, sm_template):
+        """
+        The async version of smart_create. The build runs in a thread pool without blocking the event loop.
+        """
+        return await run_in_executor(self.smart_create, sm_class, sm_template)
+
+    async def asmart_bulk_create(self, sm_class, sm_templates, batch_size=None):
+        """
+        The async version of smart_bulk_create.
+        """
+        return await run_in_executor(self.smart_bulk_create, sm_class, sm_templates, batch_size=batch_size)
@@ -0,0 +1,54 @@
+from functools import lru_cache
+
+from django.utils.module_loading import autodiscover_modules, import_string
+
+from smart_manager.utils import get_class_path
+
+
+# The maximum number of smart manager classes and paths that are cached in each direction
+CACHE_SIZE = 1024
+
+# Smart manager classes that registered themselves, keyed on their paths
+_registered_classes = {}
+
+
+def register(smart_manager_class):
+    """
+    A class decorator that registers a smart manager class. Registered classes are loaded from the registry
+    instead of being imported by their path. Smart manager classes in the smart_managers module of an installed
+    app are registered when the app registry is ready.
+    """
+    _registered_classes[get_class_path(smart_manager_class)] = smart_manager_class
+    get_smart_manager_class.cache_clear()
+    get_smart_manager_class_path.cache_clear()
+    return smart_manager_class
+
+
+def autodiscover():
+    """
+    Imports the smart_managers module of every installed app so that its smart manager classes are registered.
+    """
+    autodiscover_modules('smart_managers')
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def get_smart_manager_class(class_path):
+    """
+    Returns the smart manager class of a path. Classes that are not registered are imported. Raises an
+    ImportError if the path cannot be imported.
+    """
+    if class_path in _registered_classes:
+        return _registered_classes[class_path]
+
+    try:
+        return import_string(class_path)
+    except ImportError as e:
+        raise ImportError('Cannot load smart manager class {0}: {1}'.format(class_path, e))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def get_smart_manager_class_path(smart_manager_class):
+    """
+    Returns the path used to load a smart manager class.
+    """
+    return get_class_path(smart_manager_class)
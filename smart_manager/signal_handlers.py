@@ -1,16 +1,17 @@
 from django.db.models.signals import pre_delete
 from django.dispatch import receiver
 
-from smart_manager.models import SmartManagerObject
+from smart_manager.models import SmartManager, SmartManagerObject
 
 
 @receiver(pre_delete, sender=SmartManagerObject, dispatch_uid='delete_model_obj_on_smart_manager_object_delete')
 def delete_model_obj_on_smart_manager_object_delete(sender, instance, **kwargs):
     """
     If the model template is managing deletions, delete all of the model objects associated with it before
-    the template is deleted.
+    the template is deleted. This only handles smart manager objects that are deleted one at a time. Querysets
+    of smart manager objects delete their model objects in bulk without sending this signal.
     """
-    if instance.smart_manager.manages_deletions:
+    if SmartManager.objects.filter(id=instance.smart_manager_id, manages_deletions=True).exists():
         try:
             instance.model_obj.delete()
         except:
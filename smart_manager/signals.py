@@ -0,0 +1,10 @@
+from django.dispatch import Signal
+
+
+# Sent after every chunk of a streaming build is written, with the smart manager and the number of objects that
+# have been written so far
+build_progress = Signal()
+
+# Sent after every instrumented build with the smart managers that were built and the BuildStats of the build.
+# Builds are only instrumented when this signal has receivers or a collector has been added
+build_finished = Signal()
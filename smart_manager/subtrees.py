@@ -0,0 +1,196 @@
+from collections import OrderedDict
+import hashlib
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+
+from smart_manager.context import BuildContext
+from smart_manager.registry import get_smart_manager_class_path
+from smart_manager.templates import unwrap_template
+
+
+class SubtreeRecorder(object):
+    """
+    Records the subtrees that are built by child builders during a build. Subtrees that were recorded by the
+    previous build can be reused when the fingerprint of the child builder class and template has not changed.
+    One recorder is shared by all builders in a build.
+    """
+    def __init__(self, subtrees=None):
+        # The serialized subtrees of the previous build keyed on their fingerprints
+        self.subtrees = subtrees or {}
+
+        # The child builders and the objects they returned for the subtrees built by this build
+        self._built_subtrees = OrderedDict()
+
+        # The serialized subtrees that were reused by this build
+        self._reused_subtrees = {}
+
+    def load(self, subtree_fingerprint, context=None):
+        """
+        Returns the keys of the built objects and the result of a subtree from the previous build, or None if it
+        cannot be reused.
+        """
+        descendants = get_subtree_descendants(self.subtrees, subtree_fingerprint)
+        if descendants is None:
+            return None
+
+        loaded_subtree = load_subtree(descendants, subtree_fingerprint, context)
+        if loaded_subtree is not None:
+            self._reused_subtrees.update(descendants)
+        return loaded_subtree
+
+    def record(self, subtree_fingerprint, smart_manager, built_objs):
+        self._built_subtrees[subtree_fingerprint] = (smart_manager, built_objs)
+
+    def serialize(self):
+        """
+        Serializes the subtrees of this build. This must be called after the build has been flushed. A subtree
+        only keeps the objects that were not built by its serialized child subtrees, since those are loaded from
+        the subtrees of the children.
+        """
+        subtrees = dict(self._reused_subtrees)
+
+        # The keys of the objects built by serialized subtrees and their descendants. Child builders are recorded
+        # before their parents, so their subtrees are serialized first
+        subtree_built_obj_keys = {}
+        for subtree_fingerprint, (smart_manager, built_objs) in self._built_subtrees.items():
+            built_obj_keys = set(smart_manager.get_built_objs())
+            own_built_obj_keys = set(built_obj_keys)
+            child_subtree_fingerprints = []
+            for child_subtree_fingerprint in smart_manager._subtree_fingerprints:
+                child_built_obj_keys = get_subtree_built_obj_keys(
+                    subtrees, child_subtree_fingerprint, subtree_built_obj_keys)
+                if child_built_obj_keys is not None:
+                    own_built_obj_keys -= child_built_obj_keys
+                    child_subtree_fingerprints.append(child_subtree_fingerprint)
+
+            subtree = serialize_subtree(smart_manager, built_objs, own_built_obj_keys, child_subtree_fingerprints)
+            if subtree is not None:
+                subtrees[subtree_fingerprint] = subtree
+                subtree_built_obj_keys[subtree_fingerprint] = built_obj_keys
+
+        return subtrees
+
+
+class SubtreeTemplateEncoder(DjangoJSONEncoder):
+    """
+    Encodes child templates for fingerprinting. Model objects are encoded with their model and pk. Templates that
+    contain unsaved model objects cannot be fingerprinted.
+    """
+    def default(self, o):
+        if isinstance(o, models.Model):
+            if o.pk is None:
+                raise TypeError('Cannot fingerprint a template with an unsaved {0}'.format(o.__class__.__name__))
+            return [o._meta.label, o.pk]
+        return super(SubtreeTemplateEncoder, self).default(o)
+
+
+def get_subtree_fingerprint(smart_manager_class, template):
+    """
+    Returns a hash of a child builder class and its template, or None if the template cannot be fingerprinted.
+    """
+    try:
+        encoded_template = json.dumps(
+            [get_smart_manager_class_path(smart_manager_class), unwrap_template(template)],
+            sort_keys=True, cls=SubtreeTemplateEncoder)
+    except TypeError:
+        return None
+    return hashlib.sha256(encoded_template.encode('utf-8')).hexdigest()
+
+
+def serialize_model_obj(model_obj, context=None):
+    """
+    Returns a (content type id, pk) list for a model object. The content type is resolved with the build context
+    if one is given.
+    """
+    return list((context or BuildContext()).get_model_obj_key(model_obj))
+
+
+def load_model_obj(serialized_model_obj, context=None):
+    """
+    Returns an instance of a serialized model object without querying for it. All fields other than the pk are
+    deferred and loaded from the database when they are accessed. Returns None if the model no longer exists.
+    """
+    return (context or BuildContext()).load_model_obj(*serialized_model_obj)
+
+
+def serialize_subtree(smart_manager, built_objs, built_obj_keys, subtree_fingerprints):
+    """
+    Serializes the keys of the objects built by a child builder but not by its child subtrees, the objects it
+    returned and the fingerprints of its child subtrees. Returns None if the child returned something other than
+    model objects.
+    """
+    if not all(built_obj is None or isinstance(built_obj, models.Model) for built_obj in built_objs):
+        return None
+
+    context = smart_manager._context
+    return {
+        'built_objs': sorted(list(built_obj_key) for built_obj_key in built_obj_keys),
+        'result': [
+            serialize_model_obj(built_obj, context) if built_obj is not None else None for built_obj in built_objs
+        ],
+        'subtrees': subtree_fingerprints,
+    }
+
+
+def load_subtree(subtrees, subtree_fingerprint, context=None):
+    """
+    Loads the keys of the objects built by a subtree and its descendants and the objects the subtree returned.
+    Returns None if any of the objects can no longer be loaded.
+    """
+    context = context or BuildContext()
+    built_obj_keys = get_subtree_built_obj_keys(subtrees, subtree_fingerprint)
+    if built_obj_keys is None or any(
+        context.get_model_class(content_type_id) is None for content_type_id, pk in built_obj_keys
+    ):
+        return None
+
+    serialized_result = subtrees[subtree_fingerprint]['result']
+    result = [
+        context.load_model_obj(*built_obj) if built_obj is not None else None for built_obj in serialized_result
+    ]
+    if any(
+        built_obj is None and serialized_built_obj is not None
+        for built_obj, serialized_built_obj in zip(result, serialized_result)
+    ):
+        return None
+
+    return list(built_obj_keys), result
+
+
+def get_subtree_descendants(subtrees, subtree_fingerprint):
+    """
+    Returns the fingerprints and serialized subtrees of a subtree and all of its descendants, or None if any of
+    them is missing.
+    """
+    descendants = {}
+    subtree_fingerprints = [subtree_fingerprint]
+    while subtree_fingerprints:
+        subtree_fingerprint = subtree_fingerprints.pop()
+        if subtree_fingerprint not in subtrees:
+            return None
+        if subtree_fingerprint not in descendants:
+            descendants[subtree_fingerprint] = subtrees[subtree_fingerprint]
+            subtree_fingerprints.extend(subtrees[subtree_fingerprint]['subtrees'])
+
+    return descendants
+
+
+def get_subtree_built_obj_keys(subtrees, subtree_fingerprint, cache=None):
+    """
+    Returns the keys of the objects built by a serialized subtree and all of its descendants, or None if any of
+    them is missing. The keys of subtrees that are in the cache are not loaded again.
+    """
+    if cache is not None and subtree_fingerprint in cache:
+        return cache[subtree_fingerprint]
+
+    descendants = get_subtree_descendants(subtrees, subtree_fingerprint)
+    if descendants is None:
+        return None
+
+    built_obj_keys = set(
+        tuple(built_obj_key) for subtree in descendants.values() for built_obj_key in subtree['built_objs'])
+    if cache is not None:
+        cache[subtree_fingerprint] = built_obj_keys
+    return built_obj_keys
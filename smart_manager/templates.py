@@ -0,0 +1,210 @@
+from collections.abc import ItemsView, ValuesView
+from copy import deepcopy
+
+
+class BaseTemplateView(object):
+    """
+    A copy-on-write view of a dict, list or tuple in a template. Views are dicts, lists and tuples themselves, so they
+    can be checked with isinstance, encoded with json.dumps and stored in JSON fields. A view holds a shallow copy of
+    the container it wraps, and nested containers are wrapped in views of their own when they are read. The template
+    is never modified, and the containers that are not read through a view are shared instead of copied.
+    """
+    def _init_view(self, child_views):
+        # The views of nested containers keyed on the ids of the containers, and the views keyed on their own ids. The
+        # containers are kept with their views so that their ids cannot be reused
+        self._child_views = child_views
+
+        # The ids of the nested containers that are held more than once. All of the places that hold one of them are
+        # replaced by its view when it is read, so writes to it are seen everywhere it is held
+        seen_ids, self._duplicate_ids = set(), set()
+        for value in self._values():
+            if isinstance(value, (dict, list, tuple)):
+                (self._duplicate_ids if id(value) in seen_ids else seen_ids).add(id(value))
+
+    def _read(self, key, value):
+        """
+        Returns the view of a value that was read and stores it in place of the value.
+        """
+        view = wrap_template(value, self._child_views)
+        if view is not value:
+            if id(value) in self._duplicate_ids:
+                for other_key, other_value in list(self._items()):
+                    if other_value is value:
+                        self._set(other_key, view)
+            else:
+                self._set(key, view)
+        return view
+
+    def __repr__(self):
+        return '{0}({1})'.format(self.__class__.__name__, super(BaseTemplateView, self).__repr__())
+
+    def __copy__(self):
+        return self.copy()
+
+    def copy(self):
+        return get_template_view(self)
+
+
+class TemplateDictView(BaseTemplateView, dict):
+    """
+    A copy-on-write view of a dict in a template.
+    """
+    def __init__(self, data):
+        super(TemplateDictView, self).__init__(dict.items(data))
+        self._init_view({})
+
+    def __getitem__(self, key):
+        return self._read(key, dict.__getitem__(self, key))
+
+    def __iter__(self):
+        # Defining __iter__ keeps dict() and ** from copying the nested containers without reading them
+        return dict.__iter__(self)
+
+    def __or__(self, other):
+        view = self.copy()
+        view.update(other)
+        return view
+
+    def __deepcopy__(self, memo):
+        return {deepcopy(key, memo): deepcopy(value, memo) for key, value in dict.items(self)}
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def items(self):
+        return ItemsView(self)
+
+    def values(self):
+        return ValuesView(self)
+
+    def pop(self, key, *args):
+        return wrap_template(dict.pop(self, key, *args), self._child_views)
+
+    def popitem(self):
+        key, value = dict.popitem(self)
+        return key, wrap_template(value, self._child_views)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def _items(self):
+        return dict.items(self)
+
+    def _values(self):
+        return dict.values(self)
+
+    def _set(self, key, value):
+        dict.__setitem__(self, key, value)
+
+
+class TemplateListView(BaseTemplateView, list):
+    """
+    A copy-on-write view of a list in a template.
+    """
+    def __init__(self, data):
+        super(TemplateListView, self).__init__(list.__iter__(data))
+        self._init_view({})
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return TemplateListView(list.__getitem__(self, index))
+        return self._read(index, list.__getitem__(self, index))
+
+    def __iter__(self):
+        i = 0
+        while i < len(self):
+            yield self[i]
+            i += 1
+
+    def __reversed__(self):
+        for i in range(len(self) - 1, -1, -1):
+            yield self[i]
+
+    def __add__(self, other):
+        view = self.copy()
+        view.extend(other)
+        return view
+
+    def __deepcopy__(self, memo):
+        return [deepcopy(value, memo) for value in list.__iter__(self)]
+
+    def pop(self, index=-1):
+        return wrap_template(list.pop(self, index), self._child_views)
+
+    def _items(self):
+        return enumerate(list.__iter__(self))
+
+    def _values(self):
+        return list.__iter__(self)
+
+    def _set(self, index, value):
+        list.__setitem__(self, index, value)
+
+
+class TemplateTupleView(BaseTemplateView, tuple):
+    """
+    A view of a tuple in a template. Tuples cannot be written, so the containers in a tuple are wrapped when the
+    view is made, and writes to them are seen through the tuple.
+    """
+    def __new__(cls, data):
+        child_views = {}
+        view = super(TemplateTupleView, cls).__new__(
+            cls, [wrap_template(value, child_views) for value in tuple.__iter__(data)])
+        view._child_views = child_views
+        return view
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return TemplateTupleView(tuple.__getitem__(self, index))
+        return tuple.__getitem__(self, index)
+
+    def __deepcopy__(self, memo):
+        return tuple(deepcopy(value, memo) for value in tuple.__iter__(self))
+
+
+def get_template_view(template):
+    """
+    Returns a copy-on-write view of a template. Values other than dicts, lists and tuples, such as model objects
+    and iterators, are returned as they are.
+    """
+    if isinstance(template, dict):
+        return TemplateDictView(template)
+    elif isinstance(template, list):
+        return TemplateListView(template)
+    elif isinstance(template, tuple):
+        return TemplateTupleView(template)
+    return template
+
+
+def wrap_template(value, child_views):
+    """
+    Returns the view of a container that was read from a view, given the child views of that view. A container that
+    is held more than once by a view has one view. Views of other templates, such as a part of a parent template in a
+    child template, are wrapped like the containers they view so that writes to them do not reach the other template.
+    """
+    if not isinstance(value, (dict, list, tuple)):
+        return value
+
+    child_view = child_views.get(id(value))
+    if child_view is None or child_view[0] is not value:
+        view = get_template_view(value)
+        child_views[id(value)] = (value, view)
+        child_views[id(view)] = (view, view)
+        return view
+    return child_view[1]
+
+
+def unwrap_template(template):
+    """
+    Returns the plain dicts, lists and tuples of a template view, including any writes that were made to it. The
+    containers that were not read through the view are returned as they are. Other values are returned as they are.
+    """
+    if isinstance(template, TemplateDictView):
+        return {key: unwrap_template(value) for key, value in dict.items(template)}
+    elif isinstance(template, TemplateListView):
+        return [unwrap_template(value) for value in list.__iter__(template)]
+    elif isinstance(template, TemplateTupleView):
+        return tuple(unwrap_template(value) for value in tuple.__iter__(template))
+    return template
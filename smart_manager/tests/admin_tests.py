@@ -1,6 +1,12 @@
-from django.test import TestCase
+from django.contrib.admin.sites import AdminSite
+from django.contrib.auth.models import User
+from django.http import QueryDict
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from mock import MagicMock, patch
 
 from smart_manager import admin
+from smart_manager.admin import EstimatedCountPaginator, SmartManagerAdmin, SmartManagerObjectInline
+from smart_manager.models import SmartManager, SmartManagerObject
 
 
 class AdminTest(TestCase):
@@ -9,3 +15,152 @@ class AdminTest(TestCase):
         Verify the admin is registered properly.
         """
         assert(admin)
+
+
+class SmartManagerAdminTest(TestCase):
+    """
+    Tests listing smart managers in the admin.
+    """
+    def setUp(self):
+        super(SmartManagerAdminTest, self).setUp()
+        self.model_admin = SmartManagerAdmin(SmartManager, AdminSite())
+        self.request = RequestFactory().get('/')
+        self.request.user = User.objects.create(is_superuser=True, is_staff=True)
+        self.smart_managers = [
+            SmartManager.objects.create(
+                smart_manager_class='smart_manager.tests.smart_managers.UpsertModelListTemplate',
+                template=[{'char_field': str(j), 'int_field': j} for j in range(i * 10, i * 10 + i)])
+            for i in range(3)
+        ]
+        self.parent_smart_manager = SmartManager.objects.create(
+            smart_manager_class='smart_manager.tests.smart_managers.ParentSmartManager',
+            template={'char_field': 'parent', 'children': []})
+
+    def test_changelist_queryset(self):
+        """
+        Tests that the list of smart managers is loaded in one query without templates.
+        """
+        changelist = self.model_admin.get_changelist_instance(self.request)
+        with self.assertNumQueries(1):
+            smart_managers = list(changelist.get_queryset(self.request).order_by('id'))
+            self.assertEquals(
+                [str(smart_manager.primary_obj_type) for smart_manager in smart_managers],
+                ['None', 'None', 'None', 'parent model'])
+
+        self.assertEquals(
+            [self.model_admin.num_smart_manager_objs(smart_manager) for smart_manager in smart_managers],
+            [0, 1, 2, 1])
+        self.assertTrue(all(
+            smart_manager.get_deferred_fields() >= {'template', 'built_subtrees'} for smart_manager in smart_managers))
+        self.assertEquals(changelist.result_count, 4)
+
+    def test_num_smart_manager_objs_not_sortable(self):
+        """
+        Tests that the list cannot be sorted by the number of managed objects, which would count the objects of
+        every smart manager in the table.
+        """
+        self.assertFalse(hasattr(self.model_admin.num_smart_manager_objs, 'admin_order_field'))
+        changelist = self.model_admin.get_changelist_instance(self.request)
+        self.assertIsNone(changelist.get_ordering_field('num_smart_manager_objs'))
+
+    def test_queue_rebuild(self):
+        """
+        Tests that the queue rebuild action marks the smart managers as pending.
+        """
+        with patch('smart_manager.models.transaction.on_commit') as mock_on_commit, patch.object(
+            self.model_admin, 'message_user'
+        ) as mock_message_user:
+            self.model_admin.queue_rebuild(
+                self.request, self.model_admin.get_queryset(self.request).filter(id__in=[
+                    self.smart_managers[1].id, self.smart_managers[2].id,
+                ]))
+
+        self.assertEquals(mock_on_commit.call_count, 1)
+        self.assertEquals(
+            set(SmartManager.objects.filter(build_status=SmartManager.PENDING).values_list('id', flat=True)),
+            set([self.smart_managers[1].id, self.smart_managers[2].id]))
+        mock_message_user.assert_called_once_with(self.request, 'Queued 2 smart managers for rebuilding.')
+
+
+class SmartManagerObjectInlineTest(TestCase):
+    """
+    Tests showing the managed objects of a smart manager one page at a time.
+    """
+    def setUp(self):
+        super(SmartManagerObjectInlineTest, self).setUp()
+        self.inline = SmartManagerObjectInline(SmartManager, AdminSite())
+        self.inline.per_page = 2
+        self.smart_manager = SmartManager.objects.create(
+            smart_manager_class='smart_manager.tests.smart_managers.UpsertModelListTemplate',
+            template=[{'char_field': str(i), 'int_field': i} for i in range(5)])
+        self.smart_manager_obj_ids = list(
+            SmartManagerObject.objects.order_by('id').values_list('id', flat=True))
+
+    def get_formset(self, page, **params):
+        if page is not None:
+            params['smo_page'] = page
+        request = RequestFactory().get('/', params)
+        request.user = User.objects.create(username=str(page), is_superuser=True, is_staff=True)
+        return self.inline.get_formset(request, self.smart_manager)(
+            instance=self.smart_manager, queryset=self.inline.get_queryset(request))
+
+    def test_pages(self):
+        formset = self.get_formset(2)
+        self.assertEquals([form.instance.id for form in formset], self.smart_manager_obj_ids[2:4])
+        self.assertEquals((formset.page_number, formset.num_pages, formset.count), (2, 3, 5))
+
+        self.assertEquals([form.instance.id for form in self.get_formset(None)], self.smart_manager_obj_ids[:2])
+        self.assertEquals([form.instance.id for form in self.get_formset('x')], self.smart_manager_obj_ids[:2])
+        self.assertEquals([form.instance.id for form in self.get_formset(10)], self.smart_manager_obj_ids[4:])
+
+    def test_page_query_strings(self):
+        """
+        Tests that links to other pages keep the other parameters of the page.
+        """
+        formset = self.get_formset(2, _changelist_filters='q=a', _popup='1')
+        list(formset)
+        self.assertEquals(
+            QueryDict(formset.previous_page_query_string[1:]).dict(),
+            {'_changelist_filters': 'q=a', '_popup': '1', 'smo_page': '1'})
+        self.assertEquals(
+            QueryDict(formset.next_page_query_string[1:]).dict(),
+            {'_changelist_filters': 'q=a', '_popup': '1', 'smo_page': '3'})
+
+    def test_read_only(self):
+        request = RequestFactory().get('/')
+        self.assertFalse(self.inline.has_add_permission(request, self.smart_manager))
+        self.assertFalse(self.inline.has_change_permission(request, self.smart_manager))
+        self.assertFalse(self.inline.can_delete)
+
+
+class EstimatedCountPaginatorTest(TransactionTestCase):
+    def setUp(self):
+        super(EstimatedCountPaginatorTest, self).setUp()
+        for i in range(3):
+            SmartManager.objects.create(
+                smart_manager_class='smart_manager.tests.smart_managers.UpsertSmartManager',
+                template={'char_field': str(i), 'int_field': i})
+
+    def get_mock_connections(self, row):
+        mock_connection = MagicMock(vendor='postgresql')
+        mock_connection.cursor.return_value.__enter__.return_value.fetchone.return_value = row
+        return {'default': mock_connection}
+
+    def test_exact_count(self):
+        self.assertEquals(EstimatedCountPaginator(SmartManager.objects.all(), 10).count, 3)
+        self.assertEquals(EstimatedCountPaginator([1, 2], 10).count, 2)
+
+    def test_estimated_count(self):
+        with patch('smart_manager.admin.connections', self.get_mock_connections((20000.0,))):
+            self.assertEquals(EstimatedCountPaginator(SmartManager.objects.all(), 10).count, 20000)
+
+    def test_small_or_filtered(self):
+        """
+        Tests that small tables and filtered querysets are counted exactly on PostgreSQL.
+        """
+        with patch('smart_manager.admin.connections', self.get_mock_connections((100.0,))):
+            self.assertEquals(EstimatedCountPaginator(SmartManager.objects.all(), 10).count, 3)
+        with patch('smart_manager.admin.connections', self.get_mock_connections(None)):
+            self.assertEquals(EstimatedCountPaginator(SmartManager.objects.all(), 10).count, 3)
+        with patch('smart_manager.admin.connections', self.get_mock_connections((20000.0,))):
+            self.assertEquals(EstimatedCountPaginator(SmartManager.objects.filter(name=None), 10).count, 3)
@@ -0,0 +1,116 @@
+import asyncio
+import threading
+
+from django.test import TransactionTestCase, override_settings
+from mock import patch
+
+from smart_manager.aio import get_executor, run_in_executor
+from smart_manager.models import SmartManager
+from smart_manager.tests.models import UpsertModel
+from smart_manager.tests.smart_managers import UpsertSmartManager
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class RunInExecutorTest(TransactionTestCase):
+    """
+    Tests running blocking functions from an event loop.
+    """
+    @override_settings(SMART_MANAGER_ASYNC_WORKERS=2)
+    def test_get_executor(self):
+        get_executor.cache_clear()
+        self.addCleanup(get_executor.cache_clear)
+        self.assertEquals(get_executor()._max_workers, 2)
+        self.assertIs(get_executor(), get_executor())
+
+    def test_concurrent(self):
+        """
+        Tests that functions that are run at the same time run concurrently in different threads.
+        """
+        barrier = threading.Barrier(2, timeout=5)
+
+        async def run_both():
+            return await asyncio.gather(
+                run_in_executor(barrier.wait), run_in_executor(barrier.wait))
+
+        self.assertEquals(sorted(run(run_both())), [0, 1])
+
+    @patch('smart_manager.aio.close_old_connections')
+    def test_close_old_connections(self, mock_close_old_connections):
+        """
+        Tests that old connections are closed after every call, even if it fails.
+        """
+        with self.assertRaises(ValueError):
+            run(run_in_executor(int, 'a'))
+        self.assertEquals(run(run_in_executor(int, '1')), 1)
+        self.assertEquals(mock_close_old_connections.call_count, 2)
+
+
+class AsyncApiTest(TransactionTestCase):
+    """
+    Tests the async versions of building and deleting smart managers.
+    """
+    def test_smart_manager(self):
+        """
+        Tests saving, building and deleting a smart manager.
+        """
+        smart_manager = SmartManager(
+            smart_manager_class='smart_manager.tests.smart_managers.UpsertSmartManager',
+            template={'char_field': 'a', 'int_field': 1},
+        )
+        run(smart_manager.asave())
+        self.assertEquals(UpsertModel.objects.get().int_field, 1)
+
+        UpsertModel.objects.update(int_field=2)
+        run(smart_manager.abuild())
+        self.assertEquals(UpsertModel.objects.get().int_field, 1)
+
+        run(smart_manager.adelete())
+        self.assertFalse(SmartManager.objects.exists())
+        self.assertFalse(UpsertModel.objects.exists())
+
+    def test_smart_manager_mixin(self):
+        """
+        Tests creating objects with smart managers.
+        """
+        smart_manager = run(UpsertModel.objects.asmart_create(UpsertSmartManager, {'char_field': 'a', 'int_field': 1}))
+        smart_managers = run(UpsertModel.objects.asmart_bulk_create(UpsertSmartManager, [
+            {'char_field': 'b', 'int_field': 2},
+        ]))
+
+        self.assertEquals(smart_manager.primary_obj, UpsertModel.objects.get(char_field='a'))
+        self.assertEquals(smart_managers[0].primary_obj, UpsertModel.objects.get(char_field='b'))
+
+    def test_smart_model_mixin(self):
+        """
+        Tests upserting and deleting an object with its smart manager.
+        """
+        UpsertModel.objects.smart_create(UpsertSmartManager, {'char_field': 'a', 'int_field': 1})
+        model_obj = UpsertModel.objects.get()
+        run(model_obj.asmart_upsert(UpsertSmartManager, {'char_field': 'a', 'int_field': 2}))
+        self.assertEquals(UpsertModel.objects.get().int_field, 2)
+
+        run(model_obj.asmart_delete())
+        self.assertFalse(SmartManager.objects.exists())
+        self.assertFalse(UpsertModel.objects.exists())
+
+    def test_smart_queryset_mixin(self):
+        """
+        Tests upserting and deleting many objects with their smart managers.
+        """
+        UpsertModel.objects.smart_create(UpsertSmartManager, {'char_field': 'a', 'int_field': 1})
+        model_obj = UpsertModel.objects.get()
+        run(UpsertModel.objects.filter(id=model_obj.id).asmart_upsert_many(UpsertSmartManager, {
+            model_obj.id: {'char_field': 'a', 'int_field': 2},
+        }))
+        self.assertEquals(UpsertModel.objects.get().int_field, 2)
+
+        run(UpsertModel.objects.asmart_delete())
+        self.assertFalse(SmartManager.objects.exists())
+        self.assertFalse(UpsertModel.objects.exists())
@@ -1,9 +1,16 @@
+from django.db import connection
 from django.test import TestCase
 from mock import patch
 
+from smart_manager import batch
 from smart_manager.base import BaseSmartManager
-from smart_manager.tests.smart_managers import UpsertSmartManager
-from smart_manager.tests.models import UpsertModel
+from smart_manager.templates import get_template_view
+from smart_manager.tests.smart_managers import (
+    UpsertSmartManager, BatchUpsertSmartManager, BatchUpsertModelListTemplate, BatchParentSmartManager,
+    BatchParentUnbatchedChildSmartManager, ChildSmartManager,
+)
+from smart_manager.tests.models import UpsertModel, ParentModel, ChildModel
+from smart_manager.utils import can_return_pks_from_bulk_insert
 
 
 class BaseSmartManagerTest(TestCase):
@@ -24,6 +31,48 @@ class BaseSmartManagerTest(TestCase):
         # The template in the model template should remain the same
         self.assertEquals(smart_manager._template, {'hello': 'world'})
 
+    def test_template_deepcopy_view(self):
+        """
+        Tests that a builder that copies its template copies the views it is given by build_using.
+        """
+        class CopyTemplateSmartManager(BaseSmartManager):
+            copy_template = True
+
+        template = {'hello': {'world': [1]}}
+        smart_manager = CopyTemplateSmartManager(get_template_view(template))
+        smart_manager._template['hello']['world'].append(2)
+
+        self.assertEquals(template, {'hello': {'world': [1]}})
+        self.assertEquals(type(smart_manager._template), dict)
+
+    def test_template_deepcopy_model_objs(self):
+        """
+        Tests that model objects in a copied template are not copied.
+        """
+        class CopyTemplateSmartManager(BaseSmartManager):
+            copy_template = True
+
+        parent = ParentModel(char_field='a')
+        template = {'children': [{'parent': parent}]}
+        smart_manager = CopyTemplateSmartManager(get_template_view(template))
+
+        self.assertIsNot(smart_manager._template['children'], template['children'])
+        self.assertIs(smart_manager._template['children'][0]['parent'], parent)
+
+    def test_template_view(self):
+        """
+        Tests that modifying the template in the template class does not modify the input template.
+        """
+        template = {'hello': {'world': [1]}}
+        smart_manager = BaseSmartManager(template)
+
+        # Modify the template in the template class
+        smart_manager._template['hello']['world'].append(2)
+
+        # The input template should remain the same
+        self.assertEquals(template, {'hello': {'world': [1]}})
+        self.assertEquals(smart_manager._template, {'hello': {'world': [1, 2]}})
+
     def test_build_object(self):
         """
         Tests that the build_object function upserts the object and adds it to the built objects list.
@@ -57,6 +106,28 @@ class BaseSmartManagerTest(TestCase):
         self.assertEquals(UpsertModel.objects.count(), 1)
         self.assertEquals(smart_manager.built_objs, set([upsert_model]))
 
+    def test_build_using_shares_built_objs(self):
+        """
+        Tests that child builders add their built objects to the built objects of their parent in place.
+        """
+        smart_manager = BaseSmartManager({})
+        with patch.object(UpsertSmartManager, 'build', autospec=True) as mock_build:
+            mock_build.side_effect = lambda builder: self.assertIs(builder._built_objs, smart_manager._built_objs)
+            smart_manager.build_using(UpsertSmartManager, {'int_field': 1, 'char_field': '2'})
+        self.assertEquals(mock_build.call_count, 1)
+
+    def test_built_objs_deferred(self):
+        """
+        Tests that the built objects are loaded with all fields other than the pk deferred.
+        """
+        smart_manager = BaseSmartManager({})
+        smart_manager.build_obj(UpsertModel, char_field='hi', updates={'int_field': 1})
+
+        with self.assertNumQueries(0):
+            built_obj = list(smart_manager.built_objs)[0]
+        self.assertEquals(built_obj.get_deferred_fields(), set(['char_field', 'int_field']))
+        self.assertEquals(built_obj.char_field, 'hi')
+
     @patch('smart_manager.tests.smart_managers.UpsertSmartManager.build', spec_set=True)
     def test_multi_build_using(self, mock_build):
         """
@@ -68,3 +139,225 @@ class BaseSmartManagerTest(TestCase):
         smart_manager = BaseSmartManager({})
         built_objs = smart_manager.build_using(UpsertSmartManager, {'int_field': 1, 'char_field': '2'})
         self.assertTrue(type(built_objs) in (list, tuple,))
+
+
+class BatchBuildTest(TestCase):
+    """
+    Tests building objects in a batched build.
+    """
+    def setUp(self):
+        super(BatchBuildTest, self).setUp()
+        # Backends that cannot return pks from bulk inserts need another query to fetch the created objects
+        self.num_create_queries = 1 if can_return_pks_from_bulk_insert(connection.alias) else 2
+
+    def test_build_obj_queued(self):
+        """
+        Tests that objects are not written until the build is flushed.
+        """
+        smart_manager = BatchUpsertSmartManager({'char_field': 'hi', 'int_field': 1})
+        upsert_model = smart_manager.build()
+        self.assertIsNone(upsert_model.id)
+        self.assertFalse(UpsertModel.objects.exists())
+
+        smart_manager.flush()
+        self.assertEquals(UpsertModel.objects.get(), upsert_model)
+        self.assertEquals(smart_manager.built_objs, set([upsert_model]))
+
+    def test_built_objs_flushes(self):
+        """
+        Tests that accessing the built objects flushes the build.
+        """
+        smart_manager = BatchUpsertSmartManager({'char_field': 'hi', 'int_field': 1})
+        smart_manager.build()
+        self.assertEquals(smart_manager.built_objs, set([UpsertModel.objects.get()]))
+
+    def test_build_list_num_queries(self):
+        """
+        Tests that the number of queries does not depend on the number of built objects.
+        """
+        template = [{'char_field': str(i), 'int_field': i} for i in range(100)]
+        smart_manager = BatchUpsertModelListTemplate(template)
+        smart_manager.build()
+        with self.assertNumQueries(1 + self.num_create_queries):
+            smart_manager.flush()
+        self.assertEquals(
+            set(UpsertModel.objects.values_list('char_field', 'int_field')),
+            set((str(i), i) for i in range(100)))
+        self.assertEquals(len(smart_manager.built_objs), 100)
+        self.assertTrue(all(built_obj.id for built_obj in smart_manager.built_objs))
+
+        # Update half of the objects. The existing objects are fetched and only changed ones are updated
+        template = [{'char_field': str(i), 'int_field': i + i % 2} for i in range(100)]
+        smart_manager = BatchUpsertModelListTemplate(template)
+        smart_manager.build()
+        with self.assertNumQueries(2):
+            smart_manager.flush()
+        self.assertEquals(
+            set(UpsertModel.objects.values_list('char_field', 'int_field')),
+            set((str(i), i + i % 2) for i in range(100)))
+        self.assertEquals(UpsertModel.objects.count(), 100)
+
+    def test_build_unchanged(self):
+        """
+        Tests that nothing is written when the built objects have not changed.
+        """
+        BatchUpsertSmartManager({'char_field': 'hi', 'int_field': 1}).build()
+        UpsertModel.objects.create(char_field='hi', int_field=1)
+
+        smart_manager = BatchUpsertSmartManager({'char_field': 'hi', 'int_field': 1})
+        upsert_model = smart_manager.build()
+        with self.assertNumQueries(1):
+            smart_manager.flush()
+        self.assertEquals(UpsertModel.objects.get(), upsert_model)
+
+    def test_build_lookup_chunks(self):
+        """
+        Tests fetching existing objects over multiple queries.
+        """
+        template = [{'char_field': str(i), 'int_field': i} for i in range(batch.LOOKUP_CHUNK_SIZE + 1)]
+        smart_manager = BatchUpsertModelListTemplate(template)
+        smart_manager.build()
+        self.assertEquals(len(smart_manager.built_objs), batch.LOOKUP_CHUNK_SIZE + 1)
+        self.assertEquals(UpsertModel.objects.count(), batch.LOOKUP_CHUNK_SIZE + 1)
+
+    def test_build_obj_merges_upserts(self):
+        """
+        Tests that upserting the same object twice in a batch results in one object with the last updates.
+        Defaults are only used when the object is created.
+        """
+        smart_manager = BaseSmartManager({})
+        smart_manager._batch = batch.UpsertBatch()
+        built_obj1 = smart_manager.build_obj(
+            UpsertModel, char_field='hi', updates={'int_field': 1}, is_deletable=False)
+        built_obj2 = smart_manager.build_obj(UpsertModel, char_field='hi', updates={'int_field': 2})
+        self.assertIs(built_obj1, built_obj2)
+        self.assertEquals(len(smart_manager._batch), 1)
+
+        smart_manager.flush()
+        upsert_model = UpsertModel.objects.get()
+        self.assertEquals(upsert_model.int_field, 2)
+        self.assertEquals(smart_manager.built_objs, set([upsert_model]))
+
+    def test_build_obj_defaults(self):
+        """
+        Tests that defaults are only used when creating objects and that existing values are loaded onto
+        the built objects.
+        """
+        smart_manager = BaseSmartManager({})
+        smart_manager._batch = batch.UpsertBatch()
+        smart_manager.build_obj(UpsertModel, char_field='hi', defaults={'int_field': 1})
+        smart_manager.flush()
+
+        smart_manager._batch = batch.UpsertBatch()
+        built_obj = smart_manager.build_obj(UpsertModel, char_field='hi', defaults={'int_field': 2})
+        smart_manager.flush()
+        self.assertEquals(built_obj.int_field, 1)
+        self.assertEquals(UpsertModel.objects.get().int_field, 1)
+
+    def test_build_obj_loads_extant_relations(self):
+        """
+        Tests that relations of existing objects are loaded onto the built objects.
+        """
+        parent1 = ParentModel.objects.create(char_field='parent1')
+        parent2 = ParentModel.objects.create(char_field='parent2')
+        ChildModel.objects.create(parent=parent1, int_field=1)
+
+        smart_manager = BaseSmartManager({})
+        smart_manager._batch = batch.UpsertBatch()
+        built_obj = smart_manager.build_obj(ChildModel, int_field=1, defaults={'parent': parent2})
+        smart_manager.flush()
+        self.assertEquals(built_obj.parent, parent1)
+
+    def test_build_obj_with_pk(self):
+        """
+        Tests batching objects that are looked up by their pk.
+        """
+        smart_manager = BaseSmartManager({})
+        smart_manager._batch = batch.UpsertBatch()
+        built_obj = smart_manager.build_obj(UpsertModel, id=10, updates={'char_field': 'hi', 'int_field': 1})
+        smart_manager.flush()
+        self.assertEquals(built_obj.id, 10)
+        self.assertEquals(UpsertModel.objects.get().id, 10)
+
+    def test_build_obj_multiple_objects_returned(self):
+        """
+        Tests that an error is raised when a lookup matches more than one object.
+        """
+        UpsertModel.objects.create(char_field='hi', int_field=1)
+        UpsertModel.objects.create(char_field='hi', int_field=2)
+
+        smart_manager = BatchUpsertSmartManager({'char_field': 'hi', 'int_field': 1})
+        smart_manager.build()
+        with self.assertRaises(UpsertModel.MultipleObjectsReturned):
+            smart_manager.flush()
+
+    def test_build_obj_related_lookup(self):
+        """
+        Tests that lookups spanning relationships are not queued.
+        """
+        smart_manager = BaseSmartManager({})
+        smart_manager._batch = batch.UpsertBatch()
+        parent = smart_manager.build_obj(ParentModel, char_field='parent')
+        child = smart_manager.build_obj(ChildModel, parent__char_field='parent', defaults={
+            'parent': parent,
+        }, updates={'int_field': 1})
+
+        self.assertIsNotNone(parent.id)
+        self.assertEquals(ChildModel.objects.get(), child)
+        self.assertEquals(smart_manager.built_objs, set([parent, child]))
+
+    def test_build_obj_unsaved_relation(self):
+        """
+        Tests that flushing fails when an object points to an unsaved object that is not in the batch.
+        """
+        smart_manager = BaseSmartManager({})
+        smart_manager._batch = batch.UpsertBatch()
+        smart_manager.build_obj(ChildModel, parent=ParentModel(char_field='parent'), int_field=1)
+        with self.assertRaises(ValueError):
+            smart_manager.flush()
+
+    def test_build_dependency_order(self):
+        """
+        Tests that parents are flushed before the children that point to them.
+        """
+        smart_manager = BatchParentSmartManager({'char_field': 'parent', 'children': [1, 2, 3]})
+        parent = smart_manager.build()
+        self.assertFalse(ParentModel.objects.exists())
+
+        with self.assertNumQueries(2 + 2 * self.num_create_queries):
+            smart_manager.flush()
+        self.assertEquals(ParentModel.objects.get(), parent)
+        self.assertEquals(
+            set(ChildModel.objects.values_list('parent_id', 'int_field')),
+            set([(parent.id, 1), (parent.id, 2), (parent.id, 3)]))
+        self.assertEquals(len(smart_manager.built_objs), 4)
+
+        # Rebuild an existing parent with a different set of children
+        smart_manager = BatchParentSmartManager({'char_field': 'parent', 'children': [1, 4]})
+        smart_manager.build()
+        self.assertEquals(len(smart_manager.built_objs), 3)
+        self.assertEquals(ParentModel.objects.count(), 1)
+        self.assertEquals(ChildModel.objects.count(), 4)
+
+    def test_build_using_unbatched_child(self):
+        """
+        Tests that a batched builder is flushed before building with a builder that is not batched.
+        """
+        smart_manager = BatchParentUnbatchedChildSmartManager({'char_field': 'parent', 'children': [1, 2]})
+        parent = smart_manager.build()
+        self.assertIsNotNone(parent.id)
+        self.assertEquals(ChildModel.objects.filter(parent=parent).count(), 2)
+        self.assertEquals(len(smart_manager.built_objs), 3)
+
+    def test_build_using_batched_child(self):
+        """
+        Tests that a batched child of a builder that is not batched is flushed after it is built.
+        """
+        parent = ParentModel.objects.create(char_field='parent')
+        smart_manager = BaseSmartManager({})
+        built_objs = smart_manager.build_using(BatchUpsertSmartManager, {'char_field': 'hi', 'int_field': 1})
+        self.assertEquals(built_objs, [UpsertModel.objects.get()])
+
+        built_objs = smart_manager.build_using(ChildSmartManager, {'parent': parent, 'int_field': 1})
+        self.assertEquals(built_objs, [ChildModel.objects.get()])
+        self.assertEquals(smart_manager.built_objs, set([UpsertModel.objects.get(), ChildModel.objects.get()]))
@@ -0,0 +1,121 @@
+"""
+Benchmarks for building, rebuilding and deleting smart managers. The benchmarks build trees of UpsertModel
+objects with a child builder for every node. They are run with run_benchmarks.py.
+"""
+from contextlib import contextmanager, ExitStack
+from time import perf_counter
+
+from django.db import connections, transaction
+
+from smart_manager.models import SmartManager
+from smart_manager.registry import get_smart_manager_class_path
+from smart_manager.tests.smart_managers import BatchTreeSmartManager, TreeSmartManager
+
+
+# The scenarios that are measured, in the order they are run
+SCENARIOS = ('build', 'noop_rebuild', 'forced_rebuild', 'partial_rebuild', 'delete')
+
+
+def get_tree_template(breadth, depth, path='0'):
+    """
+    Returns the template of a tree where every node above the given depth has breadth children.
+    """
+    return {
+        'char_field': path,
+        'int_field': 0,
+        'children': [
+            get_tree_template(breadth, depth - 1, '{0}.{1}'.format(path, i)) for i in range(breadth)
+        ] if depth > 0 else [],
+    }
+
+
+def get_num_tree_nodes(breadth, depth):
+    return sum(breadth ** level for level in range(depth + 1))
+
+
+def change_tree_template(template):
+    """
+    Changes the value of the last leaf of a tree template.
+    """
+    while template['children']:
+        template = template['children'][-1]
+    template['int_field'] += 1
+
+
+class Measurement(object):
+    """
+    The wall time in seconds and the number of queries of a scenario.
+    """
+    def __init__(self):
+        self.duration = 0.0
+        self.num_queries = 0
+
+    def count_query(self, execute, sql, params, many, context):
+        self.num_queries += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def measure():
+    """
+    Measures the wall time and queries of the code inside the context.
+    """
+    measurement = Measurement()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(measurement.count_query))
+        start_time = perf_counter()
+        yield measurement
+        measurement.duration = perf_counter() - start_time
+
+
+def run_scenarios(smart_manager_class, template):
+    """
+    Runs every scenario once and returns their measurements keyed on the scenario names.
+    """
+    measurements = {}
+    with measure() as measurements['build']:
+        smart_manager = SmartManager.objects.create(
+            smart_manager_class=get_smart_manager_class_path(smart_manager_class), template=template)
+
+    # Saving an unchanged template is skipped by its fingerprint, while a forced rebuild builds the whole template
+    with measure() as measurements['noop_rebuild']:
+        smart_manager.save()
+
+    with measure() as measurements['forced_rebuild']:
+        smart_manager.save(force_rebuild=True)
+
+    change_tree_template(smart_manager.template)
+    with measure() as measurements['partial_rebuild']:
+        smart_manager.save()
+
+    with measure() as measurements['delete']:
+        smart_manager.delete()
+
+    return measurements
+
+
+def run_benchmark(breadth, depth, batch_build=False, repeat=1):
+    """
+    Runs the scenarios with a tree template repeat times. Every run is rolled back so that every run starts from
+    an empty database. Returns the wall times of every run and the number of queries of the last run for every
+    scenario.
+    """
+    smart_manager_class = BatchTreeSmartManager if batch_build else TreeSmartManager
+    results = {scenario: {'durations': [], 'num_queries': 0} for scenario in SCENARIOS}
+    for i in range(repeat):
+        with transaction.atomic():
+            measurements = run_scenarios(smart_manager_class, get_tree_template(breadth, depth))
+            transaction.set_rollback(True)
+
+        for scenario in SCENARIOS:
+            results[scenario]['durations'].append(measurements[scenario].duration)
+            results[scenario]['num_queries'] = measurements[scenario].num_queries
+
+    return {
+        'breadth': breadth,
+        'depth': depth,
+        'batch_build': batch_build,
+        'num_objs': get_num_tree_nodes(breadth, depth),
+        'scenarios': results,
+    }
@@ -0,0 +1,41 @@
+from django.test import TestCase
+
+from smart_manager.models import SmartManager
+from smart_manager.tests.benchmarks import SCENARIOS, get_num_tree_nodes, get_tree_template, run_benchmark
+from smart_manager.tests.models import UpsertModel
+
+
+class BenchmarkTest(TestCase):
+    """
+    Tests the benchmarks so that they keep working.
+    """
+    def test_get_tree_template(self):
+        """
+        Tests generating the template of a tree.
+        """
+        self.assertEquals(get_tree_template(2, 1), {
+            'char_field': '0',
+            'int_field': 0,
+            'children': [
+                {'char_field': '0.0', 'int_field': 0, 'children': []},
+                {'char_field': '0.1', 'int_field': 0, 'children': []},
+            ],
+        })
+        self.assertEquals(get_num_tree_nodes(3, 2), 13)
+
+    def test_run_benchmark(self):
+        """
+        Tests that every scenario is measured and that every run is rolled back.
+        """
+        for batch_build in (False, True):
+            results = run_benchmark(2, 2, batch_build=batch_build, repeat=2)
+            self.assertEquals(results['num_objs'], 7)
+            self.assertEquals(results['batch_build'], batch_build)
+            for scenario in SCENARIOS:
+                self.assertEquals(len(results['scenarios'][scenario]['durations']), 2)
+                self.assertTrue(results['scenarios'][scenario]['num_queries'] > 0)
+            scenarios = results['scenarios']
+            self.assertLess(scenarios['noop_rebuild']['num_queries'], scenarios['forced_rebuild']['num_queries'])
+
+        self.assertFalse(SmartManager.objects.exists())
+        self.assertFalse(UpsertModel.objects.exists())
@@ -0,0 +1,124 @@
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+from mock import patch
+
+from smart_manager.base import BaseSmartManager
+from smart_manager.context import BuildContext, BuiltObjs
+from smart_manager.tests.models import ChildModel, ParentModel, UpsertModel
+from smart_manager.tests.smart_managers import BatchParentSmartManager
+
+
+class BuildContextTest(TestCase):
+    """
+    Tests resolving and grouping the model objects of a build.
+    """
+    def test_get_content_type(self):
+        """
+        Tests that the content type of a model class is only resolved once.
+        """
+        context = BuildContext()
+        with patch.object(
+            ContentType.objects, 'get_for_model', wraps=ContentType.objects.get_for_model
+        ) as mock_get_for_model:
+            self.assertEquals(context.get_content_type(UpsertModel), ContentType.objects.get_for_model(UpsertModel))
+            self.assertEquals(context.get_content_type(UpsertModel), ContentType.objects.get_for_model(UpsertModel))
+        self.assertEquals(
+            [call for call in mock_get_for_model.call_args_list if call[1].get('for_concrete_model') is False],
+            [((UpsertModel,), {'for_concrete_model': False})])
+
+    def test_get_model_obj_key(self):
+        """
+        Tests getting the content type id and pk of a model object.
+        """
+        upsert_model = UpsertModel.objects.create(char_field='hi', int_field=1)
+        self.assertEquals(
+            BuildContext().get_model_obj_key(upsert_model),
+            (ContentType.objects.get_for_model(UpsertModel).id, upsert_model.id))
+
+    def test_shared_by_child_builders(self):
+        """
+        Tests that child builders use the context of their parent.
+        """
+        smart_manager = BaseSmartManager({})
+        with patch.object(BatchParentSmartManager, 'build', autospec=True) as mock_build:
+            mock_build.side_effect = lambda builder: self.assertIs(builder._context, smart_manager._context)
+            smart_manager.build_using(BatchParentSmartManager, {'char_field': 'parent', 'children': [1]})
+        self.assertEquals(mock_build.call_count, 1)
+
+
+class BuiltObjsTest(TestCase):
+    """
+    Tests tracking the keys of built objects.
+    """
+    def setUp(self):
+        super(BuiltObjsTest, self).setUp()
+        self.context = BuildContext()
+        self.parent = ParentModel.objects.create(char_field='parent')
+        self.children = [ChildModel.objects.create(parent=self.parent, int_field=i) for i in range(2)]
+        self.parent_type_id = ContentType.objects.get_for_model(ParentModel).id
+        self.child_type_id = ContentType.objects.get_for_model(ChildModel).id
+
+    def test_group(self):
+        """
+        Tests grouping the pks of built objects by content type.
+        """
+        built_objs = BuiltObjs(self.context)
+        for model_obj in [self.children[0], self.parent, self.children[1], self.parent]:
+            built_objs.add(model_obj)
+
+        self.assertEquals(len(built_objs), 3)
+        self.assertEquals(list(built_objs.group().items()), [
+            (self.child_type_id, set([self.children[0].id, self.children[1].id])),
+            (self.parent_type_id, set([self.parent.id])),
+        ])
+        self.assertEquals(set(built_objs), set([
+            (self.child_type_id, self.children[0].id),
+            (self.child_type_id, self.children[1].id),
+            (self.parent_type_id, self.parent.id),
+        ]))
+
+    def test_pending_model_objs(self):
+        """
+        Tests that objects without pks are kept until they receive their pks.
+        """
+        built_objs = BuiltObjs(self.context)
+        parent = ParentModel(char_field='pending')
+        built_objs.add(parent)
+        self.assertTrue(built_objs.has_pending_model_objs)
+        self.assertEquals(len(built_objs), 1)
+        self.assertEquals(built_objs.get_model_objs(), [parent])
+
+        parent.save()
+        self.assertEquals(list(built_objs), [(self.parent_type_id, parent.id)])
+        self.assertFalse(built_objs.has_pending_model_objs)
+
+    def test_update(self):
+        """
+        Tests merging built objects in place.
+        """
+        built_objs = BuiltObjs(self.context)
+        built_objs.add(self.children[0])
+        pks = built_objs.group()[self.child_type_id]
+
+        other_built_objs = BuiltObjs(self.context)
+        other_built_objs.add(self.children[1])
+        other_built_objs.add(self.parent)
+        other_built_objs.add(ParentModel(char_field='pending'))
+        built_objs.update(other_built_objs)
+
+        self.assertIs(built_objs.group()[self.child_type_id], pks)
+        self.assertEquals(pks, set([self.children[0].id, self.children[1].id]))
+        self.assertEquals(len(built_objs), 4)
+
+    def test_get_model_objs(self):
+        """
+        Tests that instances of the built objects are loaded without queries.
+        """
+        built_objs = BuiltObjs(self.context)
+        for model_obj in [self.parent] + self.children:
+            built_objs.add(model_obj)
+
+        with self.assertNumQueries(0):
+            model_objs = built_objs.get_model_objs()
+        self.assertEquals(set(model_objs), set([self.parent] + self.children))
+        self.assertEquals(set(model_obj.__class__ for model_obj in model_objs), set([ParentModel, ChildModel]))
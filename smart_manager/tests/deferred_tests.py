@@ -0,0 +1,214 @@
+from django.db import connection, transaction
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from mock import patch, Mock
+
+from smart_manager.deferred import (
+    SynchronousBuildBackend, ThreadPoolBuildBackend, build_deferred_smart_manager, get_build_backend,
+)
+from smart_manager.models import SmartManager
+from smart_manager.tests.models import UpsertModel
+
+
+@override_settings(SMART_MANAGER_BUILD_BACKEND='smart_manager.deferred.SynchronousBuildBackend')
+class DeferredBuildTest(TransactionTestCase):
+    """
+    Tests deferring the builds of smart managers until after they are saved.
+    """
+    def setUp(self):
+        super(DeferredBuildTest, self).setUp()
+        get_build_backend.cache_clear()
+        self.addCleanup(get_build_backend.cache_clear)
+
+    def create_smart_manager(self, template, smart_manager_class='UpsertSmartManager', **kwargs):
+        smart_manager = SmartManager(
+            smart_manager_class='smart_manager.tests.smart_managers.{0}'.format(smart_manager_class),
+            template=template,
+        )
+        smart_manager.save(**kwargs)
+        return smart_manager
+
+    def test_defer_build(self):
+        """
+        Tests that the template is built after the transaction that saved it is committed.
+        """
+        with transaction.atomic():
+            smart_manager = self.create_smart_manager({'char_field': 'a', 'int_field': 1}, defer_build=True)
+            self.assertEquals(SmartManager.objects.get().build_status, SmartManager.PENDING)
+            self.assertFalse(UpsertModel.objects.exists())
+
+        smart_manager = SmartManager.objects.get()
+        self.assertEquals(smart_manager.build_status, SmartManager.BUILT)
+        self.assertIsNotNone(smart_manager.last_built_at)
+        self.assertEquals(smart_manager.primary_obj, UpsertModel.objects.get(char_field='a', int_field=1))
+        self.assertEquals(smart_manager.template_fingerprint, smart_manager.get_template_fingerprint())
+
+    def test_queue_rebuild(self):
+        """
+        Tests queueing rebuilds of saved smart managers, which are built after the transaction is committed.
+        """
+        smart_managers = [self.create_smart_manager({'char_field': str(i), 'int_field': i}) for i in range(3)]
+        UpsertModel.objects.update(int_field=-1)
+
+        with transaction.atomic():
+            self.assertEquals(SmartManager.objects.exclude(id=smart_managers[0].id).queue_rebuild(), 2)
+            self.assertEquals(
+                list(SmartManager.objects.order_by('id').values_list('build_status', flat=True)),
+                [SmartManager.BUILT, SmartManager.PENDING, SmartManager.PENDING])
+            self.assertEquals(UpsertModel.objects.filter(int_field=-1).count(), 3)
+
+        self.assertEquals(
+            list(UpsertModel.objects.order_by('char_field').values_list('int_field', flat=True)), [-1, 1, 2])
+        self.assertEquals(SmartManager.objects.filter(build_status=SmartManager.BUILT).count(), 3)
+
+        with patch('smart_manager.models.transaction.on_commit') as mock_on_commit:
+            self.assertEquals(SmartManager.objects.queue_rebuild(), 3)
+        self.assertTrue(mock_on_commit.called)
+
+    def test_defer_build_class(self):
+        """
+        Tests that smart manager classes can defer their builds and that unchanged templates are not enqueued.
+        """
+        backend = Mock()
+        with patch('smart_manager.models.get_build_backend', return_value=backend):
+            smart_manager = self.create_smart_manager(
+                {'char_field': 'a', 'int_field': 1}, smart_manager_class='DeferredUpsertSmartManager')
+            backend.enqueue.assert_called_once_with(smart_manager.id, force_rebuild=False)
+            self.assertEquals(SmartManager.objects.get().template_fingerprint, '')
+            self.assertFalse(UpsertModel.objects.exists())
+
+            build_deferred_smart_manager(smart_manager.id)
+            smart_manager = SmartManager.objects.get()
+            smart_manager.save()
+            smart_manager.save(update_fields=['name'], force_rebuild=True)
+
+        self.assertEquals(backend.enqueue.call_count, 2)
+        self.assertEquals(backend.enqueue.call_args[1], {'force_rebuild': True})
+        self.assertEquals(SmartManager.objects.get().build_status, SmartManager.PENDING)
+        self.assertEquals(UpsertModel.objects.count(), 1)
+
+    def test_failed_build(self):
+        """
+        Tests that deferred builds that fail are marked as failed until the template is built.
+        """
+        smart_manager = self.create_smart_manager({'char_field': 'a'}, defer_build=True)
+
+        smart_manager = SmartManager.objects.get()
+        self.assertEquals(smart_manager.build_status, SmartManager.FAILED)
+        self.assertTrue('KeyError' in smart_manager.build_error)
+        self.assertEquals(smart_manager.template_fingerprint, '')
+        self.assertFalse(UpsertModel.objects.exists())
+
+        smart_manager.template['int_field'] = 1
+        smart_manager.save(defer_build=True)
+        smart_manager = SmartManager.objects.get()
+        self.assertEquals(smart_manager.build_status, SmartManager.BUILT)
+        self.assertEquals(smart_manager.build_error, '')
+
+    def test_pending_template_already_built(self):
+        """
+        Tests that a pending smart manager is built when it is saved with the template that was last built.
+        """
+        smart_manager = self.create_smart_manager({'char_field': 'a', 'int_field': 1})
+        with patch('smart_manager.models.get_build_backend'):
+            smart_manager.template['int_field'] = 2
+            smart_manager.save(defer_build=True)
+
+        smart_manager = SmartManager.objects.get()
+        self.assertEquals(smart_manager.build_status, SmartManager.PENDING)
+        smart_manager.template['int_field'] = 1
+        smart_manager.save()
+        self.assertEquals(SmartManager.objects.get().build_status, SmartManager.BUILT)
+        self.assertEquals(UpsertModel.objects.get().int_field, 1)
+
+    def test_build_loads_built_subtrees(self):
+        """
+        Tests that deferred builds load the built subtrees with the smart manager unless the rebuild is forced.
+        """
+        smart_manager = self.create_smart_manager({'char_field': 'a', 'int_field': 1})
+        for force_rebuild in (False, True):
+            with CaptureQueriesContext(connection) as queries:
+                build_deferred_smart_manager(smart_manager.id, force_rebuild=force_rebuild)
+            self.assertEquals(
+                '"smart_manager_smartmanager"."built_subtrees"' in queries[0]['sql'], not force_rebuild)
+            self.assertFalse(any('"built_subtrees" FROM' in query['sql'] for query in queries))
+
+    def test_deleted_smart_manager(self):
+        """
+        Tests that deferred builds of smart managers that were deleted are skipped.
+        """
+        build_deferred_smart_manager(0)
+
+    def test_clean(self):
+        """
+        Tests that deferred builders are not built when they are validated.
+        """
+        smart_manager = SmartManager(
+            smart_manager_class='smart_manager.tests.smart_managers.DeferredUpsertSmartManager',
+            template={'char_field': 'a', 'int_field': 1},
+        )
+        smart_manager.clean()
+        self.assertFalse(UpsertModel.objects.exists())
+
+    def test_bulk_build(self):
+        """
+        Tests that smart managers built in bulk are marked as built.
+        """
+        smart_manager = SmartManager.objects.bulk_build([
+            ('smart_manager.tests.smart_managers.UpsertSmartManager', {'char_field': 'a', 'int_field': 1}),
+        ])[0]
+        self.assertEquals(smart_manager.build_status, SmartManager.BUILT)
+        self.assertIsNotNone(SmartManager.objects.get().last_built_at)
+
+
+class BuildBackendTest(TransactionTestCase):
+    """
+    Tests the backends that run deferred builds.
+    """
+    def test_get_build_backend(self):
+        """
+        Tests that the thread pool backend is used by default.
+        """
+        get_build_backend.cache_clear()
+        self.addCleanup(get_build_backend.cache_clear)
+        self.assertEquals(type(get_build_backend()), ThreadPoolBuildBackend)
+        self.assertIs(get_build_backend(), get_build_backend())
+
+    @patch('smart_manager.deferred.build_deferred_smart_manager')
+    def test_synchronous_backend(self, mock_build_deferred_smart_manager):
+        SynchronousBuildBackend().enqueue(1, force_rebuild=True)
+        mock_build_deferred_smart_manager.assert_called_once_with(1, force_rebuild=True)
+
+    @patch('smart_manager.deferred.connections')
+    @patch('smart_manager.deferred.build_deferred_smart_manager')
+    def test_thread_pool_backend_coalesces_builds(self, mock_build_deferred_smart_manager, mock_connections):
+        """
+        Tests that a smart manager that is enqueued again before its build has started is only built once.
+        """
+        backend = ThreadPoolBuildBackend()
+        backend._executor = Mock()
+        backend.enqueue(1)
+        backend.enqueue(1, force_rebuild=True)
+        backend.enqueue(1)
+        backend.enqueue(2)
+        self.assertEquals(backend._executor.submit.call_count, 2)
+
+        backend._build(1)
+        mock_build_deferred_smart_manager.assert_called_once_with(1, force_rebuild=True)
+        self.assertTrue(mock_connections.close_all.called)
+
+        backend.enqueue(1)
+        self.assertEquals(backend._executor.submit.call_count, 3)
+
+    @patch('smart_manager.deferred.connections')
+    @patch('smart_manager.deferred.build_deferred_smart_manager')
+    def test_thread_pool_backend(self, mock_build_deferred_smart_manager, mock_connections):
+        """
+        Tests running builds in a thread pool.
+        """
+        backend = ThreadPoolBuildBackend(max_workers=2)
+        backend.enqueue(1)
+        backend.enqueue(2)
+        backend.shutdown()
+        self.assertEquals(
+            sorted(call[0][0] for call in mock_build_deferred_smart_manager.call_args_list), [1, 2])
@@ -0,0 +1,184 @@
+import json
+
+from django.db import NotSupportedError, connection
+from django.test import TestCase, override_settings
+from mock import MagicMock, patch
+
+from smart_manager.fields import COMPRESSED_TEMPLATE_KEY, TemplateField, json_contains
+from smart_manager.models import SmartManager
+from smart_manager.tests.models import UpsertModel
+
+
+class TemplateFieldTest(TestCase):
+    def test_db_type(self):
+        self.assertEquals(TemplateField().db_type(MagicMock(vendor='postgresql')), 'jsonb')
+        self.assertEquals(TemplateField().db_type(connection), 'text')
+
+    def test_from_db_value(self):
+        """
+        Tests that values are only decoded when they are stored as text.
+        """
+        self.assertEquals(TemplateField().from_db_value('{"a": 1}', None, connection), {'a': 1})
+        self.assertEquals(TemplateField().from_db_value({'a': 1}, None, MagicMock(vendor='postgresql')), {'a': 1})
+        self.assertEquals(TemplateField().from_db_value('a', None, MagicMock(vendor='postgresql')), 'a')
+
+    def test_jsonb_contains(self):
+        queryset = SmartManager.objects.filter(template__jsonb_contains={'a': 1})
+        with self.assertRaises(NotSupportedError):
+            list(queryset)
+
+        with patch.object(connection, 'vendor', 'postgresql'):
+            sql, params = queryset.query.sql_with_params()
+        self.assertIn('"smart_manager_smartmanager"."template" @> %s::jsonb', sql)
+        self.assertEquals(params, ('{"a": 1}',))
+
+    @override_settings(SMART_MANAGER_TEMPLATE_COMPRESSION_THRESHOLD=0)
+    def test_jsonb_contains_not_compressed(self):
+        queryset = SmartManager.objects.filter(template__jsonb_contains={'a': 1})
+        with patch.object(connection, 'vendor', 'postgresql'):
+            self.assertEquals(queryset.query.sql_with_params()[1], ('{"a": 1}',))
+
+
+class TemplateCompressionTest(TestCase):
+    """
+    Tests storing large templates compressed.
+    """
+    def get_stored_template(self, smart_manager):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT template FROM smart_manager_smartmanager WHERE id = %s', [smart_manager.id])
+            return cursor.fetchone()[0]
+
+    def create_smart_manager(self, char_field):
+        return SmartManager.objects.create(
+            smart_manager_class='smart_manager.tests.smart_managers.UpsertSmartManager',
+            template={'char_field': char_field, 'int_field': 1})
+
+    @override_settings(SMART_MANAGER_TEMPLATE_COMPRESSION_THRESHOLD=100)
+    def test_compressed(self):
+        smart_manager = self.create_smart_manager('a' * 200)
+        self.assertEquals(UpsertModel.objects.get().char_field, 'a' * 200)
+        self.assertIn(COMPRESSED_TEMPLATE_KEY, self.get_stored_template(smart_manager))
+        self.assertLess(len(self.get_stored_template(smart_manager)), 100)
+
+        self.assertEquals(SmartManager.objects.get().template, {'char_field': 'a' * 200, 'int_field': 1})
+        self.assertEquals(
+            list(SmartManager.objects.values_list('template', flat=True)), [{'char_field': 'a' * 200, 'int_field': 1}])
+
+    @override_settings(SMART_MANAGER_TEMPLATE_COMPRESSION_THRESHOLD=100)
+    def test_below_threshold(self):
+        smart_manager = self.create_smart_manager('a')
+        self.assertEquals(self.get_stored_template(smart_manager), '{"char_field": "a", "int_field": 1}')
+
+    def test_not_compressed_by_default(self):
+        smart_manager = self.create_smart_manager('a' * 10000)
+        self.assertNotIn(COMPRESSED_TEMPLATE_KEY, self.get_stored_template(smart_manager))
+        self.assertEquals(SmartManager.objects.get().template['char_field'], 'a' * 10000)
+
+    @override_settings(SMART_MANAGER_TEMPLATE_COMPRESSION_THRESHOLD=0)
+    def test_decompress_postgres(self):
+        """
+        Tests decompressing templates that were decoded by psycopg2.
+        """
+        stored = json.loads(TemplateField().get_prep_value({'a': 1}))
+        self.assertEquals(list(stored), [COMPRESSED_TEMPLATE_KEY])
+        self.assertEquals(TemplateField().from_db_value(stored, None, MagicMock(vendor='postgresql')), {'a': 1})
+
+
+class JSONContainsTest(TestCase):
+    def test_objects(self):
+        self.assertTrue(json_contains({'a': 1, 'b': {'c': 2, 'd': 3}}, {'b': {'c': 2}}))
+        self.assertTrue(json_contains({'a': 1}, {}))
+        self.assertFalse(json_contains({'a': 1}, {'b': 1}))
+        self.assertFalse(json_contains({'a': 1}, {'a': 2}))
+        self.assertFalse(json_contains([{'a': 1}], {'a': 1}))
+
+    def test_arrays(self):
+        self.assertTrue(json_contains([1, 2, 3], [3, 1]))
+        self.assertTrue(json_contains([{'a': 1, 'b': 2}, {'c': 3}], [{'a': 1}]))
+        self.assertFalse(json_contains([1, 2], [4]))
+        self.assertFalse(json_contains({'a': 1}, [1]))
+
+    def test_scalars(self):
+        self.assertTrue(json_contains('a', 'a'))
+        self.assertTrue(json_contains(1, 1.0))
+        self.assertFalse(json_contains(1, True))
+        self.assertFalse(json_contains(None, 'a'))
+
+
+class TemplateQueryTest(TestCase):
+    """
+    Tests filtering smart managers by the contents of their templates.
+    """
+    def setUp(self):
+        super(TemplateQueryTest, self).setUp()
+        self.smart_managers = SmartManager.objects.bulk_build([
+            ('smart_manager.tests.smart_managers.UpsertSmartManager', {
+                'char_field': 'a', 'int_field': 1, 'unique_id': 'x', 'tags': ['t1', 't2'],
+            }),
+            ('smart_manager.tests.smart_managers.UpsertSmartManager', {
+                'char_field': 'b', 'int_field': 2, 'unique_id': 'y', 'tags': ['t2'],
+            }),
+            ('smart_manager.tests.smart_managers.UpsertSmartManager', {
+                'char_field': 'c', 'int_field': True, 'unique_id': '1', 'tags': [],
+            }),
+        ])
+
+    def test_template_contains(self):
+        self.assertEquals(list(SmartManager.objects.template_contains({'unique_id': 'x'})), [self.smart_managers[0]])
+        self.assertEquals(
+            list(SmartManager.objects.template_contains({'tags': ['t2']}).order_by('id')), self.smart_managers[:2])
+        self.assertEquals(
+            list(SmartManager.objects.exclude(id=self.smart_managers[0].id).template_contains({'tags': ['t1']})), [])
+
+    def test_template_contains_chunks(self):
+        """
+        Tests that the matching smart managers are looked up in chunks on backends that limit the number of query
+        parameters.
+        """
+        with patch.object(connection.ops, 'bulk_batch_size', return_value=1):
+            queryset = SmartManager.objects.template_contains({'tags': ['t2']})
+        self.assertEquals(queryset.query.sql_with_params()[0].count(' IN ('), 2)
+        self.assertEquals(list(queryset.order_by('id')), self.smart_managers[:2])
+
+    def test_template_contains_postgres(self):
+        with patch.object(connection, 'vendor', 'postgresql'):
+            sql, params = SmartManager.objects.template_contains({'unique_id': 'x'}).query.sql_with_params()
+        self.assertIn('@> %s::jsonb', sql)
+
+    def test_filter_template_key(self):
+        with self.assertNumQueries(1):
+            self.assertEquals(
+                list(SmartManager.objects.filter_template_key('unique_id', 'x')), [self.smart_managers[0]])
+        self.assertEquals(list(SmartManager.objects.filter_template_key('unique_id', 1)), [])
+        self.assertEquals(list(SmartManager.objects.filter_template_key('int_field', 2)), [self.smart_managers[1]])
+        self.assertEquals(list(SmartManager.objects.filter_template_key('missing', 'x')), [])
+
+    def test_filter_template_key_python(self):
+        """
+        Tests filtering by keys whose values cannot be compared by SQLite.
+        """
+        self.assertEquals(list(SmartManager.objects.filter_template_key('int_field', True)), [self.smart_managers[2]])
+        self.assertEquals(list(SmartManager.objects.filter_template_key('tags', ['t1'])), [self.smart_managers[0]])
+        self.assertEquals(list(SmartManager.objects.filter_template_key('a"b', 'x')), [])
+        with patch.object(connection, 'vendor', 'mysql'):
+            self.assertEquals(
+                list(SmartManager.objects.filter_template_key('unique_id', 'y')), [self.smart_managers[1]])
+
+    @override_settings(SMART_MANAGER_TEMPLATE_COMPRESSION_THRESHOLD=10)
+    def test_compressed(self):
+        """
+        Tests that compressed templates are filtered in Python, since the database cannot look inside them.
+        """
+        smart_manager = SmartManager.objects.create(
+            smart_manager_class='smart_manager.tests.smart_managers.UpsertSmartManager',
+            template={'char_field': 'abc', 'int_field': 4})
+        self.assertEquals(list(SmartManager.objects.template_contains({'char_field': 'abc'})), [smart_manager])
+        self.assertEquals(list(SmartManager.objects.filter_template_key('char_field', 'abc')), [smart_manager])
+        self.assertEquals(list(SmartManager.objects.filter_template_key('int_field', 4)), [smart_manager])
+
+        with patch.object(connection, 'vendor', 'postgresql'), patch(
+            'smart_manager.models.json_contains', return_value=True
+        ) as mock_json_contains:
+            sql, params = SmartManager.objects.template_contains({'char_field': 'abc'}).query.sql_with_params()
+        self.assertNotIn('@>', sql)
+        self.assertTrue(mock_json_contains.called)
@@ -0,0 +1,226 @@
+from django.test import TestCase
+from mock import patch
+
+from smart_manager.instrumentation import (
+    BuildStats, InMemoryCollector, add_collector, collect_build_stats, instrument_build, remove_collector,
+)
+from smart_manager.models import SmartManager
+from smart_manager.signals import build_finished
+from smart_manager.tests.models import ChildModel, ParentModel, UpsertModel
+
+
+def get_template(int_fields):
+    return [{'char_field': str(int_field), 'int_field': int_field} for int_field in int_fields]
+
+
+class InstrumentBuildTest(TestCase):
+    """
+    Tests recording the stats of builds.
+    """
+    def assertModelStats(self, stats, model_class, num_created, num_updated, num_unchanged):
+        model_stats = stats.models[model_class._meta.label]
+        self.assertEquals(
+            (model_stats.num_created, model_stats.num_updated, model_stats.num_unchanged),
+            (num_created, num_updated, num_unchanged))
+
+    def assertBuilderObjs(self, stats, builder_objs):
+        self.assertEquals({
+            class_path.split('.')[-1]: (
+                builder_stats.num_created, builder_stats.num_updated, builder_stats.num_unchanged)
+            for class_path, builder_stats in stats.builders.items()
+        }, builder_objs)
+
+    def test_not_instrumented(self):
+        """
+        Tests that builds are not instrumented when there is nothing to send their stats to.
+        """
+        with patch('smart_manager.instrumentation.BuildStats') as mock_build_stats:
+            with instrument_build(SmartManager, []) as stats:
+                self.assertIsNone(stats)
+            SmartManager.objects.create(
+                smart_manager_class='smart_manager.tests.smart_managers.UpsertModelListTemplate',
+                template=get_template(range(2)),
+            )
+        self.assertFalse(mock_build_stats.called)
+
+    def test_nested_builders(self):
+        """
+        Tests recording the builds of nested builders and the objects they built.
+        """
+        with collect_build_stats() as collector:
+            SmartManager.objects.create(
+                smart_manager_class='smart_manager.tests.smart_managers.ParentListSmartManager',
+                template=[{'char_field': 'a', 'children': [1, 2]}, {'char_field': 'b', 'children': [1]}],
+            )
+
+        self.assertEquals(len(collector.stats), 1)
+        stats = collector.stats[0]
+        self.assertEquals(
+            {class_path: builder_stats.num_builds for class_path, builder_stats in stats.builders.items()}, {
+                'smart_manager.tests.smart_managers.ParentListSmartManager': 1,
+                'smart_manager.tests.smart_managers.ParentSmartManager': 2,
+                'smart_manager.tests.smart_managers.ChildSmartManager': 3,
+            })
+        self.assertModelStats(stats, ParentModel, 2, 0, 0)
+        self.assertModelStats(stats, ChildModel, 3, 0, 0)
+        self.assertBuilderObjs(stats, {
+            'ParentListSmartManager': (0, 0, 0), 'ParentSmartManager': (2, 0, 0), 'ChildSmartManager': (3, 0, 0),
+        })
+
+        root_stats = stats.builders['smart_manager.tests.smart_managers.ParentListSmartManager']
+        child_stats = stats.builders['smart_manager.tests.smart_managers.ChildSmartManager']
+        self.assertTrue(0 < child_stats.num_queries < root_stats.num_queries < stats.num_queries)
+        self.assertTrue(0 < child_stats.duration <= root_stats.duration <= stats.duration)
+
+    def test_rebuild_unbatched(self):
+        """
+        Tests counting the created, updated and unchanged objects of a builder that is not batched.
+        """
+        smart_manager = SmartManager.objects.create(
+            smart_manager_class='smart_manager.tests.smart_managers.UpsertModelListTemplate',
+            template=get_template(range(3)),
+        )
+        smart_manager.template = get_template(range(4))
+        smart_manager.template[0]['int_field'] = 5
+        with collect_build_stats() as collector:
+            smart_manager.save()
+
+        self.assertModelStats(collector.stats[0], UpsertModel, 1, 1, 2)
+
+    def test_rebuild_batched(self):
+        """
+        Tests counting the created, updated and unchanged objects of a batched builder.
+        """
+        smart_manager = SmartManager.objects.create(
+            smart_manager_class='smart_manager.tests.smart_managers.BatchUpsertModelListTemplate',
+            template=get_template(range(3)),
+        )
+        smart_manager.template = get_template(range(4))
+        smart_manager.template[0]['int_field'] = 5
+        with collect_build_stats() as collector:
+            smart_manager.clean()
+            smart_manager.save()
+
+        self.assertModelStats(collector.stats[0], UpsertModel, 1, 1, 2)
+        self.assertEquals(list(collector.stats[0].builders), [])
+
+    def test_batched_builder_objs(self):
+        """
+        Tests counting the objects of batched builders for the builders that queued them.
+        """
+        sm_classes_and_templates = [
+            ('smart_manager.tests.smart_managers.BatchParentSmartManager', {'char_field': 'a', 'children': [1, 2]}),
+            ('smart_manager.tests.smart_managers.BatchUpsertSmartManager', {'char_field': '1', 'int_field': 1}),
+        ]
+        with collect_build_stats() as collector:
+            SmartManager.objects.bulk_build(sm_classes_and_templates)
+            UpsertModel.objects.update(int_field=2)
+            SmartManager.objects.rebuild()
+
+        self.assertBuilderObjs(collector.stats[0], {
+            'BatchParentSmartManager': (1, 0, 0),
+            'BatchChildSmartManager': (2, 0, 0),
+            'BatchUpsertSmartManager': (1, 0, 0),
+        })
+        self.assertBuilderObjs(collector.stats[1], {
+            'BatchParentSmartManager': (0, 0, 1),
+            'BatchChildSmartManager': (0, 0, 2),
+            'BatchUpsertSmartManager': (0, 1, 0),
+        })
+
+    def test_stream_build(self):
+        """
+        Tests recording the stats of a streaming build.
+        """
+        with collect_build_stats() as collector:
+            SmartManager.objects.create(
+                smart_manager_class='smart_manager.tests.smart_managers.StreamUpsertModelListTemplate',
+                template=get_template(range(5)),
+            )
+
+        stats = collector.stats[0]
+        self.assertModelStats(stats, UpsertModel, 5, 0, 0)
+        self.assertEquals(
+            stats.builders['smart_manager.tests.smart_managers.StreamUpsertModelListTemplate'].num_builds, 1)
+        self.assertBuilderObjs(stats, {'StreamUpsertModelListTemplate': (5, 0, 0)})
+
+    def test_bulk_build_and_rebuild(self):
+        """
+        Tests that bulk builds and rebuilds send their stats to the build_finished signal.
+        """
+        receiver_calls = []
+
+        def receiver(sender, smart_managers, stats, **kwargs):
+            receiver_calls.append((sender, smart_managers, stats))
+
+        build_finished.connect(receiver, dispatch_uid='instrument_build_test')
+        try:
+            smart_managers = SmartManager.objects.bulk_build([
+                ('smart_manager.tests.smart_managers.BatchUpsertSmartManager', {'char_field': '1', 'int_field': 1}),
+                ('smart_manager.tests.smart_managers.UpsertSmartManager', {'char_field': '2', 'int_field': 2}),
+            ])
+            SmartManager.objects.rebuild()
+        finally:
+            build_finished.disconnect(dispatch_uid='instrument_build_test')
+
+        self.assertEquals(len(receiver_calls), 2)
+        self.assertEquals(receiver_calls[0][:2], (SmartManager, smart_managers))
+        self.assertModelStats(receiver_calls[0][2], UpsertModel, 2, 0, 0)
+        self.assertEquals(set(receiver_calls[1][1]), set(smart_managers))
+        self.assertModelStats(receiver_calls[1][2], UpsertModel, 0, 0, 2)
+
+    def test_failed_build(self):
+        """
+        Tests that the stats of builds that fail are not collected.
+        """
+        with collect_build_stats() as collector:
+            with self.assertRaises(ValueError):
+                with instrument_build(SmartManager, []):
+                    raise ValueError
+        self.assertEquals(collector.stats, [])
+
+
+class CollectorTest(TestCase):
+    """
+    Tests adding and removing collectors.
+    """
+    def test_add_collector(self):
+        """
+        Tests that collectors receive stats until they are removed.
+        """
+        collector = InMemoryCollector()
+        add_collector(collector)
+        try:
+            with instrument_build(SmartManager, []):
+                pass
+        finally:
+            remove_collector(collector)
+        with collect_build_stats():
+            with instrument_build(SmartManager, []):
+                pass
+
+        self.assertEquals(len(collector.stats), 1)
+        collector.clear()
+        self.assertEquals(collector.stats, [])
+
+    def test_as_dict(self):
+        """
+        Tests converting stats to a dict.
+        """
+        stats = BuildStats()
+        stats.num_queries = 3
+        stats.record_objs(UpsertModel, num_created=1)
+        stats.builders['smart_manager.tests.smart_managers.UpsertSmartManager'].num_builds = 1
+        self.assertEquals(stats.as_dict(), {
+            'duration': 0.0,
+            'num_queries': 3,
+            'builders': {
+                'smart_manager.tests.smart_managers.UpsertSmartManager': {
+                    'num_builds': 1, 'duration': 0.0, 'num_queries': 0,
+                    'num_created': 0, 'num_updated': 0, 'num_unchanged': 0,
+                },
+            },
+            'models': {
+                'tests.UpsertModel': {'num_created': 1, 'num_updated': 0, 'num_unchanged': 0},
+            },
+        })
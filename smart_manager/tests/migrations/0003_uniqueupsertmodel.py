@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tests', '0002_parentmodel_childmodel'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UniqueUpsertModel',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('char_field', models.CharField(max_length=128)),
+                ('int_field', models.IntegerField()),
+                ('float_field', models.FloatField(null=True)),
+            ],
+            options={
+                'unique_together': {('char_field', 'int_field')},
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tests', '0003_uniqueupsertmodel'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JSONPayloadModel',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('char_field', models.CharField(max_length=128, unique=True)),
+                ('payload', jsonfield.fields.JSONField()),
+                ('encoded_payload', models.TextField()),
+            ],
+        ),
+    ]
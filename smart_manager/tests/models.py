@@ -1,9 +1,14 @@
 from django.db import models
+from jsonfield import JSONField
 
-from smart_manager.models import SmartManagerMixin, SmartModelMixin
+from smart_manager.models import SmartManagerMixin, SmartModelMixin, SmartQuerySetMixin
 
 
-class UpsertModelManager(models.Manager, SmartManagerMixin):
+class UpsertModelQuerySet(SmartQuerySetMixin, models.QuerySet):
+    pass
+
+
+class UpsertModelManager(models.Manager.from_queryset(UpsertModelQuerySet), SmartManagerMixin):
     pass
 
 
@@ -23,3 +28,36 @@ class RelModel(models.Model):
 
 class CantCascadeModel(models.Model):
     rel_model = models.ForeignKey(RelModel, on_delete=models.PROTECT)
+
+
+class ParentModel(models.Model):
+    """
+    A model for testing objects that are built before the objects that point to them.
+    """
+    char_field = models.CharField(max_length=128, unique=True)
+
+
+class ChildModel(models.Model):
+    parent = models.ForeignKey(ParentModel, on_delete=models.CASCADE)
+    int_field = models.IntegerField()
+
+
+class UniqueUpsertModel(models.Model):
+    """
+    A model with a unique constraint for testing native upserts.
+    """
+    char_field = models.CharField(max_length=128)
+    int_field = models.IntegerField()
+    float_field = models.FloatField(null=True)
+
+    class Meta:
+        unique_together = ('char_field', 'int_field')
+
+
+class JSONPayloadModel(models.Model):
+    """
+    A model for testing objects that store parts of a template as JSON.
+    """
+    char_field = models.CharField(max_length=128, unique=True)
+    payload = JSONField()
+    encoded_payload = models.TextField()
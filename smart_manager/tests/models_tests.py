@@ -1,12 +1,23 @@
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
-from django.db import IntegrityError
+from django.db import IntegrityError, connection
 from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django_dynamic_fixture import G, N
+from mock import patch
 
-from smart_manager.models import SmartManager, SmartManagerObject
-from smart_manager.tests.models import UpsertModel, RelModel, CantCascadeModel
-from smart_manager.tests.smart_managers import UpsertModelListTemplate
+from smart_manager.models import (
+    SmartManager, SmartManagerObject, SmartManagerObjectStream, build_smart_managers, load_built_subtrees,
+    prefetch_smart_managers, sync_smart_manager_objs,
+)
+from smart_manager.registry import get_smart_manager_class_path
+from smart_manager.signals import build_progress
+from smart_manager.tests.models import UpsertModel, RelModel, CantCascadeModel, ChildModel, ParentModel
+from smart_manager.tests.smart_managers import (
+    BatchUpsertSmartManager, StreamPrimaryUpsertModelListTemplate, StreamUpsertModelListTemplate,
+    UpsertModelListTemplate, UpsertSmartManager,
+)
+from smart_manager.utils import bulk_create, can_return_pks_from_bulk_insert, get_class_path
 
 
 class SmartManagerMixinTest(TransactionTestCase):
@@ -44,6 +55,50 @@ class SmartManagerMixinTest(TransactionTestCase):
                     'int_field': 1,
                 }])
 
+    def test_smart_bulk_create(self):
+        """
+        Tests smart_bulk_create.
+        """
+        get_smart_manager_class_path.cache_clear()
+        with patch('smart_manager.registry.get_class_path', side_effect=get_class_path) as mock_get_class_path:
+            sms = UpsertModel.objects.smart_bulk_create(BatchUpsertSmartManager, [
+                {'char_field': str(i), 'int_field': i}
+                for i in range(3)
+            ], batch_size=2)
+        self.assertEquals(mock_get_class_path.call_count, 1)
+
+        self.assertEquals(len(sms), 3)
+        self.assertTrue(all(sm.id for sm in sms))
+        self.assertEquals([sm.primary_obj.char_field for sm in sms], ['0', '1', '2'])
+        self.assertEquals(
+            set(SmartManager.objects.values_list('smart_manager_class', flat=True)),
+            set(['smart_manager.tests.smart_managers.BatchUpsertSmartManager']))
+        self.assertEquals(SmartManagerObject.objects.count(), 3)
+
+    def test_smart_bulk_create_num_queries(self):
+        """
+        Tests that the number of queries of smart_bulk_create with a batched builder does not depend on the number
+        of templates, unlike calling smart_create for every template.
+        """
+        with CaptureQueriesContext(connection) as create_queries:
+            for i in range(3):
+                UpsertModel.objects.smart_create(BatchUpsertSmartManager, {'char_field': str(i), 'int_field': i})
+        with CaptureQueriesContext(connection) as small_bulk_create_queries:
+            UpsertModel.objects.smart_bulk_create(BatchUpsertSmartManager, [
+                {'char_field': str(i), 'int_field': i} for i in range(3, 6)
+            ])
+        with CaptureQueriesContext(connection) as large_bulk_create_queries:
+            UpsertModel.objects.smart_bulk_create(BatchUpsertSmartManager, [
+                {'char_field': str(i), 'int_field': i} for i in range(6, 30)
+            ])
+
+        self.assertLess(len(small_bulk_create_queries), len(create_queries))
+
+        # Backends that cannot return the pks of bulk inserts save every smart manager with its own query
+        num_extra_queries = 0 if can_return_pks_from_bulk_insert(connection.alias) else 24 - 3
+        self.assertEquals(len(large_bulk_create_queries) - len(small_bulk_create_queries), num_extra_queries)
+        self.assertEquals(UpsertModel.objects.count(), 30)
+
 
 class SmartModelMixinTest(TestCase):
     """
@@ -107,6 +162,175 @@ class SmartModelMixinTest(TestCase):
         self.assertFalse(SmartManager.objects.exists())
 
 
+class SmartQuerySetMixinTest(TestCase):
+    """
+    Tests attaching smart managers to model objects in bulk.
+    """
+    def setUp(self):
+        super(SmartQuerySetMixinTest, self).setUp()
+        self.smart_managers = [
+            UpsertModel.objects.smart_create(UpsertSmartManager, {'char_field': str(i), 'int_field': i})
+            for i in range(3)
+        ]
+        G(UpsertModel, char_field='unmanaged', int_field=3)
+
+    def test_with_smart_managers(self):
+        """
+        Tests that the smart managers of all objects are attached with a fixed number of queries.
+        """
+        queryset = UpsertModel.objects.with_smart_managers().order_by('int_field')
+        with self.assertNumQueries(2):
+            ums = list(queryset)
+            self.assertEquals(list(queryset), ums)
+
+        with self.assertNumQueries(0):
+            self.assertEquals([um._get_smart_manager() for um in ums], self.smart_managers + [None])
+
+    def test_with_smart_managers_clone(self):
+        """
+        Tests that querysets derived from a queryset with smart managers also attach them.
+        """
+        queryset = UpsertModel.objects.with_smart_managers().filter(int_field__gt=0).order_by('int_field')
+        with self.assertNumQueries(2):
+            ums = list(queryset.exclude(char_field='unmanaged'))
+        with self.assertNumQueries(0):
+            self.assertEquals([um._get_smart_manager() for um in ums], self.smart_managers[1:])
+
+    def test_with_smart_managers_values(self):
+        """
+        Tests that values querysets are not affected.
+        """
+        queryset = UpsertModel.objects.with_smart_managers().filter(int_field=0)
+        with self.assertNumQueries(1):
+            self.assertEquals(list(queryset.values_list('char_field', flat=True)), ['0'])
+
+    def test_without_smart_managers(self):
+        """
+        Tests that smart managers are looked up for every object when they were not attached.
+        """
+        um = UpsertModel.objects.get(int_field=0)
+        with self.assertNumQueries(1):
+            smart_manager = um._get_smart_manager()
+        self.assertEquals(smart_manager, self.smart_managers[0])
+        self.assertEquals(smart_manager.get_deferred_fields(), set(['template', 'built_subtrees']))
+
+    def test_prefetch_smart_managers(self):
+        """
+        Tests attaching smart managers to a list of objects, including unsaved objects and duplicate objects.
+        """
+        ums = list(UpsertModel.objects.order_by('int_field')) + [UpsertModel.objects.get(int_field=0), UpsertModel()]
+        with patch.object(connection.ops, 'bulk_batch_size', return_value=2):
+            with self.assertNumQueries(2):
+                self.assertEquals(prefetch_smart_managers(um for um in ums), ums)
+
+        self.assertEquals(
+            [um._get_smart_manager() for um in ums],
+            self.smart_managers + [None, self.smart_managers[0], None])
+
+    def test_smart_functions_with_smart_managers(self):
+        """
+        Tests smart_upsert and smart_delete with attached smart managers.
+        """
+        um0, um1, um2, unmanaged_um = UpsertModel.objects.with_smart_managers().order_by('int_field')
+
+        with self.assertNumQueries(0):
+            self.assertEquals(um0._get_smart_manager(), self.smart_managers[0])
+        um0.smart_upsert(UpsertSmartManager, {'char_field': '0', 'int_field': 10})
+        self.assertFalse(hasattr(um0, '_smart_manager_cache'))
+        self.assertEquals(SmartManager.objects.count(), 3)
+        self.assertEquals(UpsertModel.objects.get(char_field='0').int_field, 10)
+
+        um1.smart_delete()
+        self.assertFalse(hasattr(um1, '_smart_manager_cache'))
+        self.assertEquals(SmartManager.objects.count(), 2)
+        self.assertFalse(UpsertModel.objects.filter(char_field='1').exists())
+
+        unmanaged_um.smart_delete()
+        self.assertFalse(UpsertModel.objects.filter(char_field='unmanaged').exists())
+
+    def test_smart_upsert_many(self):
+        """
+        Tests upserting many objects, some of which already have smart managers.
+        """
+        ums = list(UpsertModel.objects.order_by('int_field'))
+        with patch('smart_manager.models.build_smart_managers', side_effect=build_smart_managers) as mock_build:
+            smart_managers = UpsertModel.objects.smart_upsert_many(UpsertSmartManager, {
+                ums[0].id: {'char_field': '0', 'int_field': 10},
+                ums[1].id: {'char_field': '1', 'int_field': 1},
+                ums[3].id: {'char_field': 'unmanaged', 'int_field': 13},
+            })
+
+        # Only the changed smart manager is rebuilt, and the new one is bulk built
+        self.assertEquals(
+            [[smart_manager.template for smart_manager in call[0][0]] for call in mock_build.call_args_list],
+            [[{'char_field': '0', 'int_field': 10}], [{'char_field': 'unmanaged', 'int_field': 13}]])
+
+        self.assertEquals(set(smart_managers), set([ums[0].id, ums[1].id, ums[3].id]))
+        self.assertEquals(smart_managers[ums[0].id].id, self.smart_managers[0].id)
+        self.assertEquals(smart_managers[ums[1].id].id, self.smart_managers[1].id)
+        self.assertEquals(SmartManager.objects.count(), 4)
+        self.assertEquals(
+            SmartManager.objects.get(id=self.smart_managers[0].id).template, {'char_field': '0', 'int_field': 10})
+        self.assertEquals(
+            set(UpsertModel.objects.values_list('char_field', 'int_field')),
+            set([('0', 10), ('1', 1), ('2', 2), ('unmanaged', 13)]))
+        self.assertEquals(
+            SmartManagerObject.objects.get(model_obj_id=ums[3].id).smart_manager_id, smart_managers[ums[3].id].id)
+
+        # Upserting the same templates again does not build anything
+        with patch('smart_manager.models.build_smart_managers', side_effect=build_smart_managers) as mock_build:
+            UpsertModel.objects.filter(int_field__gt=0).smart_upsert_many(UpsertSmartManager, {
+                ums[0].id: {'char_field': '0', 'int_field': 10},
+                ums[3].id: {'char_field': 'unmanaged', 'int_field': 13},
+            })
+        self.assertEquals([call[0][0] for call in mock_build.call_args_list], [[], []])
+
+    def test_smart_upsert_many_shared_smart_manager(self):
+        """
+        Tests upserting objects that are managed by the same smart manager.
+        """
+        smart_manager = UpsertModel.objects.smart_create(UpsertModelListTemplate, [
+            {'char_field': 'a', 'int_field': 1},
+            {'char_field': 'b', 'int_field': 2},
+        ])
+        um_a = UpsertModel.objects.get(char_field='a')
+        um_b = UpsertModel.objects.get(char_field='b')
+
+        smart_managers = UpsertModel.objects.smart_upsert_many(UpsertModelListTemplate, {
+            um_a.id: [{'char_field': 'a', 'int_field': 3}, {'char_field': 'b', 'int_field': 2}],
+            um_b.id: [{'char_field': 'a', 'int_field': 3}, {'char_field': 'b', 'int_field': 4}],
+        })
+
+        self.assertIs(smart_managers[um_a.id], smart_managers[um_b.id])
+        self.assertEquals(smart_managers[um_a.id].id, smart_manager.id)
+        self.assertEquals(
+            set(UpsertModel.objects.filter(char_field__in=['a', 'b']).values_list('char_field', 'int_field')),
+            set([('a', 3), ('b', 4)]))
+
+    def test_smart_upsert_many_non_persisted(self):
+        """
+        Tests upserting objects that do not exist.
+        """
+        with self.assertRaises(ValueError):
+            UpsertModel.objects.smart_upsert_many(UpsertSmartManager, {
+                UpsertModel.objects.order_by('-id').first().id + 1: {'char_field': 'hi', 'int_field': 1},
+            })
+
+    def test_queryset_smart_delete(self):
+        """
+        Tests deleting the objects of a queryset and their smart managers.
+        """
+        with CaptureQueriesContext(connection) as small_delete_queries:
+            UpsertModel.objects.filter(char_field='0').smart_delete()
+        with CaptureQueriesContext(connection) as large_delete_queries:
+            UpsertModel.objects.exclude(char_field='2').smart_delete()
+
+        self.assertEquals(len(small_delete_queries), len(large_delete_queries))
+
+        self.assertEquals(list(SmartManager.objects.all()), [self.smart_managers[2]])
+        self.assertEquals(list(UpsertModel.objects.values_list('char_field', flat=True)), ['2'])
+
+
 class ValidationTest(TransactionTestCase):
     """
     Tests that validation works appropriately.
@@ -173,6 +397,108 @@ class ValidationTest(TransactionTestCase):
         smart_manager.clean()
 
 
+class CleanAndSaveTest(TestCase):
+    """
+    Tests that a template that is validated by clean is not built again when it is saved.
+    """
+    def create_smart_manager(self, smart_manager_class, template):
+        return N(
+            SmartManager,
+            smart_manager_class='smart_manager.tests.smart_managers.{0}'.format(smart_manager_class.__name__),
+            template=template,
+            template_fingerprint='',
+            built_subtrees={},
+            primary_obj_type=None,
+        )
+
+    def patch_build(self, smart_manager_class):
+        return patch.object(smart_manager_class, 'build', autospec=True, side_effect=smart_manager_class.build)
+
+    def test_batched_clean_and_save(self):
+        """
+        Tests that validating a batched template does not write anything and that the template is built once.
+        """
+        smart_manager = self.create_smart_manager(BatchUpsertSmartManager, {'char_field': 'hi', 'int_field': 1})
+        with self.patch_build(BatchUpsertSmartManager) as mock_build:
+            smart_manager.clean()
+            self.assertFalse(UpsertModel.objects.exists())
+            smart_manager.save()
+
+        self.assertEquals(mock_build.call_count, 1)
+        self.assertEquals(smart_manager.primary_obj, UpsertModel.objects.get(char_field='hi', int_field=1))
+        self.assertEquals(SmartManagerObject.objects.get().model_obj, smart_manager.primary_obj)
+
+    def test_clean_and_save(self):
+        """
+        Tests that a template that is not batched is built once.
+        """
+        smart_manager = self.create_smart_manager(UpsertSmartManager, {'char_field': 'hi', 'int_field': 1})
+        with self.patch_build(UpsertSmartManager) as mock_build:
+            smart_manager.clean()
+            self.assertTrue(UpsertModel.objects.filter(char_field='hi', int_field=1).exists())
+            smart_manager.save()
+
+        self.assertEquals(mock_build.call_count, 1)
+        self.assertEquals(smart_manager.primary_obj, UpsertModel.objects.get(char_field='hi', int_field=1))
+        self.assertEquals(SmartManagerObject.objects.get().model_obj, smart_manager.primary_obj)
+
+    def test_template_changed_after_clean(self):
+        """
+        Tests that a template that changes after it was validated is built again.
+        """
+        smart_manager = self.create_smart_manager(BatchUpsertSmartManager, {'char_field': 'hi', 'int_field': 1})
+        with self.patch_build(BatchUpsertSmartManager) as mock_build:
+            smart_manager.clean()
+            smart_manager.template['int_field'] = 2
+            smart_manager.save()
+
+        self.assertEquals(mock_build.call_count, 2)
+        self.assertEquals(list(UpsertModel.objects.values_list('char_field', 'int_field')), [('hi', 2)])
+
+    def test_force_rebuild_after_clean(self):
+        """
+        Tests that forcing a rebuild builds a validated template again.
+        """
+        smart_manager = self.create_smart_manager(BatchUpsertSmartManager, {'char_field': 'hi', 'int_field': 1})
+        with self.patch_build(BatchUpsertSmartManager) as mock_build:
+            smart_manager.clean()
+            smart_manager.save(force_rebuild=True)
+
+        self.assertEquals(mock_build.call_count, 2)
+        self.assertEquals(list(UpsertModel.objects.values_list('char_field', 'int_field')), [('hi', 1)])
+
+    def test_clean_unchanged_template(self):
+        """
+        Tests that a template that has not changed since it was built is not validated again.
+        """
+        smart_manager = self.create_smart_manager(UpsertSmartManager, {'char_field': 'hi', 'int_field': 1})
+        smart_manager.save()
+        smart_manager.name = 'name'
+
+        with patch.object(UpsertSmartManager, 'build', autospec=True) as mock_build:
+            with self.assertNumQueries(0):
+                smart_manager.clean()
+            smart_manager.save()
+        self.assertFalse(mock_build.called)
+
+    def test_invalid_template_rolled_back(self):
+        """
+        Tests that objects written by a template that fails validation are rolled back.
+        """
+        smart_manager = self.create_smart_manager(UpsertModelListTemplate, [
+            {'char_field': 'valid', 'int_field': 1},
+            {'invalid': 'invalid'},
+        ])
+        with self.assertRaises(ValidationError):
+            smart_manager.clean()
+        self.assertFalse(UpsertModel.objects.exists())
+
+        # The failed validation is not used by save
+        smart_manager.template = [{'char_field': 'valid', 'int_field': 1}]
+        smart_manager.save()
+        self.assertTrue(UpsertModel.objects.filter(char_field='valid', int_field=1).exists())
+
+
 class SmartManagerTest(TestCase):
     """
     Tests custom functionality in the SmartManager class.
@@ -271,6 +597,51 @@ class SmartManagerTest(TestCase):
         smart_manager.delete()
         self.assertFalse(UpsertModel.objects.exists())
 
+    def test_batched_template_changes(self):
+        """
+        Tests building, changing and deleting a template with a batched builder.
+        """
+        smart_manager = G(
+            SmartManager,
+            manages_deletions=True,
+            smart_manager_class='smart_manager.tests.smart_managers.BatchUpsertModelListTemplate',
+            template=[{
+                'char_field': 'hi',
+                'int_field': 1,
+            }, {
+                'char_field': 'hello',
+                'int_field': 2,
+            }],
+        )
+        self.assertEquals(UpsertModel.objects.count(), 2)
+        self.assertEquals(SmartManagerObject.objects.count(), 2)
+
+        smart_manager.template = [{
+            'char_field': 'hi',
+            'int_field': 3,
+        }]
+        smart_manager.save()
+        self.assertEquals(UpsertModel.objects.get().int_field, 3)
+        self.assertEquals(SmartManagerObject.objects.get().model_obj, UpsertModel.objects.get())
+
+        smart_manager.delete()
+        self.assertFalse(UpsertModel.objects.exists())
+
+    def test_batched_primary_obj_set(self):
+        """
+        Tests that the primary object of a batched build is set during saving.
+        """
+        smart_manager = G(
+            SmartManager,
+            smart_manager_class='smart_manager.tests.smart_managers.BatchParentSmartManager',
+            template={
+                'char_field': 'parent',
+                'children': [1, 2],
+            },
+        )
+        self.assertEquals(smart_manager.primary_obj, ParentModel.objects.get())
+        self.assertEquals(SmartManagerObject.objects.count(), 3)
+
     def test_template_changes_no_deletions(self):
         """
         Tests chaning the template and resaving when the template model does not manage deletions.
@@ -424,3 +795,739 @@ class SmartManagerTest(TestCase):
         # Delete the model template object, resulting in the deleting of the object it manages
         smart_manager.delete()
         self.assertEquals(UpsertModel.objects.count(), 1)
+
+
+class SmartManagerManagerTest(TestCase):
+    """
+    Tests building and rebuilding smart managers in bulk.
+    """
+    def test_bulk_build(self):
+        """
+        Tests building smart managers in bulk.
+        """
+        smart_managers = SmartManager.objects.bulk_build([
+            (UpsertSmartManager, {'char_field': 'hi', 'int_field': 1}),
+            ('smart_manager.tests.smart_managers.UpsertModelListTemplate', [{
+                'char_field': 'hello',
+                'int_field': 2,
+            }, {
+                'char_field': 'hey',
+                'int_field': 3,
+            }]),
+        ])
+        self.assertEquals(len(smart_managers), 2)
+        self.assertEquals(SmartManager.objects.count(), 2)
+        self.assertEquals(
+            smart_managers[0].smart_manager_class, 'smart_manager.tests.smart_managers.UpsertSmartManager')
+        self.assertEquals(smart_managers[0].primary_obj, UpsertModel.objects.get(char_field='hi'))
+        self.assertIsNone(smart_managers[1].primary_obj)
+        self.assertEquals(UpsertModel.objects.count(), 3)
+        self.assertEquals(
+            set(SmartManagerObject.objects.values_list('smart_manager_id', 'model_obj_id')),
+            set([
+                (smart_managers[0].id, UpsertModel.objects.get(char_field='hi').id),
+                (smart_managers[1].id, UpsertModel.objects.get(char_field='hello').id),
+                (smart_managers[1].id, UpsertModel.objects.get(char_field='hey').id),
+            ]))
+
+        # Deleting a bulk built smart manager deletes its objects
+        smart_managers[1].delete()
+        self.assertEquals(list(UpsertModel.objects.values_list('char_field', flat=True)), ['hi'])
+
+    def test_bulk_build_kwargs(self):
+        """
+        Tests that kwargs are used as field values of every smart manager.
+        """
+        SmartManager.objects.bulk_build([
+            (UpsertSmartManager, {'char_field': 'hi', 'int_field': 1}),
+            (UpsertSmartManager, {'char_field': 'hello', 'int_field': 2}),
+        ], manages_deletions=False)
+        SmartManager.objects.all().delete()
+        self.assertEquals(UpsertModel.objects.count(), 2)
+
+    def test_bulk_build_num_queries(self):
+        """
+        Tests that the number of queries of a batched bulk build does not depend on the number of templates.
+        """
+        def bulk_build(num_templates):
+            return SmartManager.objects.bulk_build([
+                (BatchUpsertSmartManager, {'char_field': str(i), 'int_field': i})
+                for i in range(num_templates)
+            ])
+
+        with CaptureQueriesContext(connection) as small_build_queries:
+            bulk_build(2)
+        SmartManager.objects.all().delete()
+
+        with patch('smart_manager.models.bulk_create', side_effect=bulk_create) as mock_bulk_create:
+            with CaptureQueriesContext(connection) as large_build_queries:
+                smart_managers = bulk_build(20)
+            self.assertEquals(mock_bulk_create.call_count, 1)
+
+        if can_return_pks_from_bulk_insert(connection.alias):
+            self.assertEquals(len(small_build_queries), len(large_build_queries))
+        self.assertEquals(UpsertModel.objects.count(), 20)
+        self.assertEquals(SmartManagerObject.objects.count(), 20)
+        self.assertEquals(
+            [smart_manager.primary_obj.char_field for smart_manager in smart_managers],
+            [str(i) for i in range(20)])
+
+    @patch('smart_manager.utils.can_return_pks_from_bulk_insert', spec_set=True, return_value=False)
+    def test_bulk_build_without_returned_pks(self, mock_can_return_pks_from_bulk_insert):
+        """
+        Tests bulk building on a database that does not return the pks of bulk inserted rows.
+        """
+        smart_managers = SmartManager.objects.bulk_build([
+            (UpsertSmartManager, {'char_field': 'hi', 'int_field': 1}),
+        ])
+        self.assertEquals(SmartManager.objects.get(), smart_managers[0])
+        self.assertEquals(SmartManagerObject.objects.get().smart_manager, smart_managers[0])
+
+    def test_rebuild(self):
+        """
+        Tests rebuilding the smart managers of a queryset.
+        """
+        smart_managers = SmartManager.objects.bulk_build([
+            (UpsertSmartManager, {'char_field': 'hi', 'int_field': 1}),
+            (UpsertModelListTemplate, [{'char_field': 'hello', 'int_field': 2}]),
+            (UpsertModelListTemplate, [{'char_field': 'hey', 'int_field': 3}]),
+        ])
+        SmartManager.objects.filter(id=smart_managers[0].id).update(template={'char_field': 'hi2', 'int_field': 1})
+        SmartManager.objects.filter(id=smart_managers[1].id).update(template=[])
+        UpsertModel.objects.filter(char_field='hey').update(int_field=4)
+
+        rebuilt_smart_managers = SmartManager.objects.filter(id__in=[
+            smart_managers[0].id, smart_managers[1].id,
+        ]).order_by('id').rebuild()
+        self.assertEquals(rebuilt_smart_managers, smart_managers[:2])
+        self.assertEquals(
+            set(UpsertModel.objects.values_list('char_field', 'int_field')),
+            set([('hi2', 1), ('hey', 4)]))
+        self.assertEquals(
+            SmartManager.objects.get(id=smart_managers[0].id).primary_obj, UpsertModel.objects.get(char_field='hi2'))
+        self.assertEquals(
+            set(SmartManagerObject.objects.values_list('smart_manager_id', 'model_obj_id')),
+            set([
+                (smart_managers[0].id, UpsertModel.objects.get(char_field='hi2').id),
+                (smart_managers[2].id, UpsertModel.objects.get(char_field='hey').id),
+            ]))
+
+        # Rebuild all smart managers
+        SmartManager.objects.rebuild()
+        self.assertEquals(UpsertModel.objects.get(char_field='hey').int_field, 3)
+
+
+class ForPrimaryObjsTest(TestCase):
+    """
+    Tests looking up the smart managers of primary objects.
+    """
+    def setUp(self):
+        super(ForPrimaryObjsTest, self).setUp()
+        self.smart_managers = SmartManager.objects.bulk_build([
+            (UpsertSmartManager, {'char_field': str(i), 'int_field': i}) for i in range(3)
+        ])
+        self.parent_smart_manager = SmartManager.objects.create(
+            smart_manager_class='smart_manager.tests.smart_managers.ParentSmartManager',
+            template={'char_field': '0', 'children': []})
+
+    def test_queryset(self):
+        primary_objs = UpsertModel.objects.filter(char_field__in=['0', '2'])
+        with self.assertNumQueries(1):
+            self.assertEquals(
+                set(SmartManager.objects.for_primary_objs(primary_objs)),
+                set([self.smart_managers[0], self.smart_managers[2]]))
+
+    def test_model_objs(self):
+        primary_objs = [
+            UpsertModel.objects.get(char_field='1'), ParentModel.objects.get(), N(UpsertModel),
+        ]
+        with self.assertNumQueries(1):
+            self.assertEquals(
+                set(SmartManager.objects.for_primary_objs(primary_objs)),
+                set([self.smart_managers[1], self.parent_smart_manager]))
+
+    def test_no_model_objs(self):
+        with self.assertNumQueries(0):
+            self.assertEquals(list(SmartManager.objects.for_primary_objs([N(UpsertModel)])), [])
+
+    def test_filtered_queryset(self):
+        self.assertEquals(
+            list(SmartManager.objects.filter(id=self.smart_managers[0].id).for_primary_objs(UpsertModel.objects.all())),
+            [self.smart_managers[0]])
+
+
+class TemplateFingerprintTest(TestCase):
+    """
+    Tests skipping rebuilds of templates that have not changed.
+    """
+    def setUp(self):
+        super(TemplateFingerprintTest, self).setUp()
+        self.smart_manager = SmartManager.objects.create(
+            smart_manager_class='smart_manager.tests.smart_managers.UpsertModelListTemplate',
+            template=[{
+                'char_field': 'hi',
+                'int_field': 1,
+            }],
+        )
+
+    def test_fingerprint_saved(self):
+        """
+        Tests that the fingerprint of the built template is saved.
+        """
+        self.assertEquals(len(self.smart_manager.template_fingerprint), 64)
+        self.assertEquals(
+            SmartManager.objects.get().template_fingerprint, self.smart_manager.get_template_fingerprint())
+
+    def test_fingerprint_key_order(self):
+        """
+        Tests that the fingerprint does not depend on the order of keys in the template.
+        """
+        self.assertEquals(
+            SmartManager(smart_manager_class='a', template={'a': 1, 'b': 2}).get_template_fingerprint(),
+            SmartManager(smart_manager_class='a', template={'b': 2, 'a': 1}).get_template_fingerprint())
+        self.assertNotEqual(
+            SmartManager(smart_manager_class='a', template={'a': 1}).get_template_fingerprint(),
+            SmartManager(smart_manager_class='b', template={'a': 1}).get_template_fingerprint())
+
+    @patch('smart_manager.tests.smart_managers.UpsertModelListTemplate.build', spec_set=True)
+    def test_unchanged_save(self, mock_build):
+        """
+        Tests that saving an unchanged template or changing fields other than the template does not rebuild it.
+        """
+        self.smart_manager.save()
+        self.smart_manager = SmartManager.objects.get()
+        self.smart_manager.name = 'name'
+        self.smart_manager.manages_deletions = False
+        self.smart_manager.save()
+
+        self.assertFalse(mock_build.called)
+        self.assertEquals(SmartManager.objects.get().name, 'name')
+        self.assertEquals(SmartManagerObject.objects.count(), 1)
+
+    def test_changed_save(self):
+        """
+        Tests that changing the template rebuilds it.
+        """
+        self.smart_manager.template = [{'char_field': 'hi', 'int_field': 2}]
+        self.smart_manager.save()
+        self.assertEquals(UpsertModel.objects.get().int_field, 2)
+        self.assertEquals(
+            SmartManager.objects.get().template_fingerprint, self.smart_manager.get_template_fingerprint())
+
+    def test_force_rebuild(self):
+        """
+        Tests that an unchanged template is rebuilt when forced.
+        """
+        UpsertModel.objects.all().delete()
+        self.smart_manager.save()
+        self.assertFalse(UpsertModel.objects.exists())
+
+        self.smart_manager.save(force_rebuild=True)
+        self.assertTrue(UpsertModel.objects.filter(char_field='hi', int_field=1).exists())
+
+    def test_stale_fingerprint(self):
+        """
+        Tests that the fingerprint is compared with the one that was last built rather than the one that was
+        loaded with the smart manager.
+        """
+        smart_manager = SmartManager.objects.get()
+        smart_manager.template = [{'char_field': 'hi', 'int_field': 2}]
+        smart_manager.save()
+
+        self.smart_manager.save()
+        self.assertEquals(UpsertModel.objects.get().int_field, 1)
+
+    def test_update_fields(self):
+        """
+        Tests that the fingerprint is saved when only some fields are updated.
+        """
+        self.smart_manager.template = [{'char_field': 'hi', 'int_field': 2}]
+        self.smart_manager.save(update_fields=['template'])
+        self.assertEquals(
+            SmartManager.objects.get().template_fingerprint, self.smart_manager.get_template_fingerprint())
+        self.assertEquals(UpsertModel.objects.get().int_field, 2)
+
+    def test_bulk_build_and_rebuild(self):
+        """
+        Tests that fingerprints are saved by bulk builds and rebuilds.
+        """
+        smart_manager = SmartManager.objects.bulk_build([(UpsertSmartManager, {'char_field': 'a', 'int_field': 1})])[0]
+        self.assertEquals(
+            SmartManager.objects.get(id=smart_manager.id).template_fingerprint,
+            smart_manager.get_template_fingerprint())
+
+        SmartManager.objects.filter(id=smart_manager.id).update(template={'char_field': 'b', 'int_field': 1})
+        smart_manager = SmartManager.objects.filter(id=smart_manager.id).rebuild()[0]
+        self.assertEquals(
+            SmartManager.objects.get(id=smart_manager.id).template_fingerprint,
+            smart_manager.get_template_fingerprint())
+
+
+class DeferredTemplateTest(TestCase):
+    """
+    Tests that templates are only loaded when they are read.
+    """
+    def setUp(self):
+        super(DeferredTemplateTest, self).setUp()
+        self.smart_manager = SmartManager.objects.create(
+            smart_manager_class='smart_manager.tests.smart_managers.UpsertSmartManager',
+            template={'char_field': 'a', 'int_field': 1})
+
+    def test_deferred(self):
+        smart_manager = SmartManager.objects.get()
+        self.assertEquals(smart_manager.get_deferred_fields(), set(['template', 'built_subtrees']))
+        with self.assertNumQueries(1):
+            self.assertEquals(smart_manager.template, {'char_field': 'a', 'int_field': 1})
+        with self.assertNumQueries(0):
+            self.assertEquals(smart_manager.template, {'char_field': 'a', 'int_field': 1})
+
+    def test_with_templates(self):
+        self.assertEquals(SmartManager.objects.with_templates().get().get_deferred_fields(), set(['built_subtrees']))
+        self.assertEquals(SmartManager.objects.with_templates(built_subtrees=True).get().get_deferred_fields(), set())
+        self.assertEquals(SmartManager.objects.defer('name').with_templates().get().get_deferred_fields(), set([
+            'name', 'built_subtrees']))
+        self.assertEquals(
+            SmartManager.objects.only('id').with_templates(built_subtrees=True).get().get_deferred_fields(),
+            set(field.attname for field in SmartManager._meta.concrete_fields) - set([
+                'id', 'template', 'built_subtrees']))
+
+    def test_load_built_subtrees(self):
+        """
+        Tests that the built subtrees of smart managers that are rebuilt with their subtrees are loaded at once.
+        """
+        other_smart_manager = SmartManager.objects.create(
+            smart_manager_class='smart_manager.tests.smart_managers.UpsertSmartManager',
+            template={'char_field': 'b', 'int_field': 2})
+        SmartManager.objects.filter(id=other_smart_manager.id).update(built_subtrees={'a': {}})
+        smart_managers = list(SmartManager.objects.order_by('id'))
+        smart_managers.append(SmartManager.objects.get(id=other_smart_manager.id))
+        smart_managers.append(SmartManager())
+
+        with patch.object(connection.ops, 'bulk_batch_size', return_value=1):
+            with self.assertNumQueries(2):
+                load_built_subtrees(smart_managers)
+        with self.assertNumQueries(0):
+            self.assertEquals([smart_manager.built_subtrees for smart_manager in smart_managers], [
+                {}, {'a': {}}, {'a': {}}, {}])
+
+    def test_save_deferred(self):
+        """
+        Tests saving a smart manager whose template was not loaded.
+        """
+        smart_manager = SmartManager.objects.get()
+        smart_manager.name = 'name'
+        smart_manager.save()
+        self.assertEquals(SmartManager.objects.with_templates().values_list('name', 'template').get(), (
+            'name', {'char_field': 'a', 'int_field': 1}))
+
+    def test_rebuild(self):
+        """
+        Tests that rebuilding a queryset loads the templates with the smart managers.
+        """
+        UpsertModel.objects.update(int_field=2)
+        with CaptureQueriesContext(connection) as queries:
+            SmartManager.objects.rebuild()
+
+        self.assertEquals(UpsertModel.objects.get().int_field, 1)
+        # The templates are loaded with the smart managers instead of one at a time
+        self.assertFalse(any('"smart_manager_smartmanager"."template" FROM' in query['sql'] for query in queries))
+        self.assertTrue(any('"smart_manager_smartmanager"."template", ' in query['sql'] for query in queries))
+
+    def test_delete(self):
+        """
+        Tests that deleting smart managers does not load their templates.
+        """
+        other_smart_manager = SmartManager.objects.create(
+            smart_manager_class='smart_manager.tests.smart_managers.UpsertSmartManager',
+            template={'char_field': 'b', 'int_field': 2})
+        with CaptureQueriesContext(connection) as queries:
+            SmartManager.objects.filter(id=self.smart_manager.id).delete()
+            SmartManagerObject.objects.get(smart_manager=other_smart_manager).delete()
+
+        self.assertFalse(UpsertModel.objects.exists())
+        self.assertFalse(any(
+            '"smart_manager_smartmanager"."template"' in query['sql'] or '"built_subtrees"' in query['sql']
+            for query in queries if query['sql'].startswith('SELECT')))
+
+
+class SmartManagerObjectDeleteTest(TestCase):
+    """
+    Tests deleting the objects managed by smart managers in bulk.
+    """
+    def create_smart_manager(self, num_objs, **kwargs):
+        return SmartManager.objects.create(
+            smart_manager_class='smart_manager.tests.smart_managers.UpsertModelListTemplate',
+            template=[{'char_field': str(i), 'int_field': i} for i in range(num_objs)],
+            **kwargs
+        )
+
+    def test_delete_num_queries(self):
+        """
+        Tests that the number of queries of a deletion does not depend on the number of managed objects.
+        """
+        smart_manager = self.create_smart_manager(2)
+        with CaptureQueriesContext(connection) as small_delete_queries:
+            smart_manager.delete()
+
+        smart_manager = self.create_smart_manager(20)
+        with CaptureQueriesContext(connection) as large_delete_queries:
+            smart_manager.delete()
+
+        self.assertEquals(len(small_delete_queries), len(large_delete_queries))
+        self.assertFalse(UpsertModel.objects.exists())
+        self.assertFalse(SmartManagerObject.objects.exists())
+
+    def test_delete_num_deleted(self):
+        """
+        Tests that deletions return the number of deleted objects per model.
+        """
+        self.assertEquals(self.create_smart_manager(2).delete(), (5, {
+            'tests.UpsertModel': 2,
+            'smart_manager.SmartManagerObject': 2,
+            'smart_manager.SmartManager': 1,
+        }))
+        self.create_smart_manager(3)
+        self.assertEquals(SmartManager.objects.all().delete(), (7, {
+            'tests.UpsertModel': 3,
+            'smart_manager.SmartManagerObject': 3,
+            'smart_manager.SmartManager': 1,
+        }))
+
+    def test_queryset_delete(self):
+        """
+        Tests that deleting a queryset of smart managers only deletes the objects of smart managers that manage
+        deletions.
+        """
+        self.create_smart_manager(2)
+        SmartManager.objects.create(
+            smart_manager_class='smart_manager.tests.smart_managers.UpsertSmartManager',
+            template={'char_field': 'unmanaged', 'int_field': 1},
+            manages_deletions=False,
+        )
+
+        with patch('smart_manager.signal_handlers.delete_model_obj_on_smart_manager_object_delete') as mock_handler:
+            SmartManager.objects.all().delete()
+        self.assertFalse(mock_handler.called)
+
+        self.assertFalse(SmartManager.objects.exists())
+        self.assertFalse(SmartManagerObject.objects.exists())
+        self.assertEquals(list(UpsertModel.objects.values_list('char_field', flat=True)), ['unmanaged'])
+
+    def test_delete_protected_group(self):
+        """
+        Tests that the unprotected objects of a content type are deleted when some of them are protected.
+        """
+        rel_models = [G(RelModel) for i in range(3)]
+        G(CantCascadeModel, rel_model=rel_models[1])
+        smart_manager = self.create_smart_manager(1)
+        for rel_model in rel_models:
+            SmartManagerObject.objects.create(smart_manager=smart_manager, model_obj=rel_model)
+
+        smart_manager.delete()
+
+        self.assertEquals(list(RelModel.objects.all()), [rel_models[1]])
+        self.assertFalse(UpsertModel.objects.exists())
+        self.assertFalse(SmartManagerObject.objects.exists())
+
+    def test_delete_missing_objs(self):
+        """
+        Tests deleting smart manager objects whose model objects or content types no longer exist.
+        """
+        smart_manager = self.create_smart_manager(2)
+        UpsertModel.objects.filter(char_field='0').delete()
+        SmartManagerObject.objects.create(
+            smart_manager=smart_manager,
+            model_obj_type=ContentType.objects.create(app_label='tests', model='deletedmodel'),
+            model_obj_id=1,
+        )
+
+        smart_manager.delete()
+
+        self.assertFalse(UpsertModel.objects.exists())
+        self.assertFalse(SmartManagerObject.objects.exists())
+
+    def test_delete_cascaded_objs(self):
+        """
+        Tests deleting managed objects that are also deleted by a cascade.
+        """
+        smart_manager = SmartManager.objects.create(
+            smart_manager_class='smart_manager.tests.smart_managers.BatchParentSmartManager',
+            template={'char_field': 'parent', 'children': [1, 2]},
+        )
+
+        smart_manager.delete()
+
+        self.assertFalse(ParentModel.objects.exists())
+        self.assertFalse(ChildModel.objects.exists())
+        self.assertFalse(SmartManagerObject.objects.exists())
+
+    def test_delete_chunks(self):
+        """
+        Tests that model objects are deleted in chunks on backends that limit the number of query parameters.
+        """
+        smart_manager = self.create_smart_manager(5)
+        with patch.object(connection.ops, 'bulk_batch_size', return_value=2):
+            with CaptureQueriesContext(connection) as delete_queries:
+                smart_manager.delete()
+
+        self.assertEquals(
+            len([query for query in delete_queries if query['sql'].startswith('DELETE FROM "tests_upsertmodel"')]), 3)
+        self.assertFalse(UpsertModel.objects.exists())
+
+    def test_instance_delete(self):
+        """
+        Tests that deleting a single smart manager object deletes its model object when deletions are managed.
+        """
+        smart_manager = self.create_smart_manager(1)
+        unmanaged_smart_manager = SmartManager.objects.create(
+            smart_manager_class='smart_manager.tests.smart_managers.UpsertSmartManager',
+            template={'char_field': 'unmanaged', 'int_field': 1},
+            manages_deletions=False,
+        )
+
+        SmartManagerObject.objects.get(smart_manager=smart_manager).delete()
+        SmartManagerObject.objects.get(smart_manager=unmanaged_smart_manager).delete()
+
+        self.assertEquals(list(UpsertModel.objects.values_list('char_field', flat=True)), ['unmanaged'])
+
+        # Protected model objects are not deleted
+        rel_model = G(RelModel)
+        G(CantCascadeModel, rel_model=rel_model)
+        SmartManagerObject.objects.create(smart_manager=smart_manager, model_obj=rel_model).delete()
+        self.assertTrue(RelModel.objects.exists())
+
+
+class SyncSmartManagerObjsTest(TestCase):
+    """
+    Tests syncing the SmartManagerObject rows of built smart managers.
+    """
+    def setUp(self):
+        super(SyncSmartManagerObjsTest, self).setUp()
+        self.smart_manager = SmartManager.objects.create(
+            smart_manager_class='smart_manager.tests.smart_managers.UpsertModelListTemplate',
+            template=[{'char_field': 'a', 'int_field': 1}, {'char_field': 'b', 'int_field': 2}])
+        self.smart_manager_objs = set(SmartManagerObject.objects.values_list('id', 'model_obj_id'))
+
+    def get_written_tables(self, queries):
+        return [
+            query['sql'].split()[0] for query in queries
+            if query['sql'].split()[0] in ('INSERT', 'UPDATE', 'DELETE') and 'smartmanagerobject' in query['sql']
+        ]
+
+    def test_unchanged(self):
+        """
+        Tests that rebuilding the same objects does not write any rows.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            self.smart_manager.save(force_rebuild=True)
+
+        self.assertEquals(self.get_written_tables(queries), [])
+        self.assertEquals(set(SmartManagerObject.objects.values_list('id', 'model_obj_id')), self.smart_manager_objs)
+
+    def test_changed(self):
+        """
+        Tests that only the rows of new objects are inserted and only the rows of objects that are no longer built
+        are deleted.
+        """
+        self.smart_manager.template = [{'char_field': 'b', 'int_field': 2}, {'char_field': 'c', 'int_field': 3}]
+        with CaptureQueriesContext(connection) as queries:
+            self.smart_manager.save()
+
+        self.assertEquals(self.get_written_tables(queries), ['DELETE', 'INSERT'])
+        b, c = UpsertModel.objects.get(char_field='b'), UpsertModel.objects.get(char_field='c')
+        self.assertFalse(UpsertModel.objects.filter(char_field='a').exists())
+        self.assertIn((SmartManagerObject.objects.get(model_obj_id=b.id).id, b.id), self.smart_manager_objs)
+        self.assertEquals(
+            set(SmartManagerObject.objects.values_list('model_obj_id', flat=True)), set([b.id, c.id]))
+
+    def test_move_between_smart_managers(self):
+        """
+        Tests syncing the rows of several smart managers at once, when an object moves from one to another.
+        """
+        SmartManager.objects.filter(id=self.smart_manager.id).update(manages_deletions=False)
+        self.smart_manager.refresh_from_db()
+        other_smart_manager = SmartManager.objects.create(
+            smart_manager_class='smart_manager.tests.smart_managers.UpsertModelListTemplate', template=[])
+        self.smart_manager.template = [{'char_field': 'a', 'int_field': 1}]
+        other_smart_manager.template = [{'char_field': 'b', 'int_field': 2}]
+        builds = build_smart_managers([self.smart_manager, other_smart_manager])
+        sync_smart_manager_objs([(self.smart_manager, builds[0][0]), (other_smart_manager, builds[1][0])])
+
+        self.assertEquals(set(SmartManagerObject.objects.values_list('smart_manager_id', 'model_obj_id')), {
+            (self.smart_manager.id, UpsertModel.objects.get(char_field='a').id),
+            (other_smart_manager.id, UpsertModel.objects.get(char_field='b').id),
+        })
+
+
+class StreamBuildTest(TestCase):
+    """
+    Tests saving smart managers with streaming builders.
+    """
+    def setUp(self):
+        super(StreamBuildTest, self).setUp()
+        self.progress = []
+        build_progress.connect(self.on_build_progress, dispatch_uid='stream_build_test')
+
+    def tearDown(self):
+        super(StreamBuildTest, self).tearDown()
+        build_progress.disconnect(dispatch_uid='stream_build_test')
+
+    def on_build_progress(self, sender, smart_manager, num_built_objs, **kwargs):
+        self.progress.append((smart_manager.id, num_built_objs))
+
+    def get_template(self, int_fields):
+        return [{'char_field': str(int_field), 'int_field': int_field} for int_field in int_fields]
+
+    def assertManaged(self, smart_manager, char_fields):
+        self.assertEquals(
+            set(SmartManagerObject.objects.filter(smart_manager=smart_manager).values_list('model_obj_id', flat=True)),
+            set(UpsertModel.objects.filter(char_field__in=char_fields).values_list('id', flat=True)))
+        self.assertEquals(SmartManagerObject.objects.count(), len(char_fields))
+
+    def test_stream_build(self):
+        """
+        Tests that the objects and their smart manager objects are written in chunks.
+        """
+        with patch.object(
+            SmartManagerObjectStream, 'write', autospec=True, side_effect=SmartManagerObjectStream.write
+        ) as mock_write:
+            smart_manager = SmartManager.objects.create(
+                smart_manager_class='smart_manager.tests.smart_managers.StreamUpsertModelListTemplate',
+                template=self.get_template(range(5)),
+            )
+
+        self.assertEquals(self.progress, [(smart_manager.id, 2), (smart_manager.id, 4), (smart_manager.id, 5)])
+        self.assertEquals(mock_write.call_count, 3)
+        self.assertEquals(SmartManager.objects.get().built_subtrees, {})
+        self.assertEquals(UpsertModel.objects.count(), 5)
+        self.assertManaged(smart_manager, ['0', '1', '2', '3', '4'])
+
+    def test_stream_rebuild(self):
+        """
+        Tests that objects that are no longer built are deleted and that the rows of the other objects are kept.
+        """
+        smart_manager = SmartManager.objects.create(
+            smart_manager_class='smart_manager.tests.smart_managers.StreamUpsertModelListTemplate',
+            template=self.get_template(range(5)),
+        )
+        smart_manager_obj_ids = set(SmartManagerObject.objects.values_list('id', flat=True))
+
+        smart_manager.template = self.get_template(range(2, 7))
+        smart_manager.save()
+
+        self.assertEquals(SmartManager.objects.count(), 1)
+        self.assertEquals(
+            set(UpsertModel.objects.values_list('char_field', flat=True)), set(['2', '3', '4', '5', '6']))
+        self.assertManaged(smart_manager, ['2', '3', '4', '5', '6'])
+        self.assertEquals(
+            len(smart_manager_obj_ids & set(SmartManagerObject.objects.values_list('id', flat=True))), 3)
+
+    def test_stream_rebuild_without_deletions(self):
+        """
+        Tests that objects that are no longer built are kept when the smart manager does not manage deletions.
+        """
+        smart_manager = SmartManager.objects.create(
+            smart_manager_class='smart_manager.tests.smart_managers.StreamUpsertModelListTemplate',
+            template=self.get_template(range(3)),
+            manages_deletions=False,
+        )
+        smart_manager.template = self.get_template(range(1, 3))
+        smart_manager.save()
+
+        self.assertEquals(UpsertModel.objects.count(), 3)
+        self.assertManaged(smart_manager, ['1', '2'])
+
+    def test_stream_duplicate_objs(self):
+        """
+        Tests streaming a template that builds the same object in different chunks.
+        """
+        smart_manager = SmartManager.objects.create(
+            smart_manager_class='smart_manager.tests.smart_managers.StreamUpsertModelListTemplate',
+            template=self.get_template([0, 1, 2, 0, 3]),
+        )
+
+        self.assertEquals(UpsertModel.objects.count(), 4)
+        self.assertManaged(smart_manager, ['0', '1', '2', '3'])
+
+    def test_stream_unbatched_children(self):
+        """
+        Tests streaming with child builders that are not batched.
+        """
+        smart_manager = SmartManager.objects.create(
+            smart_manager_class='smart_manager.tests.smart_managers.StreamParentListSmartManager',
+            template=[{'char_field': 'a', 'children': [1, 2]}, {'char_field': 'b', 'children': [1]}],
+        )
+
+        self.assertEquals(self.progress, [(smart_manager.id, 3), (smart_manager.id, 5)])
+        self.assertEquals(ParentModel.objects.count(), 2)
+        self.assertEquals(ChildModel.objects.count(), 3)
+        self.assertEquals(SmartManagerObject.objects.filter(smart_manager=smart_manager).count(), 5)
+
+    def test_stream_bulk_build_primary_obj(self):
+        """
+        Tests that the objects of streaming builders are written before the primary objects are set in a bulk build.
+        """
+        smart_manager = SmartManager.objects.bulk_build([
+            (StreamPrimaryUpsertModelListTemplate, self.get_template(range(3))),
+        ])[0]
+
+        self.assertEquals(smart_manager.primary_obj, UpsertModel.objects.get(char_field='0'))
+        self.assertEquals(SmartManager.objects.get().primary_obj_id, smart_manager.primary_obj_id)
+        self.assertManaged(smart_manager, ['0', '1', '2'])
+
+    def test_stream_rebuild_primary_obj(self):
+        """
+        Tests that the objects of streaming builders are written before the primary objects are set in a rebuild.
+        """
+        smart_manager = SmartManager.objects.create(
+            smart_manager_class='smart_manager.tests.smart_managers.StreamPrimaryUpsertModelListTemplate',
+            template=self.get_template(range(3)),
+        )
+        UpsertModel.objects.all().delete()
+
+        SmartManager.objects.all().rebuild()
+        self.assertEquals(SmartManager.objects.get().primary_obj, UpsertModel.objects.get(char_field='0'))
+        self.assertManaged(smart_manager, ['0', '1', '2'])
+
+        UpsertModel.objects.all().delete()
+        smart_manager.build()
+        self.assertEquals(SmartManager.objects.get().primary_obj, UpsertModel.objects.get(char_field='0'))
+        self.assertManaged(smart_manager, ['0', '1', '2'])
+
+    def test_stream_chunks(self):
+        """
+        Tests that rows are written in chunks on backends that limit the number of query parameters.
+        """
+        with patch.object(connection.ops, 'bulk_batch_size', return_value=1):
+            smart_manager = SmartManager.objects.create(
+                smart_manager_class='smart_manager.tests.smart_managers.StreamUpsertModelListTemplate',
+                template=self.get_template(range(3)),
+            )
+        self.assertManaged(smart_manager, ['0', '1', '2'])
+
+    def test_stream_template_not_copied(self):
+        """
+        Tests that streaming builders consume their template as it is given.
+        """
+        template = self.get_template(range(3))
+        self.assertIs(StreamUpsertModelListTemplate(template)._template, template)
+
+        template = iter(self.get_template(range(3)))
+        builder = StreamUpsertModelListTemplate(template)
+        self.assertIs(builder._template, template)
+        builder.build()
+        builder.flush()
+        self.assertEquals(UpsertModel.objects.count(), 3)
+
+    def test_stream_clean(self):
+        """
+        Tests that streaming builders are not built when they are validated.
+        """
+        smart_manager = N(
+            SmartManager,
+            smart_manager_class='smart_manager.tests.smart_managers.StreamUpsertModelListTemplate',
+            template=self.get_template(range(3)),
+            template_fingerprint='',
+        )
+        smart_manager.clean()
+        self.assertFalse(UpsertModel.objects.exists())
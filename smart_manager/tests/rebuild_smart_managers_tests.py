@@ -0,0 +1,158 @@
+from io import StringIO
+import json
+import os
+import shutil
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from mock import patch
+
+from smart_manager.management.commands.rebuild_smart_managers import rebuild_chunk
+from smart_manager.models import SmartManager
+from smart_manager.tests.models import UpsertModel
+
+
+class FakeAsyncResult(object):
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+class FakePool(object):
+    """
+    A process pool that runs its tasks in the calling process.
+    """
+    def __init__(self, processes):
+        self.processes = processes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def apply_async(self, func, args):
+        return FakeAsyncResult(func(*args))
+
+
+class RebuildSmartManagersTest(TestCase):
+    """
+    Tests the rebuild_smart_managers management command.
+    """
+    def setUp(self):
+        super(RebuildSmartManagersTest, self).setUp()
+        self.smart_managers = [
+            SmartManager.objects.create(
+                name='upsert{0}'.format(i),
+                smart_manager_class='smart_manager.tests.smart_managers.UpsertSmartManager',
+                template={'char_field': str(i), 'int_field': i},
+            )
+            for i in range(5)
+        ]
+        self.parent_smart_manager = SmartManager.objects.create(
+            name='parent',
+            smart_manager_class='smart_manager.tests.smart_managers.ParentSmartManager',
+            template={'char_field': 'parent', 'children': []},
+        )
+
+        # Change the built objects so that rebuilt smart managers can be told apart
+        UpsertModel.objects.update(int_field=-1)
+
+    def call_command(self, *args):
+        stdout, stderr = StringIO(), StringIO()
+        call_command('rebuild_smart_managers', *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def get_rebuilt_char_fields(self):
+        return set(UpsertModel.objects.exclude(int_field=-1).values_list('char_field', flat=True))
+
+    def test_rebuild_all(self):
+        """
+        Tests rebuilding all smart managers in chunks.
+        """
+        stdout, stderr = self.call_command('--chunk-size', '2')
+
+        self.assertEquals(self.get_rebuilt_char_fields(), set(['0', '1', '2', '3', '4']))
+        self.assertEquals(
+            [line.split(' (')[0] for line in stdout.splitlines()[:-1]],
+            ['Processed 2/6 smart managers', 'Processed 4/6 smart managers', 'Processed 6/6 smart managers'])
+        self.assertTrue(stdout.splitlines()[-1].endswith('with 0 errors'))
+        self.assertEquals(stderr, '')
+
+    def test_filters(self):
+        """
+        Tests selecting smart managers by class path, name and primary object type.
+        """
+        self.call_command(
+            '--class', 'smart_manager.tests.smart_managers.UpsertSmartManager',
+            '--class', 'smart_manager.tests.smart_managers.ParentSmartManager',
+            '--name', '^upsert[0-2]$', '--primary-obj-type', 'tests.upsertmodel',
+        )
+        self.assertEquals(self.get_rebuilt_char_fields(), set(['0', '1', '2']))
+
+        stdout, stderr = self.call_command('--primary-obj-type', 'tests.parentmodel')
+        self.assertTrue(stdout.startswith('Processed 1/1 smart managers'))
+
+    def test_invalid_primary_obj_type(self):
+        """
+        Tests that primary object types must be existing content types.
+        """
+        with self.assertRaises(CommandError):
+            self.call_command('--primary-obj-type', 'tests')
+        with self.assertRaises(CommandError):
+            self.call_command('--primary-obj-type', 'tests.missingmodel')
+
+    def test_errors(self):
+        """
+        Tests that smart managers that fail to rebuild do not keep the rest of their chunk from being rebuilt.
+        """
+        SmartManager.objects.filter(id=self.smart_managers[1].id).update(template={'char_field': '1'})
+        stdout, stderr = self.call_command('--chunk-size', '3')
+
+        self.assertEquals(self.get_rebuilt_char_fields(), set(['0', '2', '3', '4']))
+        self.assertEquals(
+            stderr, 'Could not rebuild smart manager {0}: KeyError: \'int_field\'\n'.format(self.smart_managers[1].id))
+        self.assertTrue(stdout.splitlines()[-1].endswith('with 1 errors'))
+
+    def test_rebuild_chunk_deleted_smart_manager(self):
+        """
+        Tests that smart managers that no longer exist are skipped.
+        """
+        self.assertEquals(rebuild_chunk([0, self.smart_managers[0].id]), ([0, self.smart_managers[0].id], []))
+        self.assertEquals(self.get_rebuilt_char_fields(), set(['0']))
+
+    def test_checkpoint(self):
+        """
+        Tests resuming a rebuild from a checkpoint.
+        """
+        checkpoint_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, checkpoint_dir)
+        checkpoint_path = os.path.join(checkpoint_dir, 'checkpoint.json')
+        with open(checkpoint_path, 'w') as f:
+            json.dump({'last_id': self.smart_managers[2].id, 'errors': [[0, 'error']]}, f)
+
+        SmartManager.objects.filter(id=self.smart_managers[4].id).update(template={'char_field': '4'})
+        self.call_command('--checkpoint', checkpoint_path, '--chunk-size', '2')
+
+        self.assertEquals(self.get_rebuilt_char_fields(), set(['3']))
+        with open(checkpoint_path) as f:
+            self.assertEquals(json.load(f), {
+                'last_id': self.parent_smart_manager.id,
+                'errors': [[0, 'error'], [self.smart_managers[4].id, 'KeyError: \'int_field\'']],
+            })
+
+    def test_workers(self):
+        """
+        Tests rebuilding chunks with a process pool.
+        """
+        with patch('smart_manager.management.commands.rebuild_smart_managers.Pool', FakePool), patch(
+            'smart_manager.management.commands.rebuild_smart_managers.connections'
+        ) as mock_connections:
+            self.call_command('--workers', '2', '--chunk-size', '1')
+
+        self.assertTrue(mock_connections.close_all.called)
+        self.assertEquals(self.get_rebuilt_char_fields(), set(['0', '1', '2', '3', '4']))
@@ -0,0 +1,77 @@
+from django.test import SimpleTestCase
+from mock import patch
+
+from smart_manager import BaseSmartManager
+from smart_manager.registry import (
+    autodiscover, get_smart_manager_class, get_smart_manager_class_path, register, _registered_classes,
+)
+from smart_manager.tests.smart_managers import UpsertSmartManager
+
+
+class RegisteredSmartManager(BaseSmartManager):
+    pass
+
+
+class RegistryTest(SimpleTestCase):
+    """
+    Tests loading smart manager classes and paths from the registry.
+    """
+    def setUp(self):
+        super(RegistryTest, self).setUp()
+        get_smart_manager_class.cache_clear()
+        get_smart_manager_class_path.cache_clear()
+
+    def tearDown(self):
+        super(RegistryTest, self).tearDown()
+        _registered_classes.pop('smart_manager.tests.registry_tests.RegisteredSmartManager', None)
+
+    def test_get_smart_manager_class(self):
+        """
+        Tests that classes are imported once for every path.
+        """
+        with patch('smart_manager.registry.import_string', return_value=UpsertSmartManager) as mock_import_string:
+            self.assertEquals(
+                get_smart_manager_class('smart_manager.tests.smart_managers.UpsertSmartManager'), UpsertSmartManager)
+            self.assertEquals(
+                get_smart_manager_class('smart_manager.tests.smart_managers.UpsertSmartManager'), UpsertSmartManager)
+        self.assertEquals(mock_import_string.call_count, 1)
+
+    def test_get_smart_manager_class_invalid_path(self):
+        """
+        Tests that paths that cannot be imported raise an ImportError that includes the path.
+        """
+        with self.assertRaisesRegexp(ImportError, 'smart_manager.tests.smart_managers.MissingSmartManager'):
+            get_smart_manager_class('smart_manager.tests.smart_managers.MissingSmartManager')
+        with self.assertRaisesRegexp(ImportError, 'invalid_path'):
+            get_smart_manager_class('invalid_path')
+
+    def test_get_smart_manager_class_path(self):
+        """
+        Tests that the paths of classes are computed once for every class.
+        """
+        with patch('smart_manager.registry.get_class_path', return_value='path') as mock_get_class_path:
+            self.assertEquals(get_smart_manager_class_path(UpsertSmartManager), 'path')
+            self.assertEquals(get_smart_manager_class_path(UpsertSmartManager), 'path')
+        self.assertEquals(mock_get_class_path.call_count, 1)
+
+    def test_register(self):
+        """
+        Tests that registered classes are loaded without importing them.
+        """
+        self.assertEquals(register(RegisteredSmartManager), RegisteredSmartManager)
+        with patch('smart_manager.registry.import_string', spec_set=True) as mock_import_string:
+            self.assertEquals(
+                get_smart_manager_class('smart_manager.tests.registry_tests.RegisteredSmartManager'),
+                RegisteredSmartManager)
+        self.assertFalse(mock_import_string.called)
+        self.assertEquals(
+            get_smart_manager_class_path(RegisteredSmartManager),
+            'smart_manager.tests.registry_tests.RegisteredSmartManager')
+
+    @patch('smart_manager.registry.autodiscover_modules', spec_set=True)
+    def test_autodiscover(self, mock_autodiscover_modules):
+        """
+        Tests that the smart_managers modules of installed apps are imported.
+        """
+        autodiscover()
+        mock_autodiscover_modules.assert_called_once_with('smart_managers')
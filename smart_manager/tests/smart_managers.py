@@ -1,5 +1,7 @@
+import json
+
 from smart_manager import BaseSmartManager
-from smart_manager.tests.models import UpsertModel
+from smart_manager.tests.models import ChildModel, JSONPayloadModel, ParentModel, UniqueUpsertModel, UpsertModel
 
 
 class UpsertSmartManager(BaseSmartManager):
@@ -22,3 +24,133 @@ class DontDeleteUpsertSmartManager(BaseSmartManager):
         return self.build_obj(UpsertModel, char_field=self._template['char_field'], updates={
             'int_field': self._template['int_field'],
         }, is_deletable=False)
+
+
+class NativeUpsertSmartManager(BaseSmartManager):
+    native_upsert = True
+
+    def build(self):
+        return self.build_obj(
+            UniqueUpsertModel, char_field=self._template['char_field'], int_field=self._template['int_field'],
+            updates={'float_field': self._template['float_field']})
+
+
+class BatchUpsertSmartManager(UpsertSmartManager):
+    batch_build = True
+
+
+class BatchUpsertModelListTemplate(UpsertModelListTemplate):
+    batch_build = True
+
+
+class BatchChildSmartManager(BaseSmartManager):
+    batch_build = True
+
+    def build(self):
+        return self.build_obj(ChildModel, parent=self._template['parent'], int_field=self._template['int_field'])
+
+
+class BatchParentSmartManager(BaseSmartManager):
+    """
+    Builds the children of a parent with a child builder before the parent has a pk.
+    """
+    batch_build = True
+    child_smart_manager_class = BatchChildSmartManager
+
+    def build(self):
+        parent = self.build_obj(ParentModel, char_field=self._template['char_field'])
+        for int_field in self._template['children']:
+            self.build_using(self.child_smart_manager_class, {'parent': parent, 'int_field': int_field})
+
+        return parent
+
+
+class ChildSmartManager(BatchChildSmartManager):
+    batch_build = False
+
+
+class BatchParentUnbatchedChildSmartManager(BatchParentSmartManager):
+    child_smart_manager_class = ChildSmartManager
+
+
+class ParentSmartManager(BatchParentSmartManager):
+    batch_build = False
+    child_smart_manager_class = ChildSmartManager
+
+
+class JSONPayloadSmartManager(BaseSmartManager):
+    """
+    Marks the payload of its template as built and stores it in a JSON field and as encoded JSON.
+    """
+    def build(self):
+        payload = self._template['payload']
+        payload['is_built'] = True
+        return self.build_obj(JSONPayloadModel, char_field=self._template['char_field'], updates={
+            'payload': payload,
+            'encoded_payload': json.dumps(payload),
+        })
+
+
+class JSONPayloadListSmartManager(BaseSmartManager):
+    def build(self):
+        return [self.build_using(JSONPayloadSmartManager, template)[0] for template in self._template['children']][0]
+
+
+class ParentListSmartManager(BaseSmartManager):
+    """
+    Builds a list of parents and their children. The first parent is the primary object.
+    """
+    def build(self):
+        return [self.build_using(ParentSmartManager, template)[0] for template in self._template][0]
+
+
+class StreamUpsertModelListTemplate(UpsertModelListTemplate):
+    stream_build = True
+    stream_chunk_size = 2
+
+
+class StreamPrimaryUpsertModelListTemplate(StreamUpsertModelListTemplate):
+    """
+    Streams a list of objects and returns the first one as the primary object.
+    """
+    def build(self):
+        return [
+            self.build_obj(UpsertModel, char_field=template['char_field'], updates={
+                'int_field': template['int_field'],
+            })
+            for template in self._template
+        ][0]
+
+
+class StreamParentListSmartManager(BaseSmartManager):
+    """
+    Streams a list of parents that are built with a builder that is not batched.
+    """
+    stream_build = True
+    stream_chunk_size = 3
+
+    def build(self):
+        for template in self._template:
+            self.build_using(ParentSmartManager, template)
+
+
+class TreeSmartManager(BaseSmartManager):
+    """
+    Builds a node of a tree and its children with a child builder for every child. Used by the benchmarks.
+    """
+    def build(self):
+        node = self.build_obj(UpsertModel, char_field=self._template['char_field'], updates={
+            'int_field': self._template['int_field'],
+        })
+        for child_template in self._template['children']:
+            self.build_using(self.__class__, child_template)
+
+        return node
+
+
+class BatchTreeSmartManager(TreeSmartManager):
+    batch_build = True
+
+
+class DeferredUpsertSmartManager(UpsertSmartManager):
+    defer_build = True
@@ -0,0 +1,330 @@
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+from mock import patch
+
+from smart_manager.base import BaseSmartManager
+from smart_manager.models import SmartManager, SmartManagerObject
+from smart_manager.subtrees import (
+    SubtreeRecorder, get_subtree_fingerprint, load_model_obj, load_subtree, serialize_model_obj,
+)
+from smart_manager.templates import get_template_view
+from smart_manager.tests.models import ChildModel, ParentModel, UpsertModel
+from smart_manager.tests.smart_managers import (
+    ChildSmartManager, ParentSmartManager, TreeSmartManager, UpsertSmartManager,
+)
+
+
+class SubtreeFingerprintTest(TestCase):
+    """
+    Tests fingerprinting the templates of child builders.
+    """
+    def test_model_objs(self):
+        """
+        Tests that model objects are fingerprinted with their pk.
+        """
+        parent1 = ParentModel.objects.create(char_field='1')
+        parent2 = ParentModel.objects.create(char_field='2')
+        self.assertEquals(
+            get_subtree_fingerprint(ChildSmartManager, {'parent': parent1}),
+            get_subtree_fingerprint(ChildSmartManager, {'parent': ParentModel.objects.get(id=parent1.id)}))
+        self.assertNotEqual(
+            get_subtree_fingerprint(ChildSmartManager, {'parent': parent1}),
+            get_subtree_fingerprint(ChildSmartManager, {'parent': parent2}))
+
+    def test_nested_views(self):
+        """
+        Tests that templates with views of other templates at any depth are fingerprinted like their data.
+        """
+        template = get_template_view({'child': {'char_field': 'a', 'int_field': 1}})
+        self.assertEquals(
+            get_subtree_fingerprint(UpsertSmartManager, {'children': [template['child']], 'parent': template}),
+            get_subtree_fingerprint(UpsertSmartManager, {
+                'children': [{'char_field': 'a', 'int_field': 1}],
+                'parent': {'child': {'char_field': 'a', 'int_field': 1}},
+            }))
+        self.assertIsNotNone(get_subtree_fingerprint(UpsertSmartManager, {'children': [template['child']]}))
+
+    def test_unsaved_model_obj(self):
+        """
+        Tests that templates with unsaved model objects cannot be fingerprinted.
+        """
+        self.assertIsNone(get_subtree_fingerprint(ChildSmartManager, {'parent': ParentModel()}))
+
+    def test_unserializable_template(self):
+        """
+        Tests that templates which cannot be serialized cannot be fingerprinted.
+        """
+        self.assertIsNone(get_subtree_fingerprint(ChildSmartManager, {'parent': object()}))
+
+
+class LoadSubtreeTest(TestCase):
+    """
+    Tests loading serialized subtrees.
+    """
+    def test_load_model_obj(self):
+        """
+        Tests that model objects are loaded without any queries.
+        """
+        upsert_model = UpsertModel.objects.create(char_field='hi', int_field=1)
+        serialized_model_obj = serialize_model_obj(upsert_model)
+        with self.assertNumQueries(0):
+            model_obj = load_model_obj(serialized_model_obj)
+            self.assertEquals(model_obj, upsert_model)
+
+        # Fields are loaded when accessed
+        self.assertEquals(model_obj.char_field, 'hi')
+
+    def test_load_missing_content_type(self):
+        """
+        Tests loading objects of content types that no longer exist.
+        """
+        ContentType.objects.clear_cache()
+        self.assertIsNone(load_model_obj([ContentType.objects.order_by('-id').first().id + 1, 1]))
+        content_type = ContentType.objects.create(app_label='tests', model='deletedmodel')
+        self.assertIsNone(load_model_obj([content_type.id, 1]))
+        self.assertIsNone(load_subtree({
+            'a': {'built_objs': [[content_type.id, 1]], 'result': [], 'subtrees': []},
+        }, 'a'))
+
+        upsert_model = UpsertModel.objects.create(char_field='hi', int_field=1)
+        self.assertIsNone(load_subtree({'a': {
+            'built_objs': [serialize_model_obj(upsert_model)],
+            'result': [[content_type.id, 1]],
+            'subtrees': [],
+        }}, 'a'))
+        self.assertEquals(load_subtree({'a': {
+            'built_objs': [serialize_model_obj(upsert_model)],
+            'result': [None],
+            'subtrees': [],
+        }}, 'a'), ([tuple(serialize_model_obj(upsert_model))], [None]))
+
+    def test_load_descendants(self):
+        """
+        Tests that the objects built by the descendants of a subtree are loaded from their own subtrees.
+        """
+        upsert_models = [UpsertModel.objects.create(char_field=str(i), int_field=i) for i in range(3)]
+        subtrees = {
+            'a': {'built_objs': [serialize_model_obj(upsert_models[0])], 'result': [], 'subtrees': ['b', 'c']},
+            'b': {'built_objs': [serialize_model_obj(upsert_models[1])], 'result': [], 'subtrees': ['c']},
+            'c': {'built_objs': [serialize_model_obj(upsert_models[2])], 'result': [], 'subtrees': []},
+        }
+        built_obj_keys, result = load_subtree(subtrees, 'a')
+        self.assertEquals(
+            set(built_obj_keys), set(tuple(serialize_model_obj(upsert_model)) for upsert_model in upsert_models))
+        self.assertIsNone(load_subtree(dict(subtrees, b={'built_objs': [], 'result': [], 'subtrees': ['d']}), 'a'))
+
+
+class SubtreeRecorderTest(TestCase):
+    """
+    Tests recording and reusing subtrees in builds.
+    """
+    def build(self, template, subtrees=None):
+        smart_manager = BaseSmartManager({})
+        smart_manager._context.subtree_recorder = SubtreeRecorder(subtrees)
+        built_objs = smart_manager.build_using(UpsertSmartManager, template)
+        return smart_manager, built_objs
+
+    def test_record_and_reuse(self):
+        """
+        Tests that a recorded subtree is reused without any queries.
+        """
+        smart_manager, built_objs = self.build({'char_field': 'hi', 'int_field': 1})
+        subtrees = smart_manager._context.subtree_recorder.serialize()
+        self.assertEquals(len(subtrees), 1)
+
+        with self.assertNumQueries(0):
+            smart_manager, reused_built_objs = self.build({'char_field': 'hi', 'int_field': 1}, subtrees)
+        self.assertEquals(reused_built_objs, built_objs)
+        self.assertEquals(smart_manager.built_objs, set(built_objs))
+        self.assertEquals(smart_manager._context.subtree_recorder.serialize(), subtrees)
+
+    def test_changed_subtree(self):
+        """
+        Tests that a changed subtree is built again.
+        """
+        smart_manager, built_objs = self.build({'char_field': 'hi', 'int_field': 1})
+        subtrees = smart_manager._context.subtree_recorder.serialize()
+
+        smart_manager, built_objs = self.build({'char_field': 'hi', 'int_field': 2}, subtrees)
+        self.assertEquals(UpsertModel.objects.get().int_field, 2)
+        self.assertNotEqual(smart_manager._context.subtree_recorder.serialize(), subtrees)
+
+    def test_stale_subtree(self):
+        """
+        Tests that a subtree is built again when its objects can no longer be loaded.
+        """
+        smart_manager, built_objs = self.build({'char_field': 'hi', 'int_field': 1})
+        subtrees = smart_manager._context.subtree_recorder.serialize()
+        subtree_fingerprint = list(subtrees)[0]
+        subtrees[subtree_fingerprint]['built_objs'] = [[ContentType.objects.order_by('-id').first().id + 1, 1]]
+
+        smart_manager, reused_built_objs = self.build({'char_field': 'hi', 'int_field': 1}, subtrees)
+        self.assertEquals(reused_built_objs, built_objs)
+        self.assertEquals(
+            smart_manager._context.subtree_recorder.serialize()[subtree_fingerprint]['built_objs'],
+            [serialize_model_obj(built_objs[0])])
+
+    def test_missing_descendants(self):
+        """
+        Tests that a subtree is built again when any of its descendants is missing from the previous build, since
+        the objects of the descendant cannot be loaded.
+        """
+        smart_manager, built_objs = self.build({'char_field': 'hi', 'int_field': 1})
+        subtrees = smart_manager._context.subtree_recorder.serialize()
+        subtree_fingerprint = list(subtrees)[0]
+        subtrees[subtree_fingerprint]['subtrees'] = ['missing', subtree_fingerprint]
+
+        with patch.object(
+            UpsertSmartManager, 'build', autospec=True, side_effect=UpsertSmartManager.build
+        ) as mock_build:
+            smart_manager, reused_built_objs = self.build({'char_field': 'hi', 'int_field': 1}, subtrees)
+        self.assertEquals(mock_build.call_count, 1)
+        self.assertEquals(reused_built_objs, built_objs)
+        self.assertEquals(smart_manager._context.subtree_recorder.serialize()[subtree_fingerprint]['subtrees'], [])
+
+    def test_nested_subtrees(self):
+        """
+        Tests that every subtree only keeps the objects it built itself and that the objects of its descendants
+        are reused with it.
+        """
+        template = {'char_field': '1', 'int_field': 1, 'children': [
+            {'char_field': '2', 'int_field': 2, 'children': [{'char_field': '3', 'int_field': 3, 'children': []}]},
+        ]}
+        smart_manager = BaseSmartManager({})
+        smart_manager._context.subtree_recorder = SubtreeRecorder()
+        smart_manager.build_using(TreeSmartManager, template)
+        subtrees = smart_manager._context.subtree_recorder.serialize()
+        self.assertEquals(len(subtrees), 3)
+        self.assertEquals([len(subtree['built_objs']) for subtree in subtrees.values()], [1, 1, 1])
+
+        built_objs = smart_manager.built_objs
+        smart_manager = BaseSmartManager({})
+        smart_manager._context.subtree_recorder = SubtreeRecorder(subtrees)
+        with self.assertNumQueries(0):
+            smart_manager.build_using(TreeSmartManager, template)
+        self.assertEquals(smart_manager.built_objs, built_objs)
+        self.assertEquals(smart_manager._context.subtree_recorder.serialize(), subtrees)
+
+    def test_unserializable_child_subtree(self):
+        """
+        Tests that a subtree keeps the objects of child subtrees that could not be serialized.
+        """
+        class NamedUpsertSmartManager(UpsertSmartManager):
+            def build(self):
+                super(NamedUpsertSmartManager, self).build()
+                return 'child'
+
+        class ParentUpsertSmartManager(BaseSmartManager):
+            def build(self):
+                self.build_using(NamedUpsertSmartManager, {'char_field': 'child', 'int_field': 2})
+                return self.build_obj(UpsertModel, char_field='parent', updates={'int_field': 1})
+
+        smart_manager = BaseSmartManager({})
+        smart_manager._context.subtree_recorder = SubtreeRecorder()
+        smart_manager.build_using(ParentUpsertSmartManager, {})
+        subtrees = smart_manager._context.subtree_recorder.serialize()
+
+        self.assertEquals(len(subtrees), 1)
+        self.assertEquals(list(subtrees.values())[0]['subtrees'], [])
+        self.assertEquals(
+            sorted(list(subtrees.values())[0]['built_objs']),
+            sorted(serialize_model_obj(upsert_model) for upsert_model in UpsertModel.objects.all()))
+
+    @patch('smart_manager.tests.smart_managers.UpsertSmartManager.build', spec_set=True)
+    def test_unserializable_result(self, mock_build):
+        """
+        Tests that subtrees of child builders that return something other than model objects are not recorded.
+        """
+        mock_build.return_value = ['one', 'two']
+        smart_manager, built_objs = self.build({'char_field': 'hi', 'int_field': 1})
+        self.assertEquals(smart_manager._context.subtree_recorder.serialize(), {})
+
+
+class SubtreeRebuildTest(TestCase):
+    """
+    Tests that smart managers only rebuild the subtrees of their templates that have changed.
+    """
+    def setUp(self):
+        super(SubtreeRebuildTest, self).setUp()
+        self.smart_manager = SmartManager.objects.create(
+            smart_manager_class='smart_manager.tests.smart_managers.ParentListSmartManager',
+            template=[{
+                'char_field': 'a',
+                'children': [1, 2],
+            }, {
+                'char_field': 'b',
+                'children': [1],
+            }],
+        )
+
+    def save(self, template, **kwargs):
+        self.smart_manager.template = template
+        with patch.object(ChildSmartManager, 'build', autospec=True, side_effect=ChildSmartManager.build) as mock_build:
+            with patch.object(
+                ParentSmartManager, 'build', autospec=True, side_effect=ParentSmartManager.build
+            ) as mock_parent_build:
+                self.smart_manager.save(**kwargs)
+
+        return (
+            sorted(call[0][0]._template['char_field'] for call in mock_parent_build.call_args_list),
+            sorted(call[0][0]._template['int_field'] for call in mock_build.call_args_list),
+        )
+
+    def assertChildren(self, children):
+        self.assertEquals(
+            set(ChildModel.objects.values_list('parent__char_field', 'int_field')), set(children))
+        self.assertEquals(
+            SmartManagerObject.objects.count(), ParentModel.objects.count() + ChildModel.objects.count())
+
+    def test_rebuild_changed_subtrees(self):
+        """
+        Tests that only changed subtrees are rebuilt and that unchanged subtrees of changed subtrees are reused.
+        """
+        self.assertEquals(len(SmartManager.objects.get().built_subtrees), 5)
+
+        built_parents, built_children = self.save([{
+            'char_field': 'a',
+            'children': [1, 2, 3],
+        }, {
+            'char_field': 'b',
+            'children': [1],
+        }])
+        self.assertEquals(built_parents, ['a'])
+        self.assertEquals(built_children, [3])
+        self.assertChildren([('a', 1), ('a', 2), ('a', 3), ('b', 1)])
+        self.assertEquals(len(SmartManager.objects.get().built_subtrees), 6)
+
+        # The children of b were not visited in the previous build but are still reused
+        built_parents, built_children = self.save([{
+            'char_field': 'a',
+            'children': [1, 2, 3],
+        }, {
+            'char_field': 'b',
+            'children': [2, 1],
+        }])
+        self.assertEquals(built_parents, ['b'])
+        self.assertEquals(built_children, [2])
+        self.assertChildren([('a', 1), ('a', 2), ('a', 3), ('b', 1), ('b', 2)])
+
+    def test_removed_subtrees(self):
+        """
+        Tests that the objects of removed subtrees are deleted.
+        """
+        built_parents, built_children = self.save([{
+            'char_field': 'a',
+            'children': [2],
+        }])
+        self.assertEquals(built_parents, ['a'])
+        self.assertEquals(built_children, [])
+        self.assertChildren([('a', 2)])
+        self.assertEquals(list(ParentModel.objects.values_list('char_field', flat=True)), ['a'])
+        self.assertEquals(len(SmartManager.objects.get().built_subtrees), 2)
+
+    def test_force_rebuild(self):
+        """
+        Tests that subtrees are not reused when a rebuild is forced.
+        """
+        built_parents, built_children = self.save(self.smart_manager.template, force_rebuild=True)
+        self.assertEquals(built_parents, ['a', 'b'])
+        self.assertEquals(built_children, [1, 1, 2])
+        self.assertChildren([('a', 1), ('a', 2), ('b', 1)])
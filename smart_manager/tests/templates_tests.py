@@ -0,0 +1,280 @@
+import json
+from collections import OrderedDict
+from copy import copy, deepcopy
+
+from django.test import SimpleTestCase, TestCase
+from jsonfield import JSONField
+from mock import patch
+
+from smart_manager.base import BaseSmartManager
+from smart_manager.templates import (
+    TemplateDictView, TemplateListView, TemplateTupleView, get_template_view, unwrap_template,
+)
+from smart_manager.models import SmartManager
+from smart_manager.tests.models import JSONPayloadModel, ParentModel
+from smart_manager.tests.smart_managers import UpsertSmartManager
+
+
+class TemplateViewTest(SimpleTestCase):
+    """
+    Tests reading and writing templates through copy-on-write views.
+    """
+    def setUp(self):
+        super(TemplateViewTest, self).setUp()
+        self.template = {
+            'char_field': 'a',
+            'children': [{'int_field': 1}, {'int_field': 2}],
+            'pair': ({'int_field': 3}, [4]),
+        }
+        self.original_template = deepcopy(self.template)
+
+    def test_get_template_view(self):
+        """
+        Tests that dicts, lists and tuples are wrapped in views and other values are returned as they are.
+        """
+        iterator = iter([])
+        self.assertEquals(type(get_template_view({})), TemplateDictView)
+        self.assertEquals(type(get_template_view([])), TemplateListView)
+        self.assertEquals(type(get_template_view(())), TemplateTupleView)
+        self.assertIs(get_template_view(iterator), iterator)
+        self.assertEquals(get_template_view(1), 1)
+
+    def test_read(self):
+        """
+        Tests that nested containers are read through views and that containers that are not read are shared.
+        """
+        view = get_template_view(self.template)
+        self.assertEquals(view['char_field'], 'a')
+        self.assertEquals(view['children'][-1:], [{'int_field': 2}])
+        self.assertEquals(view['pair'][0].get('int_field'), 3)
+        self.assertEquals(view['pair'][1:], ([4],))
+        self.assertEquals(dict(view.items())['char_field'], 'a')
+        self.assertTrue('children' in view)
+        self.assertEquals(len(view), 3)
+        self.assertEquals(view, self.template)
+        self.assertIs(unwrap_template(view)['children'][0], self.template['children'][0])
+
+        self.assertEquals([child['int_field'] for child in view['children']], [1, 2])
+        self.assertEquals([child['int_field'] for child in reversed(view['children'])], [2, 1])
+        self.assertEquals(type(unwrap_template(view)['children'][0]), dict)
+        self.assertIs(view['children'], view['children'])
+        self.assertEquals(repr(get_template_view([1])), 'TemplateListView([1])')
+
+    def test_containers(self):
+        """
+        Tests that views are dicts, lists and tuples that can be encoded as JSON, including any writes to them.
+        """
+        view = get_template_view(self.template)
+        view['children'][0]['int_field'] = 5
+        view['pair'][1].append(6)
+
+        self.assertTrue(isinstance(view, dict))
+        self.assertTrue(isinstance(view['children'], list))
+        self.assertTrue(isinstance(view['pair'], tuple))
+        self.assertEquals(json.loads(json.dumps(view)), {
+            'char_field': 'a', 'children': [{'int_field': 5}, {'int_field': 2}], 'pair': [{'int_field': 3}, [4, 6]],
+        })
+        self.assertEquals(json.loads(json.dumps(view, sort_keys=True)), json.loads(json.dumps(view)))
+        self.assertEquals(
+            json.loads(JSONField().get_prep_value(view['children'])), [{'int_field': 5}, {'int_field': 2}])
+        self.assertEquals(self.template, self.original_template)
+
+        view_copy = deepcopy(view)
+        self.assertEquals(view_copy, view)
+        self.assertEquals(
+            [type(view_copy), type(view_copy['children']), type(view_copy['pair'])], [dict, list, tuple])
+
+    def test_plain_copies(self):
+        """
+        Tests that plain copies of views do not share the containers of the template.
+        """
+        view = get_template_view(self.template)
+        dict(view)['children'].append({'int_field': 3})
+        {**view}['pair'][1].append(5)
+        list(view['children'])[0]['int_field'] = 5
+        (view['children'] + [])[1]['int_field'] = 6
+        (view | {})['children'].pop()
+        view['children'].pop()['int_field'] = 7
+        view.pop('pair')[0]['int_field'] = 8
+        view.popitem()[1][0]['int_field'] = 9
+
+        self.assertEquals(self.template, self.original_template)
+        self.assertEquals(copy(view), view)
+        self.assertEquals(view.setdefault('char_field', 'b'), 'a')
+        self.assertEquals(view.setdefault('parent', {}), {})
+        self.assertEquals(list(view.values()), ['a', {}])
+
+    def test_write_dict(self):
+        """
+        Tests that writing a nested dict copies the containers above it.
+        """
+        view = get_template_view(self.template)
+        children = view['children']
+        view['children'][0]['int_field'] = 5
+        view['char_field'] = 'b'
+        del view['pair']
+
+        self.assertEquals(self.template, self.original_template)
+        self.assertEquals(view, {'char_field': 'b', 'children': [{'int_field': 5}, {'int_field': 2}]})
+        self.assertIs(view['children'], children)
+        self.assertIs(unwrap_template(view)['children'][1], self.template['children'][1])
+
+    def test_write_list(self):
+        """
+        Tests writing lists through views.
+        """
+        view = get_template_view(self.template)
+        children = view['children']
+        children.append(get_template_view({'int_field': 3}))
+        children[0] = {'int_field': 0}
+        children[1:2] = [get_template_view({'int_field': 1})]
+        children.insert(0, {'int_field': -1})
+        del children[-1]
+
+        self.assertEquals(self.template, self.original_template)
+        self.assertEquals(view['children'], [{'int_field': -1}, {'int_field': 0}, {'int_field': 1}])
+        self.assertEquals(type(unwrap_template(view['children'])[2]), dict)
+
+    def test_write_nested_in_tuple(self):
+        """
+        Tests that writing a container in a tuple replaces the tuple.
+        """
+        view = get_template_view(self.template)
+        view['pair'][0]['int_field'] = 5
+        view['pair'][1].append(6)
+
+        self.assertEquals(self.template, self.original_template)
+        self.assertEquals(view['pair'], ({'int_field': 5}, [4, 6]))
+        self.assertEquals(type(unwrap_template(view['pair'])), tuple)
+
+        tuple_view = get_template_view(({'int_field': 1},))
+        tuple_view[0]['int_field'] = 2
+        self.assertEquals(tuple_view, ({'int_field': 2},))
+        self.assertEquals(len(tuple_view), 1)
+
+    def test_write_shared_container(self):
+        """
+        Tests that writing a container that is in a template more than once writes all of its occurrences.
+        """
+        child = {'int_field': 1}
+        template = OrderedDict([('first', child), ('second', child), ('children', [child, child])])
+        view = get_template_view(template)
+        view['first']['int_field'] = 2
+        view['children'][0]['int_field'] = 3
+
+        self.assertEquals(child, {'int_field': 1})
+        self.assertEquals(view['second'], {'int_field': 2})
+        self.assertEquals(view['children'], [{'int_field': 3}, {'int_field': 3}])
+        self.assertEquals(json.loads(json.dumps(view)), {
+            'first': {'int_field': 2}, 'second': {'int_field': 2}, 'children': [{'int_field': 3}, {'int_field': 3}],
+        })
+
+    def test_copy(self):
+        """
+        Tests that copies of views are written independently.
+        """
+        view = get_template_view(self.template)
+        view_copy = view.copy()
+        view_copy['char_field'] = 'b'
+        children_copy = view['children'].copy()
+        children_copy.append({'int_field': 3})
+
+        self.assertEquals(view['char_field'], 'a')
+        self.assertEquals(len(view['children']), 2)
+        self.assertEquals(len(children_copy), 3)
+
+    def test_model_objs(self):
+        """
+        Tests that model objects in templates are returned as they are.
+        """
+        parent = ParentModel(char_field='a')
+        view = get_template_view({'parent': parent})
+        self.assertIs(view['parent'], parent)
+
+
+class TemplateBuildTest(SimpleTestCase):
+    """
+    Tests passing templates to builders.
+    """
+    def test_root_template(self):
+        """
+        Tests that the template given to a builder is copied into plain containers.
+        """
+        template = {'child': {'char_field': 'a', 'int_field': 1}}
+        smart_manager = BaseSmartManager(template)
+
+        self.assertEquals(type(smart_manager._template), dict)
+        self.assertEquals(json.dumps(smart_manager._template), json.dumps(template))
+        self.assertIsNot(smart_manager._template['child'], template['child'])
+
+    def build_child(self, smart_manager, template):
+        """
+        Builds a child builder with build_using and returns it.
+        """
+        child_smart_managers = []
+        with patch.object(UpsertSmartManager, 'build', autospec=True) as mock_build:
+            mock_build.side_effect = lambda builder: child_smart_managers.append(builder) or []
+            smart_manager.build_using(UpsertSmartManager, template)
+        return child_smart_managers[0]
+
+    def test_build_using_view(self):
+        """
+        Tests that a child builder receives a view of the template it was given and that writes by either builder
+        are not seen by the other.
+        """
+        template = {'child': {'char_field': 'a', 'int_field': 1}}
+        smart_manager = BaseSmartManager(template)
+        with patch('smart_manager.base.deepcopy') as mock_deepcopy:
+            child_smart_manager = self.build_child(smart_manager, smart_manager._template['child'])
+        self.assertFalse(mock_deepcopy.called)
+
+        child_smart_manager._template['int_field'] = 2
+        smart_manager._template['child']['char_field'] = 'b'
+
+        self.assertEquals(template, {'child': {'char_field': 'a', 'int_field': 1}})
+        self.assertEquals(smart_manager._template, {'child': {'char_field': 'b', 'int_field': 1}})
+        self.assertEquals(child_smart_manager._template, {'char_field': 'a', 'int_field': 2})
+        self.assertEquals(type(unwrap_template(child_smart_manager._template)), dict)
+
+    def test_build_using_nested_view(self):
+        """
+        Tests that writes to parts of a parent template in a child template are not seen by the parent.
+        """
+        smart_manager = BaseSmartManager({'child': {'int_field': 1, 'children': [{'int_field': 2}]}})
+        child_smart_manager = self.build_child(smart_manager, get_template_view({'child': {'int_field': 1}}))
+        grandchild_smart_manager = self.build_child(child_smart_manager, {
+            'child': child_smart_manager._template['child'], 'children': (get_template_view([{'int_field': 2}]),),
+        })
+
+        grandchild_smart_manager._template['child']['int_field'] = 3
+        grandchild_smart_manager._template['children'][0][0]['int_field'] = 4
+
+        self.assertEquals(child_smart_manager._template, {'child': {'int_field': 1}})
+        self.assertEquals(grandchild_smart_manager._template, {
+            'child': {'int_field': 3}, 'children': ([{'int_field': 4}],),
+        })
+
+
+class TemplateJSONTest(TestCase):
+    """
+    Tests encoding the templates of child builders as JSON.
+    """
+    def test_build_json_payload(self):
+        """
+        Tests that a child builder can write its template and encode it as JSON in the objects it builds.
+        """
+        template = {'children': [
+            {'char_field': 'a', 'payload': {'values': [1, 2]}},
+            {'char_field': 'b', 'payload': {'values': []}},
+        ]}
+        smart_manager = SmartManager.objects.create(
+            smart_manager_class='smart_manager.tests.smart_managers.JSONPayloadListSmartManager', template=template)
+
+        self.assertEquals(
+            {obj.char_field: (obj.payload, json.loads(obj.encoded_payload)) for obj in JSONPayloadModel.objects.all()},
+            {
+                'a': ({'values': [1, 2], 'is_built': True}, {'values': [1, 2], 'is_built': True}),
+                'b': ({'values': [], 'is_built': True}, {'values': [], 'is_built': True}),
+            })
+        self.assertEquals(SmartManager.objects.get().template, template)
+        self.assertEquals(smart_manager.template['children'][0]['payload'], {'values': [1, 2]})
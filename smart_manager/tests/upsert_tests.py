@@ -0,0 +1,232 @@
+from unittest import skipUnless
+
+from django.db import connection
+from django.test import TestCase
+from mock import MagicMock, patch
+
+from smart_manager.instrumentation import InMemoryCollector, add_collector, remove_collector
+from smart_manager.models import SmartManager
+from smart_manager.tests.models import ChildModel, ParentModel, RelModel, UniqueUpsertModel, UpsertModel
+from smart_manager.upsert import NativeUpsert, get_conflict_fields, native_upsert_obj, supports_native_upsert
+
+
+class SupportsNativeUpsertTest(TestCase):
+    def test_postgres(self):
+        self.assertTrue(supports_native_upsert(MagicMock(vendor='postgresql')))
+
+    def test_other_backend(self):
+        self.assertFalse(supports_native_upsert(MagicMock(vendor='sqlite')))
+        self.assertFalse(supports_native_upsert(MagicMock(vendor='mysql')))
+
+
+class GetConflictFieldsTest(TestCase):
+    def setUp(self):
+        super(GetConflictFieldsTest, self).setUp()
+        get_conflict_fields.cache_clear()
+        self.addCleanup(get_conflict_fields.cache_clear)
+
+    def test_unique_field(self):
+        self.assertEquals(
+            get_conflict_fields(ParentModel, ('char_field',)), (ParentModel._meta.get_field('char_field'),))
+
+    def test_unique_together(self):
+        self.assertEquals(
+            get_conflict_fields(UniqueUpsertModel, ('char_field', 'int_field')),
+            (UniqueUpsertModel._meta.get_field('char_field'), UniqueUpsertModel._meta.get_field('int_field')))
+
+    def test_unique_constraint(self):
+        with patch.object(UpsertModel._meta, 'constraints', [MagicMock(
+            spec=['fields', 'condition'], fields=['char_field'], condition=None,
+        )]), patch('smart_manager.upsert.UniqueConstraint', MagicMock):
+            self.assertEquals(
+                get_conflict_fields(UpsertModel, ('char_field',)), (UpsertModel._meta.get_field('char_field'),))
+
+    def test_without_unique_constraints(self):
+        """
+        Tests that only unique fields and unique_together are used on Django versions before 2.2.
+        """
+        with patch.object(UpsertModel._meta, 'constraints', [MagicMock(
+            spec=['fields', 'condition'], fields=['char_field'], condition=None,
+        )]), patch('smart_manager.upsert.UniqueConstraint', None):
+            self.assertIsNone(get_conflict_fields(UpsertModel, ('char_field',)))
+            self.assertEquals(
+                get_conflict_fields(UniqueUpsertModel, ('char_field', 'int_field')),
+                (UniqueUpsertModel._meta.get_field('char_field'), UniqueUpsertModel._meta.get_field('int_field')))
+
+    def test_not_unique(self):
+        self.assertIsNone(get_conflict_fields(UpsertModel, ('char_field',)))
+        self.assertIsNone(get_conflict_fields(UniqueUpsertModel, ('char_field',)))
+
+    def test_missing_field(self):
+        self.assertIsNone(get_conflict_fields(ChildModel, ('parent__char_field',)))
+
+    def test_reverse_relation(self):
+        self.assertIsNone(get_conflict_fields(ParentModel, ('childmodel',)))
+
+    def test_multi_table_inheritance(self):
+        with patch.object(ParentModel._meta, 'parents', {RelModel: None}):
+            self.assertIsNone(get_conflict_fields(ParentModel, ('char_field',)))
+
+
+class NativeUpsertTest(TestCase):
+    def test_not_native(self):
+        self.assertIsNone(native_upsert_obj(UniqueUpsertModel, {'char_field': 'a', 'int_field': 1}))
+        with patch.object(connection, 'vendor', 'postgresql'):
+            self.assertIsNone(native_upsert_obj(UpsertModel, {'char_field': 'a'}, updates={'int_field': 1}))
+            self.assertIsNone(native_upsert_obj(UniqueUpsertModel, {'char_field': 'a', 'int_field': None}))
+        self.assertFalse(UpsertModel.objects.exists())
+        self.assertFalse(UniqueUpsertModel.objects.exists())
+
+    def test_native(self):
+        with patch.object(connection, 'vendor', 'postgresql'), patch.object(
+            NativeUpsert, 'execute', return_value=(UniqueUpsertModel(id=1), True, False)
+        ) as mock_execute:
+            self.assertEquals(
+                native_upsert_obj(UniqueUpsertModel, {'char_field': 'a', 'int_field': 1}), (
+                    UniqueUpsertModel(id=1), True, False))
+        self.assertEquals(mock_execute.call_count, 1)
+
+    def test_write_database(self):
+        """
+        Tests that objects are upserted on the database that the router picks for writes.
+        """
+        with patch('smart_manager.upsert.router.db_for_write', return_value=connection.alias) as mock_db_for_write:
+            self.assertIsNone(native_upsert_obj(UniqueUpsertModel, {'char_field': 'a', 'int_field': 1}))
+        mock_db_for_write.assert_called_once_with(UniqueUpsertModel)
+
+    def get_native_upsert(self, updates=None):
+        return NativeUpsert(
+            UniqueUpsertModel, connection, get_conflict_fields(UniqueUpsertModel, ('char_field', 'int_field')),
+            updates=updates, lookups={'char_field': 'a', 'int_field': 1})
+
+    def test_postgres_sql(self):
+        native_upsert = self.get_native_upsert(updates={'float_field': 1.5})
+        sql, params = native_upsert.get_postgres_sql()
+        self.assertEquals(sql, (
+            'WITH upserted AS (INSERT INTO "tests_uniqueupsertmodel" ("char_field", "int_field", "float_field") '
+            'VALUES (%s, %s, %s) ON CONFLICT ("char_field", "int_field") DO UPDATE SET "float_field" = '
+            'EXCLUDED."float_field" WHERE "tests_uniqueupsertmodel"."float_field" IS DISTINCT FROM '
+            'EXCLUDED."float_field" RETURNING {0}, ("tests_uniqueupsertmodel".xmax = 0) AS created) '
+            'SELECT upserted.*, TRUE FROM upserted UNION ALL SELECT {0}, FALSE, FALSE FROM "tests_uniqueupsertmodel" '
+            'WHERE "tests_uniqueupsertmodel"."char_field" = %s AND "tests_uniqueupsertmodel"."int_field" = %s '
+            'AND NOT EXISTS (SELECT 1 FROM upserted)'
+        ).format(native_upsert.returning))
+        self.assertEquals(params, ['a', 1, 1.5, 'a', 1])
+
+    def test_postgres_sql_no_updates(self):
+        sql, params = self.get_native_upsert().get_postgres_sql()
+        self.assertIn('ON CONFLICT ("char_field", "int_field") DO NOTHING RETURNING', sql)
+        self.assertEquals(params, ['a', 1, None, 'a', 1])
+
+    def test_postgres_execute(self):
+        """
+        Tests loading the rows returned by the PostgreSQL statement, which returns whether the object was created
+        and whether it was written.
+        """
+        model_obj = UniqueUpsertModel.objects.create(char_field='a', int_field=1, float_field=1.5)
+        native_upsert = self.get_native_upsert()
+
+        for created, written, expected in ((True, True, (True, False)), (False, True, (False, True)), (
+            False, False, (False, False)
+        )):
+            with patch.object(connection, 'vendor', 'postgresql'), patch.object(
+                native_upsert, 'get_postgres_sql', return_value=(
+                    'SELECT {0}, %s, %s FROM "tests_uniqueupsertmodel"'.format(native_upsert.returning),
+                    [created, written])
+            ):
+                upserted_obj, was_created, was_updated = native_upsert.execute()
+
+            self.assertEquals((upserted_obj.id, upserted_obj.float_field), (model_obj.id, 1.5))
+            self.assertEquals((was_created, was_updated), expected)
+
+    def test_load(self):
+        """
+        Tests that returned rows are converted with the converters of the backend.
+        """
+        native_upsert = self.get_native_upsert()
+        with patch.object(connection.ops, 'get_db_converters', return_value=[
+            lambda value, expression, connection: value * 2
+        ]):
+            model_obj = native_upsert.load((1, 'a', 2, 1.5))
+
+        self.assertEquals((model_obj.id, model_obj.char_field, model_obj.int_field, model_obj.float_field), (
+            2, 'aa', 4, 3.0))
+        self.assertFalse(model_obj._state.adding)
+
+    def test_postgres_execute_no_row(self):
+        """
+        Tests that no object is returned when a row inserted by a concurrent transaction could not be read.
+        """
+        native_upsert = self.get_native_upsert()
+        with patch.object(connection, 'vendor', 'postgresql'), patch.object(
+            native_upsert, 'get_postgres_sql', return_value=('SELECT 1 WHERE 1 = 0', [])
+        ):
+            self.assertIsNone(native_upsert.execute())
+
+
+class NativeUpsertSmartManagerTest(TestCase):
+    """
+    Tests building objects with native upserts.
+    """
+    def assertBuilds(self):
+        """
+        Builds, updates and rebuilds an object and checks the object and the recorded stats of every build.
+        """
+        collector = InMemoryCollector()
+        add_collector(collector)
+        self.addCleanup(remove_collector, collector)
+
+        smart_manager = SmartManager.objects.create(
+            smart_manager_class='smart_manager.tests.smart_managers.NativeUpsertSmartManager',
+            template={'char_field': 'a', 'int_field': 1, 'float_field': 1.5})
+        model_obj = UniqueUpsertModel.objects.get()
+        self.assertEquals(model_obj.float_field, 1.5)
+        self.assertEquals(set(smart_manager.smartmanagerobject_set.values_list('model_obj_id', flat=True)), {
+            model_obj.id})
+
+        smart_manager.template = {'char_field': 'a', 'int_field': 1, 'float_field': 2.5}
+        smart_manager.save()
+        self.assertEquals(UniqueUpsertModel.objects.get().float_field, 2.5)
+
+        smart_manager.save(force_rebuild=True)
+        self.assertEquals(UniqueUpsertModel.objects.get().id, model_obj.id)
+        self.assertEquals(
+            [vars(stats.models['tests.UniqueUpsertModel']) for stats in collector.stats], [
+                {'num_created': 1, 'num_updated': 0, 'num_unchanged': 0},
+                {'num_created': 0, 'num_updated': 1, 'num_unchanged': 0},
+                {'num_created': 0, 'num_updated': 0, 'num_unchanged': 1},
+            ])
+
+    def test_build_fallback(self):
+        """
+        Tests that objects are upserted with upsert_obj on databases that do not support native upserts.
+        """
+        with patch('smart_manager.upsert.supports_native_upsert', return_value=False), patch(
+            'smart_manager.upsert.NativeUpsert.execute'
+        ) as mock_execute:
+            self.assertBuilds()
+        self.assertFalse(mock_execute.called)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Native upserts are only supported on PostgreSQL')
+    def test_build_postgres(self):
+        """
+        Tests that objects are upserted with the native statement on PostgreSQL.
+        """
+        with patch('smart_manager.base.upsert_obj') as mock_upsert_obj:
+            self.assertBuilds()
+        self.assertFalse(mock_upsert_obj.called)
+
+    def test_build_native(self):
+        """
+        Tests that objects upserted natively are recorded like other built objects.
+        """
+        model_obj = UniqueUpsertModel.objects.create(char_field='a', int_field=1, float_field=1.5)
+        with patch('smart_manager.base.native_upsert_obj', return_value=(model_obj, False, True)) as mock_upsert:
+            smart_manager = SmartManager.objects.create(
+                smart_manager_class='smart_manager.tests.smart_managers.NativeUpsertSmartManager',
+                template={'char_field': 'a', 'int_field': 1, 'float_field': 2.5})
+
+        mock_upsert.assert_called_once_with(
+            UniqueUpsertModel, {'char_field': 'a', 'int_field': 1}, updates={'float_field': 2.5}, defaults=None)
+        self.assertEquals(list(smart_manager.smartmanagerobject_set.values_list('model_obj_id', flat=True)), [
+            model_obj.id])
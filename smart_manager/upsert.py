@@ -0,0 +1,176 @@
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections, router
+
+try:
+    from django.db.models import UniqueConstraint
+except ImportError:  # pragma: no cover
+    # Django versions before 2.2 only have unique fields and unique_together
+    UniqueConstraint = None
+
+
+def supports_native_upsert(connection):
+    """
+    Returns True if the database of the connection can upsert an object with a single statement that also tells
+    whether the object was created, updated or left unchanged. Only PostgreSQL can.
+    """
+    return connection.vendor == 'postgresql'
+
+
+@lru_cache(maxsize=None)
+def get_conflict_fields(model_class, lookup_names):
+    """
+    Returns the fields of the lookups if they are exactly the fields of a unique constraint of the model, or None
+    if they are not. The database can only resolve conflicts on the fields of a unique constraint.
+    """
+    opts = model_class._meta
+    # The fields of multi-table inheritance children are spread over several tables
+    if opts.parents:
+        return None
+
+    try:
+        fields = tuple(opts.get_field(name) for name in lookup_names)
+    except FieldDoesNotExist:
+        return None
+    if not all(field.concrete for field in fields):
+        return None
+
+    unique_sets = [{field.name} for field in opts.local_concrete_fields if field.unique]
+    unique_sets.extend(set(unique_together) for unique_together in opts.unique_together)
+    if UniqueConstraint is not None:
+        unique_sets.extend(
+            set(constraint.fields) for constraint in getattr(opts, 'constraints', [])
+            if isinstance(constraint, UniqueConstraint) and constraint.condition is None
+        )
+    return fields if {field.name for field in fields} in unique_sets else None
+
+
+class NativeUpsert(object):
+    """
+    Builds the statements of a native upsert of one object. The object is inserted with the values of the
+    lookups, defaults and updates. If an object with the same lookups exists, the fields of the updates are
+    set on it instead.
+    """
+    def __init__(self, model_class, connection, conflict_fields, updates=None, defaults=None, lookups=None):
+        self.model_class = model_class
+        self.connection = connection
+        self.conflict_fields = conflict_fields
+
+        opts = model_class._meta
+        init_kwargs = dict(defaults or {})
+        init_kwargs.update(updates or {})
+        init_kwargs.update(lookups or {})
+        model_obj = model_class(**init_kwargs)
+
+        # An auto incremented pk is left to the database unless it was given
+        self.insert_fields = [
+            field for field in opts.local_concrete_fields
+            if field is not opts.auto_field or getattr(model_obj, field.attname) is not None
+        ]
+        self.insert_params = [
+            field.get_db_prep_save(field.pre_save(model_obj, True), connection) for field in self.insert_fields
+        ]
+        self.update_fields = [opts.get_field(field_name) for field_name in (updates or {})]
+        self.lookup_params = [
+            field.get_db_prep_save(getattr(model_obj, field.attname), connection) for field in conflict_fields
+        ]
+
+        self.table = self.quote_name(opts.db_table)
+        self.returning = ', '.join(
+            '{0}.{1}'.format(self.table, self.quote_name(field.column)) for field in opts.concrete_fields)
+
+    def quote_name(self, name):
+        return self.connection.ops.quote_name(name)
+
+    def get_columns(self, fields):
+        return ', '.join(self.quote_name(field.column) for field in fields)
+
+    def get_insert_sql(self):
+        """
+        Returns the INSERT ... ON CONFLICT statement and its params. The fields of the updates are set on
+        conflicting rows in which any of them differ, and other conflicting rows are left alone.
+        """
+        sql = 'INSERT INTO {0} ({1}) VALUES ({2}) ON CONFLICT ({3}) '.format(
+            self.table, self.get_columns(self.insert_fields), ', '.join(['%s'] * len(self.insert_fields)),
+            self.get_columns(self.conflict_fields))
+        if not self.update_fields:
+            return sql + 'DO NOTHING', list(self.insert_params)
+
+        columns = [self.quote_name(field.column) for field in self.update_fields]
+        sql += 'DO UPDATE SET {0} WHERE {1}'.format(
+            ', '.join('{0} = EXCLUDED.{0}'.format(column) for column in columns),
+            ' OR '.join(
+                '{0}.{1} IS DISTINCT FROM EXCLUDED.{1}'.format(self.table, column) for column in columns))
+        return sql, list(self.insert_params)
+
+    def get_lookup_sql(self):
+        return ' AND '.join(
+            '{0}.{1} = %s'.format(self.table, self.quote_name(field.column)) for field in self.conflict_fields)
+
+    def get_postgres_sql(self):
+        """
+        Returns a statement that upserts the object and returns its row along with whether it was created and
+        whether it was written. The xmax system column of a row is 0 when the row was inserted by the statement.
+        Conflicting rows that do not need updating are not written, so they are read in the same statement.
+        """
+        insert_sql, params = self.get_insert_sql()
+        sql = (
+            'WITH upserted AS ({0} RETURNING {1}, ({2}.xmax = 0) AS created) '
+            'SELECT upserted.*, TRUE FROM upserted '
+            'UNION ALL SELECT {1}, FALSE, FALSE FROM {2} WHERE {3} AND NOT EXISTS (SELECT 1 FROM upserted)'
+        ).format(insert_sql, self.returning, self.table, self.get_lookup_sql())
+        return sql, params + self.lookup_params
+
+    def load(self, row):
+        """
+        Loads a returned row into a model object, converting the values like a queryset does.
+        """
+        values = []
+        for field, value in zip(self.model_class._meta.concrete_fields, row):
+            col = field.get_col(self.model_class._meta.db_table)
+            for converter in self.connection.ops.get_db_converters(col) + col.get_db_converters(self.connection):
+                value = converter(value, col, self.connection)
+            values.append(value)
+
+        return self.model_class.from_db(
+            self.connection.alias, [field.attname for field in self.model_class._meta.concrete_fields], values)
+
+    def execute(self):
+        """
+        Executes the upsert. Returns the object and whether it was created or updated, or None if the object
+        could not be upserted with a single statement.
+        """
+        sql, params = self.get_postgres_sql()
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+        if row is None:
+            return None
+
+        num_fields = len(self.model_class._meta.concrete_fields)
+        created, written = row[num_fields:]
+        return self.load(row[:num_fields]), created, written and not created
+
+
+def native_upsert_obj(model_class, lookups, updates=None, defaults=None):
+    """
+    Upserts an object with a single INSERT ... ON CONFLICT statement. The lookups must be the fields of a unique
+    constraint of the model. The object is upserted on the database that the router picks for writes to the
+    model. Returns the object and whether it was created or updated, or None if the object cannot be upserted
+    natively, in which case it should be upserted with upsert_obj.
+
+    Objects are only upserted natively on PostgreSQL. SQLite cannot tell created, updated and unchanged rows
+    apart in a single statement, so a native upsert would take more statements than upsert_obj there.
+    """
+    connection = connections[router.db_for_write(model_class)]
+    if not supports_native_upsert(connection) or any(value is None for value in lookups.values()):
+        return None
+
+    conflict_fields = get_conflict_fields(model_class, tuple(sorted(lookups)))
+    if conflict_fields is None:
+        return None
+
+    return NativeUpsert(
+        model_class, connection, conflict_fields, updates=updates, defaults=defaults, lookups=lookups
+    ).execute()
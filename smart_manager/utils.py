@@ -0,0 +1,47 @@
+import inspect
+
+from django.db import connections, models
+from django.db.models.query import QuerySet
+from manager_utils import bulk_update as manager_utils_bulk_update
+
+
+def get_class_path(sm_class):
+    """
+    Returns the path used to load a smart manager class.
+    """
+    return '{0}.{1}'.format(inspect.getmodule(sm_class).__name__, sm_class.__name__)
+
+
+def can_return_pks_from_bulk_insert(using):
+    """
+    Returns True if the database returns the pks of bulk inserted rows.
+    """
+    features = connections[using].features
+    return getattr(
+        features, 'can_return_rows_from_bulk_insert', getattr(features, 'can_return_ids_from_bulk_insert', False))
+
+
+def bulk_create(model_class, model_objs, batch_size=None):
+    """
+    Bulk creates model objects and makes sure that every object receives its pk. On databases that do not return
+    the pks of bulk inserted rows, the objects are inserted one at a time without calling overridden save methods.
+    """
+    using = model_class.objects.db
+    if can_return_pks_from_bulk_insert(using):
+        model_class.objects.bulk_create(model_objs, batch_size=batch_size)
+    else:
+        for model_obj in model_objs:
+            models.Model.save(model_obj, force_insert=True, using=using)
+
+    return model_objs
+
+
+def bulk_update(model_class, model_objs, field_names):
+    """
+    Updates the fields of model objects. Django's bulk_update is used when it is available. It is called on a
+    plain queryset since managers like the ManagerUtilsManager have their own bulk_update.
+    """
+    if hasattr(QuerySet, 'bulk_update'):
+        QuerySet(model_class, using=model_class.objects.db).bulk_update(model_objs, field_names)
+    else:  # pragma: no cover
+        manager_utils_bulk_update(model_class.objects, model_objs, field_names)